@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import gzip
+import lzma
+import time
+import shutil
+import argparse
+import tempfile
+
+import gen_perfile
+import perfinput
+import parse_perfile
+
+# Compress a file with gzip or xz. Return the path of the compressed file.
+#
+def compress_file(perfile, kind):
+    compressed_file = perfile + (".gz" if kind == "gzip" else ".xz")
+    opener = gzip.open if kind == "gzip" else lzma.open
+    with open(perfile, "rb") as src, opener(compressed_file, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    return compressed_file
+
+# Decompress a compressed file without parsing it. Return the seconds.
+#
+def time_decompress(compressed_file):
+    start_time = time.perf_counter()
+    with perfinput.open_decompressed(compressed_file, perfinput.compression(compressed_file)) as fh:
+        while(fh.read(1 << 20)):
+            pass
+    return time.perf_counter() - start_time
+
+# Parse a performance output file without showing the test runs. Return (seconds, lines, test runs).
+# A compressed file is parsed serially, like parse_perfile.py does.
+#
+def time_parse(perfile, jobs=1):
+    if(perfinput.compression(perfile) is not None):
+        jobs = 1
+    line_count = [0]
+    def count_lines(fh):
+        for line in fh:
+            line_count[0] += 1
+            yield line
+
+    if(jobs > 1):
+        with open(perfile) as fh:
+            for line in count_lines(fh):
+                pass
+
+    start_time = time.perf_counter()
+    run_count = 0
+    if(jobs > 1):
+        for run in parse_perfile.parse_test_runs_parallel(perfile, jobs):
+            run_count += 1
+    else:
+        with perfinput.open_perfile(perfile) as fh:
+            for run in parse_perfile.parse_test_runs(count_lines(fh)):
+                run_count += 1
+    return (time.perf_counter() - start_time, line_count[0], run_count)
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', required=False, help='Comma separated file sizes in megabytes. Default is 1,100,1000',
+                        dest='sizes', type=str, default='1,100,1000')
+    parser.add_argument('-d', '--dir', required=False, help='Directory of the synthetic files. Default is the temporary directory',
+                        dest='dir', type=str, default=tempfile.gettempdir())
+    parser.add_argument('-j', '--jobs', required=False, help='Number of worker processes of the parser. Default is 1',
+                        dest='jobs', type=int, default=1)
+    parser.add_argument('-c', '--compression', required=False, help='Compress the files with gzip or xz, and also time the decompression alone',
+                        dest='compression', type=str, choices=['gzip', 'xz'], default=None)
+    parser.add_argument('-k', '--keep', required=False, help='Keep the synthetic files', dest='keep', action='store_true')
+    args = parser.parse_args(argv)
+
+    sizes = [float(size) for size in args.sizes.split(',')]
+    print('%-10s %14s %12s %14s %10s' % ('size(MB)', 'lines', 'seconds', 'lines/sec', 'MB/sec') +
+          ('%16s' % 'decompress(s)' if args.compression else ''))
+    for size in sizes:
+        perfile = os.path.join(args.dir, 'bench_perfile_%gMB.log' % size)
+        if( not os.path.exists(perfile) ):
+            gen_perfile.gen_perfile(perfile, size)
+        parsed_file = perfile
+        try:
+            mb = os.path.getsize(perfile) / (1024.0 * 1024.0)
+            decompress = ''
+            if(args.compression):
+                parsed_file = compress_file(perfile, args.compression)
+                decompress = '%16.2f' % time_decompress(parsed_file)
+            (seconds, line_count, run_count) = time_parse(parsed_file, args.jobs)
+            print('%-10g %14d %12.2f %14.0f %10.1f' % (size, line_count, seconds, line_count / seconds, mb / seconds) + decompress)
+        finally:
+            if( not args.keep ):
+                os.remove(perfile)
+                if(parsed_file != perfile):
+                    os.remove(parsed_file)
+    return (0)
+
+if __name__ == "__main__":
+    rc = main(sys.argv[1:])
+    sys.exit(rc)
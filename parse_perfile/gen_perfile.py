@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import sys
+import random
+import argparse
+
+# the performance entry formats of a synthetic performance output file
+ENTRY_FORMATS = ["shmem_p_latency___None___size__%d___latency %f -us",
+                 "shmem_put_latency___Thread___size__%d___latency %f -us",
+                 "shmem_put_latency___Warp___size__%d___latency %f -us",
+                 "shmem_put_latency___Block___size__%d___latency %f -us",
+                 "shmem_p_bw___None___size__%d___BW %f +GB/sec",
+                 "shmem_put_bw_uni___None___size__%d___BW %f +GB/sec",
+                 "shmem_put_bw_bidi___None___size__%d___BW %f +GB/sec"]
+
+# Generate the lines of one test run: the "&&&& RUNNING" line, some output lines, one to
+# three performance test cycles marked by "&&&& PERF" and the "&&&& PASSED" or "&&&& FAILED" line.
+#
+def gen_test_run(rand, test_id):
+    test_name = "device/pt-to-pt/shmem_test_%d" % test_id
+    lines = ["&&&& RUNNING %s -n 2 -npernode 2" % test_name,
+             "Runtime options after parsing command line arguments",
+             "min_size: 4, max_size: 4096, step_factor: 2, iterations: 10"]
+    for cycle in range(rand.randint(1, 3)):
+        entry_format = rand.choice(ENTRY_FORMATS)
+        entries = [entry_format % (2 ** size, rand.uniform(0.1, 50)) for size in range(2, 13)]
+        lines.append("&&&& PERF " + entries[0])
+        lines.extend(entries[1:-1])
+        lines.append("&&&& PERF " + entries[-1])
+    result = "PASSED" if rand.random() < 0.9 else "FAILED"
+    lines.append("&&&& %s %s -n 2 -npernode 2" % (result, test_name))
+    return lines
+
+# Write a synthetic performance output file of about size_mb megabytes. Return the number of lines.
+#
+def gen_perfile(output_file, size_mb, seed=1):
+    rand = random.Random(seed)
+    size = int(size_mb * 1024 * 1024)
+    written = 0
+    line_count = 0
+    test_id = 0
+    with open(output_file, "w") as fh:
+        while(written < size):
+            lines = gen_test_run(rand, test_id)
+            block = "\n".join(lines) + "\n"
+            fh.write(block)
+            written += len(block)
+            line_count += len(lines)
+            test_id += 1
+    return line_count
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', required=True, help='Synthetic performance output file', dest='output', type=str)
+    parser.add_argument('-s', '--size', required=False, help='File size in megabytes. Default is 1', dest='size', type=float, default=1)
+    parser.add_argument('--seed', required=False, help='Random seed. Default is 1', dest='seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    line_count = gen_perfile(args.output, args.size, args.seed)
+    print("Generated %d lines in synthetic performance output file '%s'" % (line_count, args.output))
+    return (0)
+
+if __name__ == "__main__":
+    rc = main(sys.argv[1:])
+    sys.exit(rc)
@@ -1,255 +1,693 @@
 #!/usr/bin/env python3
 
+import io
+import os
 import re
 import sys
+import glob
+import json
+import mmap
+import time
+import signal
+import socket
+import subprocess
 import argparse
-
-# Extract performance latency from a line like this:
+import multiprocessing
+
+import perfcache
+import perfarrays
+import perfexport
+import perfhistory
+import perfinput
+
+# The patterns are compiled once. Every line is classified with a prefix check first, and
+# only the lines that can match are searched with a pattern.
+# search for string like "&&&& RUNNING device/pt-to-pt/shmem_p_latency -n 2 -npernode 2"
+RUNNING_PATTERN = re.compile(r'^&&&& RUNNING(\s+)(\S+)')
+PERF_PATTERN = re.compile(r'&&&& PERF(\s*)')
+UNIT_PATTERN = re.compile(r"^(\+)|(\-)")
+LATENCY_SIZE_PATTERN = re.compile(r'size(_+)(\d+)(_+)latency')
+SCOPE_PATTERNS = [("thread", "Thread", re.compile(r"(\S+)Thread(_+)size(\S+)latency")),
+                  ("warp", "Warp", re.compile(r"(\S+)Warp(_+)size(\S+)latency")),
+                  ("block", "Block", re.compile(r"(\S+)Block(_+)size(\S+)latency"))]
+
+# the kinds of performance entries in the order they are shown, and whether the highest
+# (throughput) or the lowest (latency) entry is the best
+PERF_KINDS = [("latency", False), ("throughput", True), ("thread", False), ("warp", False),
+              ("block", False), ("uni", True), ("bidi", True)]
+PERF_TITLES = {"latency": "latency", "throughput": "throughput", "thread": "thread latency", "warp": "warp latency",
+               "block": "block latency", "uni": "uni throughput", "bidi": "bidi throughput"}
+HIGHEST_BEST = dict(PERF_KINDS)
+
+# Extract the byte size and the performance latency from a line like this:
 # "shmem_p_latency___None___size__256___latency 3.95264 -us"
+# Return (size, latency), or (None, None) if the line has no byte size.
 #
-def extract_latency(line_list):
+def extract_size_latency(line_list):
     perf_name = line_list[0]
     
     # perf_name is in this format: "shmem_p_latency___None___size__256___latency"
-    pattern = r'size(_+)(\d+)(_+)latency'
-    res = re.search(pattern, perf_name)
+    res = LATENCY_SIZE_PATTERN.search(perf_name)
     if(res is None):
-        return None
-    size = float(res.group(2)) # get the byte size for example 4,8,16...etc.
+        return (None, None)
+    size = int(res.group(2)) # get the byte size for example 4,8,16...etc.
 
     # run time is in this format: "3.95264 -us"
     val = float(line_list[1])
     val = float(val/size)  # divide the run time by the byte size
     val = round(val, 6)
 
-    return val
+    return (size, val)
+
+# Extract performance latency from a line like this:
+# "shmem_p_latency___None___size__256___latency 3.95264 -us"
+#
+def extract_latency(line_list):
+    return extract_size_latency(line_list)[1]
+
+# Classify a stripped performance output line. Return (kind, perf_name, value, unit, size)
+# where kind is one of PERF_KINDS, or None if the line is not a valid performance entry. The
+# byte size is only parsed for the latency entries, where it is needed for the value, and
+# is None otherwise.
+# A perfmance output line is in this format: "shmem_put_latency___Thread___size__256___latency 6.31296 -us"
+#
+def classify_entry(line):
+    if("&&&& PERF" in line):
+        line = PERF_PATTERN.sub("", line)
+    # the above will remove the "&&&& PERF " from this performance output line
+    # &&&& PERF shmem_put_latency___Thread___size__4___latency 4.20352 -us
+
+    tmp_line = line.split()
+    if( len(tmp_line)!=3 ): # every performance line should have three columns: perf_run_detail, run_time and unit
+        return None
+
+    perf_name = tmp_line[0]
+    unit = tmp_line[2]
+    if(unit[:1] == "+" or "-" in unit):
+        unit = UNIT_PATTERN.sub("", unit)  # for unit like "+GB/sec" or "-us", remove the leading "+" or "-"
+
+    # for uni throughput entry, perf_name is in this format: "shmem_put_bw_uni___None___size__1024___BW"
+    if("_uni___" in perf_name):
+        return ("uni", perf_name, float(tmp_line[1]), unit, None)
+
+    # for bidi throughput entry, perf_name is in this format: "shmem_put_bw_bidi___None___size__1024___BW"
+    if("_bidi___" in perf_name):
+        return ("bidi", perf_name, float(tmp_line[1]), unit, None)
+
+    # for Thread, Warp and Block latency entry, perf_name is in this format: "shmem_put_latency___Thread___size__256___latency"
+    for (kind, scope, pattern) in SCOPE_PATTERNS:
+        if(scope in perf_name and pattern.search(perf_name) is not None):
+            (size, val) = extract_size_latency(tmp_line)
+            if(val is None):   # did not get a valid latency
+                return None
+            return (kind, perf_name, val, unit, size)
+
+    # for any other latency performance entry, it is in this format: "shmem_p_latency___None___size__4___latency"
+    if(perf_name.endswith("_latency")):
+        (size, val) = extract_size_latency(tmp_line)
+        if(val is None):
+            return None
+        return ("latency", perf_name, val, unit, size)
+
+    # for any other throughput performance entry, it is in this format: "shmem_p_bw___None___size__1024___BW 0.232831 +GB/sec"
+    if(unit.endswith("GB/sec")):
+        return ("throughput", perf_name, float(tmp_line[1]), unit, None)
+    return None
+
+# The performance details of one performance section that starts and ends with "&&&& PERF".
+# This includes either latency or throughput detail. For throughput, it can differentiate
+# between uni/bidi. For latency, it can differentiate among thread/warp/block. The lines are
+# added one by one, so the section is never kept in memory. With the columns of the full
+# resolution mode, every entry is also added to the columns.
+#
+class perf_stats:
+    def __init__(self, columns=None, test_index=None, cycle=None):
+        self.best = {}    # kind -> (perf_name, value, unit) of the best entry
+        self.columns = columns
+        self.test_index = test_index
+        self.cycle = cycle
+
+    # add a stripped performance output line
+    def add_line(self, line):
+        entry = classify_entry(line)
+        if(entry is None):
+            return
+        (kind, perf_name, val, unit, size) = entry
+        if(self.columns is not None):
+            self.columns.add_entry(self.test_index, self.cycle, PERF_TITLES[kind], perf_name, val, unit, size)
+        best = self.best.get(kind)
+        if( best is None or (val > best[1] if HIGHEST_BEST[kind] else val < best[1]) ):
+            self.best[kind] = (perf_name, val, unit)
+
+    # the best entries as a dictionary that can be stored as JSON, and back
+    def to_dict(self):
+        return dict([(kind, list(entry)) for (kind, entry) in self.best.items()])
+
+    @classmethod
+    def from_dict(cls, best):
+        stats = cls()
+        stats.best = dict([(kind, tuple(entry)) for (kind, entry) in best.items()])
+        return stats
+
+    def show(self):
+        column_width = 50
+        for (kind, highest) in PERF_KINDS:
+            if(kind in self.best):
+                (perf_name, val, unit) = self.best[kind]
+                title = PERF_TITLES[kind]
+                outline = ("\t\t %s test best performance:" % title).ljust(column_width) + perf_name.ljust(column_width) + "\n"
+                outline = outline + ("\t\t %s test result:" % title).ljust(column_width) + ("{:.6f} {}".format(val, unit)).ljust(column_width)
+                print(outline)
+
+        print("-"*120)
 
 # For each performance section that starts and ends with "&&&& PERF", get this section's
-# performance details. This includes either latency or throughput detail. For throughput, this
-# function can differentiate between uni/bidi. For latency, this function can differentiate 
-# among thread/warp/block.
+# performance details.
 #
 def get_perf_details(perf_section):
-    uni, bidi = {}, {} 
-    thread, warp, block = {}, {}, {}
-    latency, throughput = {}, {}
-
+    stats = perf_stats()
     for line in perf_section:
-        # a perfmance output line is in this format: "shmem_put_latency___Thread___size__256___latency 6.31296 -us"
+        stats.add_line(line.strip())
+    stats.show()
+
+# The state of one test run. In the performance output file, each test run is marked by
+# "&&&& RUNNING...". The lines after it are added one by one: the test result (PASSED or
+# FAILED) is taken from the last "&&&& <result> <test_name>" line, and the lines from one
+# "&&&& PERF" line to the next are one performance section. With the columns of the full
+# resolution mode, the test run and all its performance entries are added to the columns.
+#
+class test_run:
+    def __init__(self, test_name, columns=None):
+        self.test_name = test_name
+        self.test_result = "Not found"
+        self.perf = None       # the open performance section
+        self.perf_list = []    # the closed performance sections
+        self.columns = columns
+        if(columns is not None):
+            self.test_index = columns.add_test(test_name)
+
+    # add a stripped line of the test run
+    def add_line(self, line):
+        if(line[:4] == "&&&&"):
+            # search for string like "&&&& PASSED device/pt-to-pt/shmem_p_latency -n 2 -npernode 2"
+            columns = line.split(None, 2)
+            if( len(columns) == 3 and columns[0] == "&&&&" and columns[2].startswith(self.test_name) ):
+                self.test_result = columns[1]
+                if(self.columns is not None):
+                    self.columns.test_results[self.test_index] = columns[1]
+
+            if(line[:9] == "&&&& PERF"):
+                if(self.perf is None):
+                    if(self.columns is not None):
+                        self.perf_start = len(self.columns)
+                        self.perf = perf_stats(self.columns, self.test_index, len(self.perf_list))
+                    else:
+                        self.perf = perf_stats()
+                    self.perf.add_line(line)
+                else:
+                    self.perf.add_line(line)
+                    self.perf_list.append(self.perf)
+                    self.perf = None
+                return
+
+        if(self.perf is not None):
+            self.perf.add_line(line)
+
+    # the test run ends. The entries of an unclosed performance section are dropped from the columns.
+    def close(self):
+        if(self.perf is not None and self.columns is not None):
+            self.columns.truncate(self.perf_start)
+        self.perf = None
+
+    # the summary rows of the machine readable output: one row per closed performance section
+    # and category, in the order they are shown
+    def summary_rows(self):
+        for (cycle, perf) in enumerate(self.perf_list):
+            for (kind, highest) in PERF_KINDS:
+                if(kind in perf.best):
+                    (perf_name, val, unit) = perf.best[kind]
+                    yield (self.test_name, self.test_result, cycle, PERF_TITLES[kind], perf_name, val, unit)
+
+    # the test run as a dictionary that can be stored as JSON, and back
+    def to_dict(self):
+        return {"test_name": self.test_name, "test_result": self.test_result,
+                "perf": [perf.to_dict() for perf in self.perf_list]}
+
+    @classmethod
+    def from_dict(cls, run_dict):
+        run = cls(run_dict["test_name"])
+        run.test_result = run_dict["test_result"]
+        run.perf_list = [perf_stats.from_dict(best) for best in run_dict["perf"]]
+        return run
+
+    def show(self):
+        print("Test Name: \t %s" % self.test_name)
+        print("Test Result: \t %s" % self.test_result)
+        for perf in self.perf_list:
+            perf.show()
+
+# For each test run, get its test performance results.
+#
+def get_test_result(test_name, test_section):
+    run = test_run(test_name)
+    for i in range(1, len(test_section)):
+        run.add_line(test_section[i].strip())
+    run.show()
 
+# Read the performance output lines one by one and yield every test run as soon as its
+# section ends, at the next "&&&& RUNNING..." line or at the end of the lines. Only the
+# running test and the best entries of its performance sections are kept in memory. With
+# the columns of the full resolution mode, all the performance entries are added to them.
+#
+def parse_test_runs(lines, columns=None):
+    run = None
+    for line in lines:
         line = line.strip()
-        pattern = r'&&&& PERF(\s*)'
-        res = re.search(pattern, line)
-        if(res is not None):
-            line = re.sub(pattern, "", line)
-        # the above will remove the "&&&& PERF " from this performance output line
-        # &&&& PERF shmem_put_latency___Thread___size__4___latency 4.20352 -us
-
-        #print(line)
-        tmp_line = line.split()
-        if( len(tmp_line)!=3 ): # every performance line should have three columns: perf_run_detail, run_time and unit
-            continue
-
-        perf_name = tmp_line[0]
-        unit = re.sub(r"^(\+)|(\-)", "", tmp_line[2])  # for unit like "+GB/sec" or "-us", remove the leading "+" or "-"
-
-        # for uni throughput entry, perf_name is in this format: "shmem_put_bw_uni___None___size__1024___BW"
-        if("_uni___" in perf_name):            
-            val = float(tmp_line[1])
-            if(len(uni) == 0):
-                uni["perf_name"] = perf_name
-                uni["val"] = val
-                uni["unit"] = unit
-            elif(val > uni["val"]):
-                uni["perf_name"] = perf_name
-                uni["val"] = val
-                uni["unit"] = unit
-            continue
-
-        # for bidi throughput entry, perf_name is in this format: "shmem_put_bw_bidi___None___size__1024___BW"
-        if("_bidi___" in perf_name):
-            val = float(tmp_line[1])
-            if(len(bidi) ==0):
-                bidi["perf_name"] = perf_name
-                bidi["val"] = val
-                bidi["unit"] = unit
-            elif(val > bidi["val"]):
-                bidi["perf_name"] = perf_name
-                bidi["val"] = val
-                bidi["unit"] = unit
-            continue
+        if(line[:12] == "&&&& RUNNING"):
+            res = RUNNING_PATTERN.search(line)
+            if(res is not None):
+                if(run is not None):
+                    run.close()
+                    yield run
+                run = test_run(res.group(2), columns)
+                continue
+        if(run is not None):
+            run.add_line(line)
+
+    if(run is not None):
+        run.close()
+        yield run    # the last test run ends at the end of the file
+
+# Find the chunks of a mapped performance output file for the parallel parsing. Every chunk
+# but the first one starts at the beginning of a "&&&& RUNNING" line, so no test run is split
+# between two chunks. Return the list of (start, end) byte offsets in file order.
+#
+def find_chunks(data, chunk_count):
+    size = len(data)
+    offsets = [0]
+    for i in range(1, chunk_count):
+        pos = max(size * i // chunk_count, offsets[-1] + 1)
+        while(pos < size):
+            idx = data.find(b"&&&& RUNNING", pos)
+            if(idx < 0):
+                pos = size
+                break
+            pos = idx + 1
+            line_start = max(data.rfind(b"\n", 0, idx), data.rfind(b"\r", 0, idx)) + 1
+            if(line_start <= offsets[-1]):
+                continue
+            line_end = data.find(b"\n", idx)
+            if(line_end < 0):
+                line_end = size
+            # the line must be a test run line, for example only spaces may be in front of "&&&& RUNNING"
+            line = data[line_start:line_end].decode(errors="replace").strip()
+            if(line[:12] == "&&&& RUNNING" and RUNNING_PATTERN.search(line) is not None):
+                offsets.append(line_start)
+                break
+        if(pos >= size):
+            break
+    offsets.append(size)
+    return [(offsets[i], offsets[i+1]) for i in range(len(offsets)-1)]
+
+# Parse one chunk of a performance output file in a worker process. Only the chunk is read
+# from the mapped file. Return the list of test runs of the chunk.
+#
+def parse_chunk(chunk):
+    (input_file, start, end) = chunk
+    with open(input_file, "rb") as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            text = io.TextIOWrapper(io.BytesIO(data[start:end]))
+            return list(parse_test_runs(text))
+
+# Parse the performance output file in jobs worker processes. The file is split into chunks
+# on the "&&&& RUNNING" lines, and the test runs of the chunks are yielded in file order.
+#
+def parse_test_runs_parallel(input_file, jobs):
+    with open(input_file, "rb") as fh:
+        if(fh.seek(0, io.SEEK_END) == 0):
+            return      # an empty file has no test run, and it can not be mapped
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunks = find_chunks(data, jobs * 4)   # more chunks than jobs to keep the workers busy
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for runs in pool.imap(parse_chunk, [(input_file, start, end) for (start, end) in chunks]):
+            for run in runs:
+                yield run
+    finally:
+        pool.terminate()
+
+# Get test performance results from the user provided file. With more than one job, the
+# file is parsed in chunks by a pool of worker processes, unless it is compressed and can
+# only be read as a stream.
+#
+def get_test_performance(input_file, jobs=1):
+    try:
+        if( jobs > 1 and perfinput.compression(input_file) is None ):
+            for run in parse_test_runs_parallel(input_file, jobs):
+                run.show()
+        else:
+            with perfinput.open_perfile(input_file) as fh:
+                for run in parse_test_runs(fh):
+                    run.show()
+    except FileNotFoundError as e:
+        print("File not found:", str(e))
+        sys.exit(1)
+    except IOError as e:
+        print("An IOError occurred:", str(e))
+        sys.exit(1)
+    except Exception as e:
+        print("An exception occurred:", str(e))
+        sys.exit(1)
 
-        # for Thread latency entry, perf_name is in this format: "shmem_put_latency___Thread___size__256___latency"
-        pattern = r"(\S+)Thread(_+)size(\S+)latency"
-        res = re.search(pattern, perf_name)
-        if(res is not None):            
-            val = extract_latency(tmp_line)
-            if(val is None):
-                continue   
-            # did not get a valid latency
-
-            if(len(thread) == 0):
-                thread["perf_name"] = perf_name
-                thread["val"] = val
-                thread["unit"] = unit
-            elif(val < thread["val"]):
-                thread["perf_name"] = perf_name
-                thread["val"] = val
-                thread["unit"] = unit
-            continue
+# Get the full resolution results from the user provided file: every performance entry is
+# extracted into columns, and the per category minimum and maximum, the percentiles and the
+# per size curves are computed with NumPy.
+#
+def get_full_performance(input_file):
+    try:
+        perfarrays.import_numpy()    # fail before the file is parsed
+        columns = perfarrays.perf_columns()
+        with perfinput.open_perfile(input_file) as fh:
+            for run in parse_test_runs(fh, columns):
+                pass
+        perfarrays.show_full(columns)
+    except ImportError as e:
+        print("An ImportError occurred:", str(e))
+        sys.exit(1)
+    except FileNotFoundError as e:
+        print("File not found:", str(e))
+        sys.exit(1)
+    except IOError as e:
+        print("An IOError occurred:", str(e))
+        sys.exit(1)
+    except Exception as e:
+        print("An exception occurred:", str(e))
+        sys.exit(1)
 
-        # for Warp latency entry, perf_name is in this format: "shmem_put_latency___Warp___size__4___latency"
-        pattern = r"(\S+)Warp(_+)size(\S+)latency"
-        res = re.search(pattern, perf_name)
-        if(res is not None):            
-            val = extract_latency(tmp_line)
-            if(val is None):
-                continue   
-            # did not get a valid latency
-
-            if(len(warp) == 0):
-                warp["perf_name"] = perf_name
-                warp["val"] = val
-                warp["unit"] = unit
-            elif(val < warp["val"]):
-                warp["perf_name"] = perf_name
-                warp["val"] = val
-                warp["unit"] = unit
-            continue
-        
-        # for Block latency entry, perf_name is in this format: "shmem_put_latency___Block___size__4___latency"
-        pattern = r"(\S+)Block(_+)size(\S+)latency"
-        res = re.search(pattern, perf_name)
-        if(res is not None):            
-            val = extract_latency(tmp_line)
-            if(val is None):
-                continue   
-            # did not get a valid latency
-
-            if(len(block) == 0):
-                block["perf_name"] = perf_name
-                block["val"] = val
-                block["unit"] = unit
-            elif(val < block["val"] ):
-                block["perf_name"] = perf_name
-                block["val"] = val
-                block["unit"] = unit
-            continue
+# Write the results of the user provided file in a machine readable format: the best entries
+# of every performance section, or with data "entries" every performance entry. The rows are
+# written test run by test run, so the results are never kept in memory.
+#
+def export_test_performance(input_file, output_format, data, output=None):
+    try:
+        columns = perfarrays.perf_columns() if data == "entries" else None
+        writer = perfexport.open_writer(output_format, output,
+                                        perfexport.ENTRY_COLUMNS if data == "entries" else perfexport.SUMMARY_COLUMNS)
+        try:
+            with perfinput.open_perfile(input_file) as fh:
+                for run in parse_test_runs(fh, columns):
+                    if(columns is None):
+                        for row in run.summary_rows():
+                            writer.write(row)
+                    else:
+                        for row in columns.rows():
+                            writer.write(row)
+                        columns.truncate(0)    # the entries of this test run are written
+        finally:
+            writer.close()
+    except ImportError as e:
+        print("An ImportError occurred:", str(e))
+        sys.exit(1)
+    except FileNotFoundError as e:
+        print("File not found:", str(e))
+        sys.exit(1)
+    except IOError as e:
+        print("An IOError occurred:", str(e))
+        sys.exit(1)
+    except Exception as e:
+        print("An exception occurred:", str(e))
+        sys.exit(1)
 
-        # for any other latency performance entry, it is in this format: "shmem_p_latency___None___size__4___latency"
-        pattern = r"(_+)latency$"
-        res = re.search(pattern, perf_name)
-        if(res is not None):            
-            val = extract_latency(tmp_line)
-            if(val is None):
-                continue   
-            # did not get a valid latency
-
-            if(len(latency) == 0):
-                latency["perf_name"] = perf_name
-                latency["val"] = val
-                latency["unit"] = unit
-            elif(val < latency["val"]):
-                latency["perf_name"] = perf_name
-                latency["val"] = val
-                latency["unit"] = unit
-            continue
+# Follow a performance output file that is still growing. The lines are read as they are
+# written, and a test run is shown as soon as its test result line is seen, and again when
+# it changes before the next "&&&& RUNNING" line. The byte offset of the "&&&& RUNNING" line
+# of the open test run is saved in a checkpoint file, so a restarted follower only parses the
+# open test run again, and does not show it again if it is unchanged.
+#
+class perf_follower:
+    def __init__(self, input_file, checkpoint_file=None):
+        self.input_file = input_file
+        self.checkpoint_file = checkpoint_file
+        self.reset()
+
+    def reset(self):
+        self.run = None
+        self.run_offset = 0       # byte offset of the "&&&& RUNNING" line of the open test run
+        self.shown = None         # (test result, number of performance sections) of the open test run when it was shown
+        self.resume_shown = None  # the shown state of the open test run in the checkpoint
+        self.saved_time = 0
+
+    # the identity of the followed file, to tell a new file with the same name
+    def file_id(self):
+        stat = os.stat(self.input_file)
+        return [stat.st_dev, stat.st_ino]
+
+    # restore the byte offset from the checkpoint file. Return the offset to read from.
+    def load_checkpoint(self):
+        if( self.checkpoint_file is None or not os.path.exists(self.checkpoint_file) ):
+            return 0
+        with open(self.checkpoint_file) as fh:
+            checkpoint = json.load(fh)
+        if( checkpoint.get("file_id") != self.file_id() or os.path.getsize(self.input_file) < checkpoint["offset"] ):
+            print("Checkpoint file '%s' does not match '%s', following from the beginning" % (self.checkpoint_file, self.input_file))
+            return 0
+        self.run_offset = checkpoint["offset"]
+        self.resume_shown = tuple(checkpoint["shown"]) if checkpoint["shown"] is not None else None
+        return self.run_offset
+
+    # save the checkpoint file, at most once per second unless force is set
+    def save_checkpoint(self, force=False):
+        if( self.checkpoint_file is None or (not force and time.time() - self.saved_time < 1.0) ):
+            return
+        checkpoint = {"file": os.path.abspath(self.input_file), "file_id": self.file_id(), "offset": self.run_offset,
+                      "shown": list(self.shown) if self.shown is not None else None}
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, "w") as fh:
+            json.dump(checkpoint, fh)
+        os.replace(tmp_file, self.checkpoint_file)    # a reader never sees a partial checkpoint
+        self.saved_time = time.time()
+
+    # show the open test run if its test result is known and it changed since it was shown
+    def show_run(self, closing=False):
+        run = self.run
+        if(run is None):
+            return
+        state = (run.test_result, len(run.perf_list))
+        if( state != self.shown and (closing or run.test_result != "Not found") ):
+            run.show()
+            sys.stdout.flush()
+            self.shown = state
+
+    # the open test run ends: it is shown if it changed since it was shown
+    def close_run(self):
+        if(self.run is not None):
+            self.run.close()
+            self.show_run(True)
+            self.end_run(self.run)
+
+    # called for every test run that ends
+    def end_run(self, run):
+        pass
+
+    # add a line that starts at the byte offset line_offset
+    def add_line(self, line, line_offset):
+        line = line.strip()
+        if(line[:12] == "&&&& RUNNING"):
+            res = RUNNING_PATTERN.search(line)
+            if(res is not None):
+                self.close_run()
+                self.run = test_run(res.group(2))
+                self.shown = None
+                if(line_offset == self.run_offset and self.resume_shown is not None):
+                    self.shown = self.resume_shown    # the test run was shown before the restart
+                self.resume_shown = None
+                self.run_offset = line_offset
+                self.save_checkpoint()
+                return
+        if(self.run is not None):
+            self.run.add_line(line)
+            if(line[:4] == "&&&&"):
+                self.show_run()
+
+    # Follow the file until it has not grown for idle_timeout seconds (0 follows it until the
+    # follower is interrupted). The open test run is shown when the file stops growing, but not
+    # when the follower is interrupted. A last line without its end of line may still be
+    # written, so it is not parsed: the checkpoint resumes at the open test run, and the
+    # restarted follower parses the line once it is complete.
+    def follow(self, interval=1.0, idle_timeout=0):
+        offset = self.load_checkpoint()
+        pending = b""      # the last line, until its end is written
+        idle = 0.0
+        fh = open(self.input_file, "rb")
+        try:
+            fh.seek(offset)
+            while(True):
+                data = fh.read(1 << 20)
+                if(data):
+                    idle = 0.0
+                    lines = (pending + data).split(b"\n")
+                    pending = lines.pop()
+                    for line in lines:
+                        self.add_line(line.decode(errors="replace"), offset)
+                        offset += len(line) + 1
+                    continue
+
+                if(os.path.getsize(self.input_file) < offset + len(pending)):
+                    # the file is truncated or replaced: follow the new content from the beginning
+                    print("Performance results file '%s' is truncated, following from the beginning" % self.input_file)
+                    fh.close()
+                    fh = open(self.input_file, "rb")
+                    self.reset()
+                    (offset, pending) = (0, b"")
+                    continue
+                self.save_checkpoint(True)
+                if( idle_timeout > 0 and idle >= idle_timeout ):
+                    break
+                time.sleep(interval)
+                idle += interval
+        except KeyboardInterrupt:
+            # the open test run is not shown, the restarted follower parses it again
+            self.save_checkpoint(True)
+            return
+        finally:
+            fh.close()
+
+        self.close_run()
+        self.save_checkpoint(True)
+
+# Follow the user provided file while it is growing, and show every test run as soon as
+# it ends.
+#
+def follow_test_performance(input_file, checkpoint_file=None, interval=1.0, idle_timeout=0):
+    try:
+        if(perfinput.compression(input_file) is not None):
+            print("Compressed performance results file '%s' can not be followed" % input_file)
+            sys.exit(1)
+        perf_follower(input_file, checkpoint_file).follow(interval, idle_timeout)
+    except FileNotFoundError as e:
+        print("File not found:", str(e))
+        sys.exit(1)
+    except IOError as e:
+        print("An IOError occurred:", str(e))
+        sys.exit(1)
+    except Exception as e:
+        print("An exception occurred:", str(e))
+        sys.exit(1)
 
-        # for any other throughput performance entry, it is in this format: "shmem_p_bw___None___size__1024___BW 0.232831 +GB/sec"
-        pattern = r"GB/sec$"
-        res = re.search(pattern, unit)
-        if(res is not None):
-            val = float(tmp_line[1])
-            if(len(throughput) ==0):
-                throughput["perf_name"] = perf_name
-                throughput["val"] = val
-                throughput["unit"] = unit
-            elif(val > throughput["val"]):
-                throughput["perf_name"] = perf_name
-                throughput["val"] = val
-                throughput["unit"] = unit
-            continue
+# The follower of the output of a benchmark command. Every test run is shown as soon as it
+# ends, like with --follow, and the failed tests and the best entries of all the test runs
+# are kept for the checks after the command ends.
+#
+class exec_follower(perf_follower):
+    def __init__(self):
+        perf_follower.__init__(self, None)
+        self.test_count = 0
+        self.failed_tests = []
+        self.rows = []      # the summary rows of all the test runs
+
+    def end_run(self, run):
+        self.test_count += 1
+        if(run.test_result == "FAILED"):
+            self.failed_tests.append(run.test_name)
+        self.rows.extend(run.summary_rows())
+
+# Stop a command and the processes it started. Return its exit code.
+#
+def stop_command(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except (AttributeError, ProcessLookupError):    # no process groups, or the command has ended
+        proc.terminate()
+    return proc.wait()
+
+# Run a benchmark command and parse its standard output while it is running. The raw output
+# is also written to tee_file if it is given, compressed by its extension. With baseline run
+# IDs, the best entries are compared with the baseline runs of the run history, and with a
+# run ID they are stored in it. Return 1 if the command fails, a test FAILED or a result is
+# worse than the baseline by more than threshold percent.
+#
+def exec_test_performance(command, tee_file=None, history_file=None, baseline_ids=None, threshold=5.0,
+                          run_id=None, commit_id='', host=''):
+    if(baseline_ids is None):
+        baseline_ids = []
+    follower = exec_follower()
+    try:
+        tee = perfinput.open_compressed_output(tee_file) if tee_file else None
+        # the command runs in its own process group, so all of its processes can be stopped
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, start_new_session=True)
+    except ImportError as e:
+        print("An ImportError occurred:", str(e))
+        sys.exit(1)
+    except Exception as e:
+        print("An exception occurred:", str(e))
+        sys.exit(1)
 
-    column_width = 50
-    if(len(latency) > 0):
-        outline = "\t\t latency test best performance:".ljust(column_width) + latency["perf_name"].ljust(column_width) + "\n"
-        outline = outline + "\t\t latency test result:".ljust(column_width) + ("{:.6f} {}".format(latency["val"], latency["unit"])).ljust(column_width)
-        print(outline)
-
-    if(len(throughput) > 0):
-        outline = "\t\t throughput test best performance:".ljust(column_width) + throughput["perf_name"].ljust(column_width) + "\n"
-        outline = outline + "\t\t throughput test result:".ljust(column_width) + ("{:.6f} {}".format(throughput["val"], throughput["unit"])).ljust(column_width)
-        print(outline)
-
-    if(len(thread) > 0):
-        outline = "\t\t thread latency test best performance:".ljust(column_width) + thread["perf_name"].ljust(column_width) + "\n"
-        outline = outline + "\t\t thread latency test result:".ljust(column_width) + ("{:.6f} {}".format(thread["val"], thread["unit"])).ljust(column_width)
-        print(outline)
-
-    if(len(warp) > 0):
-        outline = "\t\t warp latency test best performance:".ljust(column_width) + warp["perf_name"].ljust(column_width) + "\n"
-        outline = outline + "\t\t warp latency test result:".ljust(column_width) + ("{:.6f} {}".format(warp["val"], warp["unit"])).ljust(column_width)
-        print(outline)
-
-    if(len(block) > 0):
-        outline = "\t\t block latency test best performance:".ljust(column_width) + block["perf_name"].ljust(column_width) + "\n"
-        outline = outline + "\t\t block latency test result:".ljust(column_width) + ("{:.6f} {}".format(block["val"], block["unit"])).ljust(column_width)
-        print(outline)
-
-    if(len(uni) > 0):
-        outline = "\t\t uni throughput test best performance:".ljust(column_width) + uni["perf_name"].ljust(column_width) + "\n"
-        outline = outline + "\t\t uni throughput test result:".ljust(column_width) + ("{:.6f} {}".format(uni["val"], uni["unit"])).ljust(column_width)
-        print(outline)
-
-    if(len(bidi) > 0):
-        outline = "\t\t bidi throughput test best performance:".ljust(column_width) + bidi["perf_name"].ljust(column_width) + "\n"
-        outline = outline + "\t\t bidi throughput test result:".ljust(column_width) + ("{:.6f} {}".format(bidi["val"], bidi["unit"])).ljust(column_width)
-        print(outline)
+    try:
+        for line in iter(proc.stdout.readline, b""):
+            if(tee is not None):
+                tee.write(line)
+            follower.add_line(line.decode(errors="replace"), 0)
+        command_rc = proc.wait()
+    except KeyboardInterrupt:
+        command_rc = stop_command(proc)
+    except Exception as e:
+        # the command is not left running without a reader
+        print("An exception occurred:", str(e))
+        stop_command(proc)
+        if(tee is not None):
+            try:
+                tee.close()
+            except Exception:
+                pass    # the tee file has failed already
+            tee = None
+        sys.exit(1)
+    finally:
+        proc.stdout.close()
+        if(tee is not None):
+            tee.close()
+    follower.close_run()
 
     print("-"*120)
-    
-# For each test run, get its test performance results. 
-# In the performance output file, each test run is marked by "&&&& RUNNING..."
-#
-def get_test_result(test_name, test_section):
-    test_result = "Not found"
-    
-    for i in range(1, len(test_section)):
-        line = test_section[i].strip()
-        pattern = r'^&&&&(\s+)(\S+)(\s+)%s' % test_name
-            # search for string like "&&&& PASSED device/pt-to-pt/shmem_p_latency -n 2 -npernode 2"
-        
-        res = re.search(pattern, line)
-        if(res is not None):
-            result = res.group(2)
-            test_result = result
-
-    print("Test Name: \t %s" % test_name)
-    print("Test Result: \t %s" % test_result)
-    # get the test result(PASSED or FAILED) for this particular test_name
-
-    start_index, end_index = None, None
-    for i in range(len(test_section)):
-        line = test_section[i].strip()
-        pattern = r'^&&&& PERF'
-        res = re.search(pattern, line)
-        if(res is not None):
-            if(start_index is None):
-                start_index = i
-            else:
-                end_index = i
-                perf_section = test_section[start_index:end_index+1]
-
-                get_perf_details(perf_section)
-
-                start_index = None       
-
-# Get test performance results from the user provided file
+    print("Command exit code: \t %d" % command_rc)
+    print("Test runs: \t %d, failed: %d" % (follower.test_count, len(follower.failed_tests)))
+    for test_name in follower.failed_tests:
+        print("\t FAILED: \t %s" % test_name)
+    rc = 1 if( command_rc != 0 or len(follower.failed_tests) > 0 ) else 0
+
+    if( run_id is not None or len(baseline_ids) > 0 ):
+        try:
+            history = perfhistory.perf_history(history_file)
+            if(run_id is not None):
+                count = history.add_run(run_id, commit_id, host, command, follower.rows)
+                print("Stored %d results of the command as run '%s'" % (count, run_id))
+            if(len(baseline_ids) > 0):
+                missing = history.missing_runs(baseline_ids)
+                if(len(missing) > 0):
+                    print("Run not found in the run history '%s': %s" % (history_file, ", ".join(missing)))
+                    return (1)
+                print("Baseline runs: \t %s" % ", ".join(baseline_ids))
+                (result, baseline_only, candidate_only) = history.compare_rows(baseline_ids, follower.rows, threshold)
+                if(show_comparison(result, baseline_only, candidate_only, threshold) > 0):
+                    rc = 1
+        except ImportError as e:
+            print("An ImportError occurred:", str(e))
+            return (1)
+        except Exception as e:
+            print("An exception occurred:", str(e))
+            return (1)
+    return rc
+
+# Store the best entries of the user provided file in the run history as run run_id, with
+# the commit and the host of the run.
 #
-def get_test_performance(input_file):
+def store_test_performance(input_file, history_file, run_id, commit_id, host):
     try:
-        with open(input_file) as fh:
-            file_lines = fh.readlines()
+        history = perfhistory.perf_history(history_file)
+        with perfinput.open_perfile(input_file) as fh:
+            rows = (row for run in parse_test_runs(fh) for row in run.summary_rows())
+            count = history.add_run(run_id, commit_id, host, os.path.abspath(input_file), rows)
+        print("Stored %d results of performance results file '%s' as run '%s'" % (count, input_file, run_id))
     except FileNotFoundError as e:
         print("File not found:", str(e))
         sys.exit(1)
@@ -260,37 +698,274 @@ def get_test_performance(input_file):
         print("An exception occurred:", str(e))
         sys.exit(1)
 
-    start_index = None
-    prev_test_name = None
+# Compare the candidate runs with the baseline runs of the run history, and show the
+# regressions beyond threshold percent (with details, all the matched results). Return 1 if
+# there is a regression.
+#
+def compare_test_performance(history_file, baseline_ids, candidate_ids, threshold, details=False):
+    try:
+        history = perfhistory.perf_history(history_file)
+        missing = history.missing_runs(baseline_ids + candidate_ids)
+        if(len(missing) > 0):
+            print("Run not found in the run history '%s': %s" % (history_file, ", ".join(missing)))
+            return (1)
+        (result, baseline_only, candidate_only) = history.compare(baseline_ids, candidate_ids, threshold)
+    except ImportError as e:
+        print("An ImportError occurred:", str(e))
+        sys.exit(1)
+    except Exception as e:
+        print("An exception occurred:", str(e))
+        sys.exit(1)
+
+    print("Baseline runs: \t %s" % ", ".join(baseline_ids))
+    print("Candidate runs: \t %s" % ", ".join(candidate_ids))
+    regression_count = show_comparison(result, baseline_only, candidate_only, threshold, details)
+    return (1 if regression_count > 0 else 0)
 
-    for i in range(len(file_lines)):
-        pattern = r'^&&&& RUNNING(\s+)(\S+)'
-            # search for string like "&&&& RUNNING device/pt-to-pt/shmem_p_latency -n 2 -npernode 2"
-        line = file_lines[i].strip()
-        res = re.search(pattern, line)
-        if(res is not None):
-            test_name = res.group(2)
-            if(start_index is None):
-                start_index = i                
-            else:
-                end_index = i
-                test_section = file_lines[start_index:end_index]
-                # get the test_section that starts as "&&&& RUNNING..." and ends as "&&&& PASSED..." 
+# Show the result of a run comparison: the regressions, or with details all the compared
+# results, and the numbers of compared results, regressions and improvements. Return the
+# number of regressions.
+#
+def show_comparison(result, baseline_only, candidate_only, threshold, details=False):
+    column_width = 50
+    print("-"*120)
+    print("Test name and category".ljust(column_width) + "Baseline".ljust(20) + "Candidate".ljust(20) + "Change".ljust(12) + "Status")
+    regression_count = int(result["regression"].sum())
+    improvement_count = int(result["improvement"].sum())
+    if(details):
+        shown = range(len(result["tests"]))
+    else:
+        shown = result["regression"].nonzero()[0]
+    last_test = None
+    for i in shown:
+        (test_name, cycle, category) = (result["tests"][i], result["cycles"][i], result["categories"][i])
+        status = "REGRESSION" if result["regression"][i] else ("improvement" if result["improvement"][i] else "")
+        if( (test_name, cycle) != last_test ):
+            print("%s (cycle %d)" % (test_name, cycle))
+            last_test = (test_name, cycle)
+        print(("\t\t %s" % category).ljust(column_width) + ("{:.6f} {}".format(result["baseline"][i], result["units"][i])).ljust(20) +
+              ("{:.6f} {}".format(result["candidate"][i], result["units"][i])).ljust(20) + ("{:+.2f}%".format(result["change"][i])).ljust(12) + status)
+    print("-"*120)
+    print("Compared results: %d, regressions: %d, improvements: %d (threshold %.2f%%)" %
+          (len(result["tests"]), regression_count, improvement_count, threshold))
+    if( baseline_only > 0 or candidate_only > 0 ):
+        print("Results only in the baseline runs: %d, only in the candidate runs: %d" % (baseline_only, candidate_only))
+    return regression_count
+
+# Find the performance output files of a directory, searched recursively, or of a glob
+# pattern like "logs/**/*.log". Return the file paths in sorted order.
+#
+def find_perfiles(perfdir):
+    if(os.path.isdir(perfdir)):
+        paths = [os.path.join(root, name) for (root, dirs, names) in os.walk(perfdir) for name in names]
+    else:
+        paths = glob.glob(perfdir, recursive=True)
+    return sorted([path for path in paths if os.path.isfile(path)])
+
+# Hash a performance output file in a worker process. Return (path, content hash, error).
+#
+def hash_perfile(path):
+    try:
+        return (path, perfcache.file_hash(path), None)
+    except Exception as e:
+        return (path, None, str(e))
 
-                get_test_result(prev_test_name, test_section)      
+# Parse a performance output file in a worker process. Return (path, list of test run
+# dictionaries, error).
+#
+def parse_perfile_runs(path):
+    try:
+        with perfinput.open_perfile(path) as fh:
+            return (path, [run.to_dict() for run in parse_test_runs(fh)], None)
+    except Exception as e:
+        return (path, None, str(e))
 
-                start_index = end_index
-            prev_test_name = test_name
+# Show the combined summary of the batch mode: the number of tests, passed tests and failed
+# tests of every file, the totals and the failed tests.
+#
+def show_batch_summary(paths, results, errors):
+    column_width = 70
+    print("-"*120)
+    print("Performance results file".ljust(column_width) + "Tests".ljust(10) + "Passed".ljust(10) + "Failed".ljust(10) + "Not found".ljust(10))
+    totals = [0, 0, 0, 0]
+    failed_tests = []
+    for path in paths:
+        if(path in errors):
+            print(path.ljust(column_width) + "error: %s" % errors[path])
+            continue
+        runs = results[path]
+        counts = [len(runs), 0, 0, 0]
+        for run in runs:
+            if(run["test_result"] == "PASSED"):
+                counts[1] += 1
+            elif(run["test_result"] == "FAILED"):
+                counts[2] += 1
+                failed_tests.append((path, run["test_name"]))
+            elif(run["test_result"] == "Not found"):
+                counts[3] += 1
+        totals = [totals[i] + counts[i] for i in range(4)]
+        print(path.ljust(column_width) + "".join([str(count).ljust(10) for count in counts]))
+    print("Total".ljust(column_width) + "".join([str(count).ljust(10) for count in totals]))
+
+    if(len(failed_tests) > 0):
+        print("-"*120)
+        print("Failed tests:")
+        for (path, test_name) in failed_tests:
+            print("\t %s: \t %s" % (path, test_name))
+
+# Get test performance results from all the performance output files of a directory or a
+# glob pattern. The files are parsed by a pool of worker processes. With a cache file, the
+# parsed test runs are cached by file path, size, modification time and content hash, and
+# only the new or changed files are parsed again.
+#
+def get_batch_performance(perfdir, jobs, cache_file=None, details=False):
+    paths = find_perfiles(perfdir)
+    if(cache_file):
+        # the cache file can be in the searched directory
+        cache_path = os.path.abspath(cache_file)
+        paths = [path for path in paths if os.path.abspath(path) not in (cache_path, cache_path + "-journal")]
+    if(len(paths) == 0):
+        print("No performance results file found in '%s'" % perfdir)
+        return (1)
+
+    results = {}    # path -> list of test run dictionaries
+    errors = {}     # path -> error message
+    file_stats = {}
+    changed = []
+    cache = perfcache.perf_cache(cache_file) if cache_file else None
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            errors[path] = str(e)
+            continue
+        file_stats[path] = (stat.st_size, stat.st_mtime)
+        runs = cache.lookup_file(path, stat.st_size, stat.st_mtime) if cache else None
+        if(runs is None):
+            changed.append(path)
+        else:
+            results[path] = runs
+
+    pool = multiprocessing.Pool(jobs) if jobs > 1 and len(changed) > 1 else None
+    imap = pool.imap_unordered if pool else map
+    try:
+        hashes = {}
+        parse_paths = changed
+        if(cache is not None):
+            # a changed file whose content is already known is not parsed again
+            parse_paths = []
+            for (path, content_hash, error) in imap(hash_perfile, changed):
+                if(error is not None):
+                    errors[path] = error
+                    continue
+                hashes[path] = content_hash
+                runs = cache.lookup_hash(content_hash)
+                if(runs is None):
+                    parse_paths.append(path)
+                else:
+                    results[path] = runs
+                    cache.store(path, file_stats[path][0], file_stats[path][1], content_hash)
+
+        for (path, runs, error) in imap(parse_perfile_runs, parse_paths):
+            if(error is not None):
+                errors[path] = error
+                continue
+            results[path] = runs
+            if(cache is not None):
+                cache.store(path, file_stats[path][0], file_stats[path][1], hashes[path], runs)
+    finally:
+        if(pool is not None):
+            pool.terminate()
+        if(cache is not None):
+            cache.close()
+
+    parsed_count = len([path for path in parse_paths if path in results])
+    print("Performance results files: %d, parsed: %d, cached: %d, errors: %d" %
+          (len(paths), parsed_count, len(results) - parsed_count, len(errors)))
+    if(details):
+        for path in paths:
+            if(path in results):
+                print("Performance results file: \t %s" % path)
+                for run_dict in results[path]:
+                    test_run.from_dict(run_dict).show()
+    show_batch_summary(paths, results, errors)
+    return (1 if len(errors) > 0 else 0)
 
 def main(argv):
     parser = argparse.ArgumentParser()
-    parser.add_argument('-f', '--perfile', required=True, help='Performance results file', dest='perfile', type=str)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-f', '--perfile', help='Performance results file', dest='perfile', type=str)
+    group.add_argument('-d', '--perfdir', help='Directory or glob pattern of performance results files', dest='perfdir', type=str)
+    group.add_argument('--exec', help='Run the benchmark command and parse its output while it is running', dest='exec_command', type=str)
+    group.add_argument('--compare', help='Compare the --candidate runs with the --baseline runs of the run history', dest='compare', action='store_true')
+    parser.add_argument('-j', '--jobs', required=False, help='Number of worker processes. Default is 1 for a file and the number of CPUs for a directory',
+                        dest='jobs', type=int, default=None)
+    parser.add_argument('--cache', required=False, help='Result cache file of the directory mode. Default is ~/.parse_perfile_cache.db',
+                        dest='cache', type=str, default=os.path.join(os.path.expanduser("~"), ".parse_perfile_cache.db"))
+    parser.add_argument('--no-cache', required=False, help='Do not use the result cache', dest='no_cache', action='store_true')
+    parser.add_argument('--full', required=False, help='Show the full resolution results of all the performance entries (needs NumPy)',
+                        dest='full', action='store_true')
+    parser.add_argument('--format', required=False, help='Write the results as json (JSON Lines), csv or parquet (needs pyarrow)',
+                        dest='format', type=str, choices=['json', 'csv', 'parquet'], default=None)
+    parser.add_argument('--data', required=False, help='Results written by --format: the best entries (summary) or every entry (entries). Default is summary',
+                        dest='data', type=str, choices=['summary', 'entries'], default='summary')
+    parser.add_argument('-o', '--output', required=False, help='Output file of --format. Default is the standard output', dest='output', type=str)
+    parser.add_argument('--follow', required=False, help='Follow the file while it is growing and show every test run as soon as it ends',
+                        dest='follow', action='store_true')
+    parser.add_argument('--checkpoint', required=False, help='Checkpoint file of --follow. Default is the performance results file with ".checkpoint"',
+                        dest='checkpoint', type=str, default=None)
+    parser.add_argument('--interval', required=False, help='Seconds between the checks for new lines of --follow. Default is 1',
+                        dest='interval', type=float, default=1.0)
+    parser.add_argument('--idle-timeout', required=False, help='Stop --follow after the file has not grown for this many seconds. Default is 0 (never)',
+                        dest='idle_timeout', type=float, default=0)
+    parser.add_argument('--history', required=False, help='Run history file of --store and --compare. Default is ~/.parse_perfile_history.db',
+                        dest='history', type=str, default=os.path.join(os.path.expanduser("~"), ".parse_perfile_history.db"))
+    parser.add_argument('--store', required=False, help='Store the results of the file or of --exec in the run history', dest='store', action='store_true')
+    parser.add_argument('--run-id', required=False, help='Run ID of --store. Default is the file name, or exec-<time> for --exec', dest='run_id', type=str)
+    parser.add_argument('--commit', required=False, help='Commit of the run of --store', dest='commit', type=str, default='')
+    parser.add_argument('--host', required=False, help='Host of the run of --store. Default is this host', dest='host', type=str, default=socket.gethostname())
+    parser.add_argument('--baseline', required=False, help='Baseline run IDs of --compare and --exec', dest='baseline', nargs='+', default=[])
+    parser.add_argument('--candidate', required=False, help='Candidate run IDs of --compare', dest='candidate', nargs='+', default=[])
+    parser.add_argument('--threshold', required=False, help='Regression threshold of --compare and --exec in percent. Default is 5',
+                        dest='threshold', type=float, default=5.0)
+    parser.add_argument('--tee', required=False, help='Also write the raw output of --exec to this file, compressed if it ends with .gz, .xz or .zst',
+                        dest='tee', type=str, default=None)
+    parser.add_argument('--details', required=False, help='Show the test runs of every file in the directory mode', dest='details', action='store_true')
     args = parser.parse_args()
 
+    if( args.format is not None and args.perfdir is not None ):
+        parser.error("--format needs a performance results file (-f)")
+    if(args.exec_command is not None):
+        print("Running '%s' to get performance run details" % args.exec_command)
+        sys.stdout.flush()
+        return exec_test_performance(args.exec_command, args.tee, args.history, args.baseline, args.threshold,
+                                     (args.run_id or time.strftime("exec-%Y%m%d-%H%M%S")) if args.store else None, args.commit, args.host)
+    if(args.compare):
+        if( len(args.baseline) == 0 or len(args.candidate) == 0 ):
+            parser.error("--compare needs --baseline and --candidate run IDs")
+        return compare_test_performance(args.history, args.baseline, args.candidate, args.threshold, args.details)
+    if(args.perfdir is not None):
+        print("Parsing performance results files '%s' to get performance run summary" % args.perfdir)
+        jobs = args.jobs if args.jobs is not None else (os.cpu_count() or 1)
+        return get_batch_performance(args.perfdir, jobs, None if args.no_cache else args.cache, args.details)
+
     perfile = args.perfile    
+    if(args.store):
+        store_test_performance(perfile, args.history, args.run_id or os.path.basename(perfile), args.commit, args.host)
+        return (0)
+    if(args.format is not None):
+        export_test_performance(perfile, args.format, args.data, args.output)
+        return (0)
+    if(args.follow):
+        print("Following performance results file '%s' to get performance run details" % perfile)
+        follow_test_performance(perfile, args.checkpoint or perfile + ".checkpoint", args.interval, args.idle_timeout)
+        return (0)
     print("Parsing performance results file '%s' to get performance run details" % perfile)
 
-    get_test_performance(perfile)
+    if(args.full):
+        get_full_performance(perfile)
+    else:
+        get_test_performance(perfile, args.jobs or 1)
     return (0)
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import re
+import array
+
+# The full resolution mode of parse_perfile.py. Every performance entry of every performance
+# test cycle is kept, not only the best entry, in compact columns: the test, the cycle of the
+# test, the operation (for example "shmem_put_latency"), the category (for example "thread
+# latency" or "uni throughput"), the byte size, the value and the unit. The strings are stored
+# once and referenced by code. The columns are handed to NumPy without a copy, and the per
+# category minimum and maximum, the per size curves and the percentiles are computed with
+# vectorized operations over all the entries. NumPy is only imported by the analysis, so the
+# rest of parse_perfile.py works without it.
+
+SIZE_PATTERN = re.compile(r'size(_+)(\d+)')
+
+# the percentiles shown by show_full
+PERCENTILES = (50, 90, 99)
+
+# Import NumPy on first use. The feature is named in the error if NumPy is not installed.
+#
+def import_numpy(feature="the full resolution mode"):
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("%s needs NumPy, install it with 'pip install numpy'" % feature)
+    return numpy
+
+class perf_columns:
+    # the columns, their array type codes and their NumPy types
+    COLUMNS = [("test", "q", "int64"), ("cycle", "q", "int64"), ("op", "q", "int64"), ("category", "q", "int64"),
+               ("unit", "q", "int64"), ("size", "q", "int64"), ("value", "d", "float64")]
+
+    def __init__(self):
+        self.test_names = []
+        self.test_results = []
+        self.strings = {"op": [], "category": [], "unit": []}    # the strings of the coded columns
+        self.codes = {"op": {}, "category": {}, "unit": {}}
+        self.columns = dict([(name, array.array(typecode)) for (name, typecode, dtype) in self.COLUMNS])
+
+    def __len__(self):
+        return len(self.columns["value"])
+
+    # the code of a string of a coded column
+    def code(self, column, string):
+        codes = self.codes[column]
+        if(string not in codes):
+            codes[string] = len(codes)
+            self.strings[column].append(string)
+        return codes[string]
+
+    # add a test run. Return its index.
+    def add_test(self, test_name):
+        self.test_names.append(test_name)
+        self.test_results.append("Not found")
+        return len(self.test_names) - 1
+
+    # add a performance entry. The size is parsed from the perf_name if it is not given.
+    # A perf_name is in this format: "shmem_put_latency___Thread___size__256___latency"
+    def add_entry(self, test, cycle, category, perf_name, val, unit, size=None):
+        if(size is None):
+            res = SIZE_PATTERN.search(perf_name)
+            size = int(res.group(2)) if res is not None else -1
+        columns = self.columns
+        columns["test"].append(test)
+        columns["cycle"].append(cycle)
+        columns["op"].append(self.code("op", perf_name.split("___", 1)[0]))
+        columns["category"].append(self.code("category", category))
+        columns["unit"].append(self.code("unit", unit))
+        columns["size"].append(size)
+        columns["value"].append(val)
+
+    # drop the entries from length on, for example the entries of an unclosed performance cycle
+    def truncate(self, length):
+        for column in self.columns.values():
+            del column[length:]
+
+    # the entries as rows of (test, test_result, cycle, op, category, size, value, unit)
+    def rows(self):
+        strings = self.strings
+        columns = self.columns
+        for i in range(len(self)):
+            test = columns["test"][i]
+            yield (self.test_names[test], self.test_results[test], columns["cycle"][i], strings["op"][columns["op"][i]],
+                   strings["category"][columns["category"][i]], columns["size"][i], columns["value"][i],
+                   strings["unit"][columns["unit"][i]])
+
+    # the columns as NumPy arrays that share the memory of the columns
+    def arrays(self):
+        numpy = import_numpy()
+        result = {}
+        for (name, typecode, dtype) in self.COLUMNS:
+            if(len(self.columns[name]) == 0):
+                result[name] = numpy.zeros(0, dtype=dtype)
+            else:
+                result[name] = numpy.frombuffer(self.columns[name], dtype=dtype)
+        return result
+
+# Sort the entries by the key columns, and within the groups of equal keys by the sort_last
+# column if it is given. Return (order, starts, counts) where order sorts the entries and
+# starts are the first sorted entry of every group.
+#
+def group_by(numpy, keys, sort_last=None):
+    sort_keys = keys + ([sort_last] if sort_last is not None else [])
+    order = numpy.lexsort(tuple(reversed(sort_keys)))    # the last key of lexsort is the primary key
+    count = len(order)
+    changed = numpy.zeros(count, dtype=bool)
+    if(count > 0):
+        changed[0] = True
+        for key in keys:
+            sorted_key = key[order]
+            changed[1:] |= sorted_key[1:] != sorted_key[:-1]
+    starts = numpy.flatnonzero(changed)
+    counts = numpy.diff(numpy.append(starts, count))
+    return (order, starts, counts)
+
+# The minimum, mean and maximum value and the number of entries of every group of equal
+# key columns. Return a dictionary of arrays with one element per group.
+#
+def reduce_groups(columns, key_names):
+    numpy = import_numpy()
+    cols = columns.arrays()
+    (order, starts, counts) = group_by(numpy, [cols[name] for name in key_names])
+    values = cols["value"][order]
+    result = dict([(name, cols[name][order][starts]) for name in key_names])
+    result["count"] = counts
+    if(len(starts) > 0):
+        result["min"] = numpy.minimum.reduceat(values, starts)
+        result["max"] = numpy.maximum.reduceat(values, starts)
+        result["mean"] = numpy.add.reduceat(values, starts) / counts
+    else:
+        result["min"] = result["max"] = result["mean"] = values
+    return result
+
+# The per category minimum, mean and maximum of every (op, category, unit).
+#
+def category_stats(columns):
+    return reduce_groups(columns, ["op", "category", "unit"])
+
+# The per size curves: the minimum, mean and maximum of every (op, category, unit, size).
+#
+def size_curves(columns):
+    return reduce_groups(columns, ["op", "category", "unit", "size"])
+
+# The percentiles of the values of every (op, category, unit), with linear interpolation
+# like numpy.percentile. The values are sorted within their groups by one lexsort, and the
+# percentiles of all the groups are read from the sorted values at once.
+#
+def category_percentiles(columns, percentiles=PERCENTILES):
+    numpy = import_numpy()
+    cols = columns.arrays()
+    key_names = ["op", "category", "unit"]
+    (order, starts, counts) = group_by(numpy, [cols[name] for name in key_names], cols["value"])
+    values = cols["value"][order]
+    result = dict([(name, cols[name][order][starts]) for name in key_names])
+    result["count"] = counts
+    for percentile in percentiles:
+        position = starts + (counts - 1) * (percentile / 100.0)
+        lower = numpy.floor(position).astype("int64")
+        upper = numpy.minimum(lower + 1, starts + counts - 1)
+        result["p%d" % percentile] = values[lower] + (values[upper] - values[lower]) * (position - lower)
+    return result
+
+# Show the full resolution analysis of the columns: the per category minimum and maximum,
+# the percentiles and the per size curves.
+#
+def show_full(columns):
+    column_width = 50
+    strings = columns.strings
+    print("Tests: \t %d" % len(columns.test_names))
+    print("Performance entries: \t %d" % len(columns))
+    print("-"*120)
+
+    stats = category_stats(columns)
+    percentiles = category_percentiles(columns)
+    print("Per category results:")
+    for i in range(len(stats["count"])):
+        name = "%s %s" % (strings["op"][stats["op"][i]], strings["category"][stats["category"][i]])
+        unit = strings["unit"][stats["unit"][i]]
+        outline = ("\t\t %s" % name).ljust(column_width) + ("entries: %d" % stats["count"][i]).ljust(column_width) + "\n"
+        outline = outline + "\t\t min/mean/max:".ljust(column_width) + ("{:.6f} / {:.6f} / {:.6f} {}".format(stats["min"][i], stats["mean"][i], stats["max"][i], unit))
+        outline = outline + "\n" + ("\t\t %s:" % "/".join(["p%d" % p for p in PERCENTILES])).ljust(column_width)
+        outline = outline + " / ".join(["{:.6f}".format(percentiles["p%d" % p][i]) for p in PERCENTILES]) + " " + unit
+        print(outline)
+    print("-"*120)
+
+    curves = size_curves(columns)
+    print("Per size results:")
+    for i in range(len(curves["count"])):
+        name = "%s %s" % (strings["op"][curves["op"][i]], strings["category"][curves["category"][i]])
+        unit = strings["unit"][curves["unit"][i]]
+        print(("\t\t %s size %d" % (name, curves["size"][i])).ljust(2*column_width) +
+              "{:.6f} / {:.6f} / {:.6f} {} ({} entries)".format(curves["min"][i], curves["mean"][i], curves["max"][i], unit, curves["count"][i]))
+    print("-"*120)
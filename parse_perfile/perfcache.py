@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+import hashlib
+
+# The local result cache of the batch mode of parse_perfile.py. The parsed test runs of a
+# performance output file are stored in a SQLite file by the sha256 hash of its content,
+# and every file path is stored with its size, modification time and content hash. A file
+# whose size and modification time are unchanged is not read again, and a file whose
+# content hash is already known, for example a copied or touched file, is not parsed again.
+
+# the cached test runs are dropped when the parsed results of the parser change
+CACHE_VERSION = 1
+
+# Compute the sha256 hash of the content of a file, chunk by chunk.
+#
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class perf_cache:
+    def __init__(self, cache_file):
+        self.conn = sqlite3.connect(cache_file)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (hash TEXT PRIMARY KEY, runs TEXT)")
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if( row is None or row[0] != str(CACHE_VERSION) ):
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM results")
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(CACHE_VERSION),))
+            self.conn.commit()
+
+    # the cached test runs (list of dictionaries) of an unchanged file, or None
+    def lookup_file(self, path, size, mtime):
+        row = self.conn.execute("SELECT size, mtime, hash FROM files WHERE path = ?", (path,)).fetchone()
+        if( row is None or row[0] != size or row[1] != mtime ):
+            return None
+        return self.lookup_hash(row[2])
+
+    # the cached test runs of a file content hash, or None
+    def lookup_hash(self, content_hash):
+        row = self.conn.execute("SELECT runs FROM results WHERE hash = ?", (content_hash,)).fetchone()
+        if(row is None):
+            return None
+        return json.loads(row[0])
+
+    # store the file and, if they are given, the test runs of its content hash
+    def store(self, path, size, mtime, content_hash, runs=None):
+        self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, size, mtime, content_hash))
+        if(runs is not None):
+            self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?)", (content_hash, json.dumps(runs)))
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
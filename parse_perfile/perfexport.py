@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import sys
+import csv
+import json
+
+# The machine readable output of parse_perfile.py. The result rows are written in batches
+# by a streaming writer, so the output of a huge performance output file is never kept in
+# memory: JSON Lines (one JSON object per row), CSV with a header line, or Parquet with one
+# row group per batch. The Parquet writer needs pyarrow, which is only imported when the
+# Parquet format is used.
+
+# the rows of the best entries: one row per test run, performance test cycle and category
+SUMMARY_COLUMNS = [("test", "string"), ("test_result", "string"), ("cycle", "int64"), ("category", "string"),
+                   ("perf_name", "string"), ("value", "float64"), ("unit", "string")]
+
+# the rows of every performance entry of the full resolution mode
+ENTRY_COLUMNS = [("test", "string"), ("test_result", "string"), ("cycle", "int64"), ("op", "string"),
+                 ("category", "string"), ("size", "int64"), ("value", "float64"), ("unit", "string")]
+
+# the number of rows written at once
+BATCH_ROWS = 65536
+
+class row_writer:
+    def __init__(self, output, columns, batch_rows=BATCH_ROWS):
+        self.output = output
+        self.columns = columns
+        self.names = [name for (name, type_name) in columns]
+        self.batch_rows = batch_rows
+        self.batch = []
+        self.fh = None
+
+    # open the output file, or use the standard output if there is no output file
+    def open_text(self):
+        if(self.output is None):
+            return sys.stdout
+        return open(self.output, "w", newline="", buffering=1 << 20)
+
+    def write(self, row):
+        self.batch.append(row)
+        if(len(self.batch) >= self.batch_rows):
+            self.flush()
+
+    def flush(self):
+        self.batch = []
+
+    def close(self):
+        if(len(self.batch) > 0):
+            self.flush()
+        if( self.fh is not None and self.fh is not sys.stdout ):
+            self.fh.close()
+        elif(self.fh is sys.stdout):
+            self.fh.flush()
+
+class json_writer(row_writer):
+    def __init__(self, output, columns, batch_rows=BATCH_ROWS):
+        row_writer.__init__(self, output, columns, batch_rows)
+        self.fh = self.open_text()
+
+    def flush(self):
+        self.fh.write("".join([json.dumps(dict(zip(self.names, row))) + "\n" for row in self.batch]))
+        self.batch = []
+
+class csv_writer(row_writer):
+    def __init__(self, output, columns, batch_rows=BATCH_ROWS):
+        row_writer.__init__(self, output, columns, batch_rows)
+        self.fh = self.open_text()
+        self.csv = csv.writer(self.fh)
+        self.csv.writerow(self.names)
+
+    def flush(self):
+        self.csv.writerows(self.batch)
+        self.batch = []
+
+class parquet_writer(row_writer):
+    def __init__(self, output, columns, batch_rows=BATCH_ROWS):
+        row_writer.__init__(self, output, columns, batch_rows)
+        if(output is None):
+            raise ValueError("the parquet format needs an output file")
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("the parquet format needs pyarrow, install it with 'pip install pyarrow'")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(name, getattr(pyarrow, type_name)()) for (name, type_name) in columns])
+        self.parquet = pyarrow.parquet.ParquetWriter(output, self.schema)
+
+    def flush(self):
+        arrays = [self.pyarrow.array([row[i] for row in self.batch], type=self.schema.field(i).type) for i in range(len(self.names))]
+        self.parquet.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        self.batch = []
+
+    def close(self):
+        row_writer.close(self)
+        self.parquet.close()    # an empty file still gets the schema
+
+WRITERS = {"json": json_writer, "csv": csv_writer, "parquet": parquet_writer}
+
+# Open the streaming writer of a format. The output is the output file, or None for the
+# standard output.
+#
+def open_writer(output_format, output, columns):
+    return WRITERS[output_format](output, columns)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import time
+import sqlite3
+
+import perfarrays
+
+# The run history of parse_perfile.py. The best entries of the performance output files are
+# stored in a SQLite file by run ID, with the commit and the host of the run. Every (test,
+# performance test cycle, category) is stored once with an integer key, and the results of a
+# run refer to it, so a comparison only reads integer keys and values. Two sets of runs are
+# compared by key: the values of every set are reduced to their median per key, the keys of
+# the baseline and the candidate are matched, and the relative changes and the regressions
+# beyond a threshold are computed for all the keys at once with NumPy.
+
+class perf_history:
+    def __init__(self, history_file):
+        self.conn = sqlite3.connect(history_file)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, commit_id TEXT, host TEXT, "
+                          "source TEXT, created REAL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS result_keys (key_id INTEGER PRIMARY KEY, test TEXT, cycle INTEGER, "
+                          "category TEXT, unit TEXT, higher_better INTEGER, UNIQUE (test, cycle, category))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (run_id TEXT, key_id INTEGER, test_result TEXT, "
+                          "perf_name TEXT, value REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_run_id ON results (run_id)")
+        self.key_ids = None    # (test, cycle, category) -> key_id, read on first use
+
+    # the key of (test, cycle, category), added if it is new and add is set (else None)
+    def key_id(self, test, cycle, category, unit, add=True):
+        if(self.key_ids is None):
+            self.key_ids = dict([((row[0], row[1], row[2]), row[3]) for row in
+                                 self.conn.execute("SELECT test, cycle, category, key_id FROM result_keys")])
+        key = (test, cycle, category)
+        if( key not in self.key_ids and not add ):
+            return None
+        if(key not in self.key_ids):
+            # a throughput is better when it is higher, a latency when it is lower
+            cursor = self.conn.execute("INSERT INTO result_keys (test, cycle, category, unit, higher_better) VALUES (?, ?, ?, ?, ?)",
+                                       (test, cycle, category, unit, 1 if "throughput" in category else 0))
+            self.key_ids[key] = cursor.lastrowid
+        return self.key_ids[key]
+
+    # store the summary rows (test, test_result, cycle, category, perf_name, value, unit) of a
+    # run. A run that is stored again replaces the old one. Return the number of rows.
+    def add_run(self, run_id, commit_id, host, source, rows):
+        with self.conn:
+            self.conn.execute("DELETE FROM results WHERE run_id = ?", (run_id,))
+            self.conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)", (run_id, commit_id, host, source, time.time()))
+            cursor = self.conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?)",
+                                           ((run_id, self.key_id(test, cycle, category, unit), test_result, perf_name, value)
+                                            for (test, test_result, cycle, category, perf_name, value, unit) in rows))
+            return cursor.rowcount
+
+    # the stored runs: (run_id, commit_id, host, source, created), oldest first
+    def runs(self):
+        return self.conn.execute("SELECT run_id, commit_id, host, source, created FROM runs ORDER BY created").fetchall()
+
+    # the missing run IDs of run_ids
+    def missing_runs(self, run_ids):
+        known = set([row[0] for row in self.conn.execute("SELECT run_id FROM runs WHERE run_id IN (%s)" %
+                                                         ",".join(["?"] * len(run_ids)), list(run_ids))])
+        return [run_id for run_id in run_ids if run_id not in known]
+
+    # the median value of every key of the runs. Return (key_ids, values) arrays sorted by key.
+    def run_values(self, run_ids):
+        numpy = perfarrays.import_numpy("the run comparison")
+        rows = self.conn.execute("SELECT key_id, value FROM results WHERE run_id IN (%s)" % ",".join(["?"] * len(run_ids)),
+                                 list(run_ids)).fetchall()
+        if(len(rows) == 0):
+            return (numpy.zeros(0, dtype="int64"), numpy.zeros(0))
+        rows = numpy.array(rows, dtype="float64")
+        return median_values(numpy, rows[:, 0].astype("int64"), rows[:, 1])
+
+    # the median value of every key of summary rows (test, test_result, cycle, category,
+    # perf_name, value, unit) that are not stored. The keys that are not in the run history
+    # are left out. Return (key_ids, values) arrays sorted by key.
+    def row_values(self, rows):
+        numpy = perfarrays.import_numpy("the run comparison")
+        pairs = [(self.key_id(test, cycle, category, unit, False), value)
+                 for (test, test_result, cycle, category, perf_name, value, unit) in rows]
+        pairs = [pair for pair in pairs if pair[0] is not None]
+        if(len(pairs) == 0):
+            return (numpy.zeros(0, dtype="int64"), numpy.zeros(0))
+        pairs = numpy.array(pairs, dtype="float64")
+        return median_values(numpy, pairs[:, 0].astype("int64"), pairs[:, 1])
+
+    # (test, cycle, category, unit, higher_better) arrays of the key_ids
+    def key_details(self, key_ids):
+        numpy = perfarrays.import_numpy("the run comparison")
+        details = dict([(row[0], row[1:]) for row in
+                        self.conn.execute("SELECT key_id, test, cycle, category, unit, higher_better FROM result_keys")])
+        columns = list(zip(*[details[key_id] for key_id in key_ids.tolist()])) or [[], [], [], [], []]
+        return [numpy.array(column, dtype=dtype) for (column, dtype) in zip(columns, [object, "int64", object, object, bool])]
+
+    # Compare the candidate runs with the baseline runs. A change is a regression when it is
+    # worse than threshold percent: a lower throughput or a higher latency. Return a dictionary
+    # of arrays with one element per matched key, and the numbers of unmatched keys.
+    def compare(self, baseline_ids, candidate_ids, threshold):
+        return self.compare_values(self.run_values(baseline_ids), self.run_values(candidate_ids), threshold)
+
+    # Compare the summary rows of a run that is not stored with the baseline runs, like compare.
+    def compare_rows(self, baseline_ids, rows, threshold):
+        return self.compare_values(self.run_values(baseline_ids), self.row_values(rows), threshold)
+
+    # compare the (key_ids, values) of the candidate with the (key_ids, values) of the baseline
+    def compare_values(self, baseline, candidate, threshold):
+        numpy = perfarrays.import_numpy("the run comparison")
+        (base_keys, base_values) = baseline
+        (cand_keys, cand_values) = candidate
+        (key_ids, base_index, cand_index) = numpy.intersect1d(base_keys, cand_keys, assume_unique=True, return_indices=True)
+        base = base_values[base_index]
+        cand = cand_values[cand_index]
+        (tests, cycles, categories, units, higher_better) = self.key_details(key_ids)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            change = numpy.where(base != 0, (cand - base) / numpy.abs(base) * 100.0, 0.0)
+        # the change in the better direction is positive
+        gain = numpy.where(higher_better, change, -change)
+        result = {"tests": tests, "cycles": cycles, "categories": categories, "units": units,
+                  "baseline": base, "candidate": cand, "change": change,
+                  "regression": gain < -threshold, "improvement": gain > threshold}
+        return (result, len(base_keys) - len(key_ids), len(cand_keys) - len(key_ids))
+
+# The median value of every key. Return (key_ids, values) arrays sorted by key.
+#
+def median_values(numpy, key_ids, values):
+    (order, starts, counts) = perfarrays.group_by(numpy, [key_ids], values)
+    values = values[order]
+    # the median of every group of sorted values
+    medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2.0
+    return (key_ids[order][starts], medians)
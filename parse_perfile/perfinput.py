@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import io
+import gzip
+import lzma
+import queue
+import threading
+
+# The input of parse_perfile.py. A performance output file that is compressed with gzip, xz or
+# zstd is detected by its first bytes and read as a stream, without a temporary file. The
+# decompression runs in a separate thread and hands the decompressed chunks to the line
+# parser through a bounded queue, so the decompression and the parsing overlap (the gzip,
+# xz and zstd decompressors release the GIL), and only a few chunks are kept in memory.
+# zstd needs the compression.zstd module of Python 3.14 or the zstandard package, which are
+# only imported for a zstd file.
+
+MAGIC = [("gzip", b"\x1f\x8b"), ("xz", b"\xfd7zXZ\x00"), ("zstd", b"\x28\xb5\x2f\xfd")]
+
+# the size of a decompressed chunk and the number of chunks in the queue
+CHUNK_SIZE = 1 << 20
+QUEUE_CHUNKS = 8
+
+# The compression of a file: "gzip", "xz", "zstd", or None for a file that is not compressed.
+#
+def compression(path):
+    with open(path, "rb") as fh:
+        head = fh.read(6)
+    for (name, magic) in MAGIC:
+        if(head.startswith(magic)):
+            return name
+    return None
+
+# Open the decompressed binary stream of a compressed file.
+#
+def open_decompressed(path, kind):
+    if(kind == "gzip"):
+        return gzip.open(path, "rb")
+    if(kind == "xz"):
+        return lzma.open(path, "rb")
+    try:
+        from compression import zstd      # Python 3.14 and later
+        return zstd.open(path, "rb")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("a zstd compressed file needs Python 3.14 or zstandard, install it with 'pip install zstandard'")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+# Open a binary output file that is compressed by its extension: ".gz" with gzip, ".xz" with
+# xz and ".zst" with zstd. Any other file is not compressed.
+#
+def open_compressed_output(path):
+    if(path.endswith(".gz")):
+        return gzip.open(path, "wb")
+    if(path.endswith(".xz")):
+        return lzma.open(path, "wb")
+    if(path.endswith(".zst")):
+        try:
+            from compression import zstd      # Python 3.14 and later
+            return zstd.open(path, "wb")
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("a zstd compressed file needs Python 3.14 or zstandard, install it with 'pip install zstandard'")
+        return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+    return open(path, "wb")
+
+# A binary stream whose data is read from another stream by a reader thread. The chunks are
+# passed through a bounded queue, and an error of the reader thread is raised to the reader.
+#
+class threaded_reader(io.RawIOBase):
+    def __init__(self, source, chunk_size=CHUNK_SIZE, queue_chunks=QUEUE_CHUNKS):
+        io.RawIOBase.__init__(self)
+        self.source = source
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(queue_chunks)
+        self.chunk = memoryview(b"")
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.read_source, name="perfile-decompress", daemon=True)
+        self.thread.start()
+
+    # the reader thread: read the source chunk by chunk until the end or until the reader is closed
+    def read_source(self):
+        try:
+            while(not self.stopped.is_set()):
+                chunk = self.source.read(self.chunk_size)
+                self.put(chunk)
+                if(not chunk):
+                    break
+        except Exception as e:
+            self.put(e)
+        finally:
+            self.source.close()
+
+    def put(self, item):
+        while(not self.stopped.is_set()):
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while(len(self.chunk) == 0):
+            if(self.eof):
+                return 0
+            item = self.chunks.get()
+            if(isinstance(item, Exception)):
+                self.eof = True
+                raise item
+            if(not item):
+                self.eof = True
+                return 0
+            self.chunk = memoryview(item)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def close(self):
+        if(not self.closed):
+            self.stopped.set()    # a reader thread that waits for room in the queue stops
+            self.thread.join()
+        io.RawIOBase.close(self)
+
+# Open a performance output file for reading text lines like open(). A compressed file is
+# decompressed by a reader thread.
+#
+def open_perfile(path):
+    kind = compression(path)
+    if(kind is None):
+        return open(path)
+    return io.TextIOWrapper(io.BufferedReader(threaded_reader(open_decompressed(path, kind)), CHUNK_SIZE))
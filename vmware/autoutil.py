@@ -2,8 +2,12 @@ import time
 import sys
 import os
 import re
+import json
+import atexit
+import queue
+import threading
 
-__all__ = ['build_vmname', 'writelog']
+__all__ = ['build_vmname', 'lazy_module', 'writelog', 'writeevent', 'readevents', 'flush_logs', 'start_log_queue', 'stop_log_queue', 'progress_reporter']
 
 # Build several virtual machines name based on "base_vmname" and the count.
 # The virtual machine names are saved in a list and returned to caller.
@@ -39,14 +43,199 @@ def build_vmname(base_vmname, count):
 
     return vm_list
 
+# Proxy of a module (or a module attribute like pyVmomi.vim) that is only imported when one
+# of its attributes is used for the first time, so the scripts start without loading the
+# heavy modules they may not need.
+#
+class lazy_module:
+    def __init__(self, module_name, attr_name = None):
+        self._module_name = module_name
+        self._attr_name = attr_name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            import importlib
+            module = importlib.import_module(self._module_name)
+            self._module = getattr(module, self._attr_name) if self._attr_name else module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+# Background writer that appends the queued log lines of one log file in batches. The
+# log file is kept open and every batch is written with one write call. For a durable
+# log file, every batch is also synced to disk.
+#
+class log_writer:
+    def __init__(self, logfile_name, durable = False, batch_size = 1000, flush_interval = 0.5):
+        self.logfile_name = logfile_name
+        self.durable = durable
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.line_queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='log_writer', daemon=True)
+        self.thread.start()
+
+    def write(self, line):
+        self.line_queue.put(line)
+
+    # wait until all the queued log lines are written into the log file
+    def flush(self):
+        self.line_queue.join()
+
+    def _run(self):
+        logfile = None
+        while True:
+            lines = [self.line_queue.get()]
+            try:
+                while( len(lines) < self.batch_size ):
+                    lines.append(self.line_queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+
+            try:
+                if logfile is None:
+                    logfile = open(self.logfile_name, 'a')
+                logfile.write(''.join(['%s\n' % line for line in lines]))
+                logfile.flush()
+                if(self.durable == True):
+                    os.fsync(logfile.fileno())
+            except (IOError, OSError) as error:
+                sys.stderr.write('Unable to write log file %s. Error: %s\n' % (self.logfile_name, error))
+            finally:
+                for line in lines:
+                    self.line_queue.task_done()
+
+
+_log_writers = {}
+_log_writers_lock = threading.Lock()
+
+def _get_log_writer(logfile_name, durable = False):
+    with _log_writers_lock:
+        writer = _log_writers.get(logfile_name)
+        if writer is None:
+            writer = log_writer(logfile_name, durable)
+            _log_writers[logfile_name] = writer
+        elif(durable == True):
+            writer.durable = True
+        return writer
+
+# Wait until all the queued log messages are written. This is called at script exit.
+#
+def flush_logs():
+    with _log_writers_lock:
+        writers = list(_log_writers.values())
+    for writer in writers:
+        writer.flush()
+
+atexit.register(flush_logs)
+
 # Write log message to a log file. User can specify whether to include timestamp in the log message.
+# The log message is queued and written by the background log writer of the log file.
 #
 def writelog(logfile_name, logmsg, writetime = True):
     mypid = os.getpid()
     msg = logmsg
     if(writetime == True):
         msg = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()) + ' {%s}' % sys.argv[0] + '{PID: %d} ' % mypid + logmsg
-    logfile = open(logfile_name, 'a')
-    logfile.write('%s\n' % msg)
-    logfile.close()
+    _get_log_writer(logfile_name).write(msg)
+
+# Write a structured event as one JSON line to a log file, for example
+# {"ts": 1625573421.5, "pid": 1234, "vm": "vm-001", "phase": "clone", "state": "success", "duration": 35.2}
+# The event log file is synced to disk batch by batch, so it can be used as a durable record.
+#
+def writeevent(logfile_name, **event):
+    if logfile_name is None:
+        return
+    record = {'ts': round(time.time(), 3), 'pid': os.getpid()}
+    record.update(event)
+    _get_log_writer(logfile_name, durable=True).write(json.dumps(record, default=str))
+
+# Read the structured events of a log file written by writeevent. Only the events whose
+# keys have all the values in "match" are returned, for example readevents(logfile, pid=1234).
+# The lines that are not JSON events are skipped.
+#
+def readevents(logfile_name, **match):
+    if logfile_name is None or not os.path.exists(logfile_name):
+        return []
+    with _log_writers_lock:
+        writer = _log_writers.get(logfile_name)
+    if writer is not None:
+        writer.flush()
+
+    events = []
+    with open(logfile_name) as logfile:
+        for line in logfile:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(event, dict):
+                continue
+            if all([event.get(key) == value for (key, value) in match.items()]):
+                events.append(event)
+    return events
+
+# Route the python logging records through a queue, so the logging handlers like the
+# file handler run in a background thread instead of the caller. Return the queue listener.
+#
+def start_log_queue(handlers, level):
+    import logging
+    import logging.handlers
+
+    record_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(record_queue, *handlers, respect_handler_level=True)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(logging.handlers.QueueHandler(record_queue))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+# Stop the queue listener of start_log_queue now, after the queued records are written,
+# instead of at script exit.
+#
+def stop_log_queue(listener):
+    atexit.unregister(listener.stop)
+    listener.stop()
+
+# Aggregate the per virtual machine task states of a waiting loop and log one progress
+# summary at most every "interval" seconds, instead of one log line per virtual machine
+# per poll.
+#
+class progress_reporter:
+    def __init__(self, logger, task_msg, total, interval = 60, done_states = ('success', 'error')):
+        self.logger = logger
+        self.task_msg = task_msg
+        self.total = total
+        self.interval = interval
+        self.done_states = done_states
+        self.states = {}
+        self.progress = {}
+        self.last_report = 0
+
+    def update(self, name, state, progress = None):
+        self.states[name] = state
+        if progress is not None:
+            self.progress[name] = progress
+
+    def done(self):
+        return len([state for state in self.states.values() if state in self.done_states])
+
+    def report(self, force = False):
+        if self.logger is None:    # nothing to report to
+            return
+        now = time.time()
+        if(force == False and now - self.last_report < self.interval):
+            return
+        self.last_report = now
 
+        counts = {}
+        for state in self.states.values():
+            counts[state] = counts.get(state, 0) + 1
+        detail = ', '.join(['%d %s' % (counts[state], state) for state in sorted(counts.keys())])
+        running = [self.progress[name] for name in self.progress.keys() if self.states.get(name) == 'running']
+        if( len(running) > 0 ):
+            detail = detail + ', running tasks at %d percent on average' % (sum(running) / len(running))
+        self.logger.info('%s: %d of %d done (%s)' % (self.task_msg, self.done(), self.total, detail))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python script benchmarks the per virtual machine bookkeeping of "vmwarevms.py" for
+  large deployments, without vCenter. The vms class runs against a fake vCenter backend
+  whose tasks complete at once, so only the time spent in the bookkeeping is measured:
+  building the virtual machine records, checking the static IP addresses already in use,
+  the clone task window with failed clones dropped, a task wait through property
+  collector updates, and the static IP check. Every step is run for growing numbers of
+  virtual machines and its time per virtual machine is reported. The script exits with 1
+  if the time per virtual machine of a step grows more than "-g" times (default 3) from
+  the smallest to the largest deployment, so a quadratic loop is caught in CI. Run
+  "python3 bench_scaling.py -h" for the options.
+"""
+
+import sys
+import time
+import types
+import logging
+import argparse
+import collections
+
+import vmwarevms
+
+
+# the fake vCenter objects. A task succeeds as soon as it is submitted, except the clone
+# tasks of every tenth virtual machine that fail with a permanent fault.
+#
+class _fake_obj:
+    def __init__(self, moid):
+        self._moId = moid
+
+
+class _fake_spec:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _fake_vim():
+    task_state = types.SimpleNamespace(success='success', error='error', running='running', queued='queued')
+    return types.SimpleNamespace(
+        VirtualMachine=_fake_obj, Task=_fake_obj, Folder=_fake_obj, HostSystem=_fake_obj,
+        TaskInfo=types.SimpleNamespace(State=task_state),
+        VirtualMachinePowerState=types.SimpleNamespace(poweredOn='poweredOn', poweredOff='poweredOff'),
+        vm=types.SimpleNamespace(GuestInfo=types.SimpleNamespace(ToolsStatus=types.SimpleNamespace(toolsOk='toolsOk'))))
+
+
+def _fake_vmodl():
+    return types.SimpleNamespace(query=types.SimpleNamespace(PropertyCollector=types.SimpleNamespace(
+        ObjectSpec=_fake_spec, PropertySpec=_fake_spec, FilterSpec=_fake_spec, TraversalSpec=_fake_spec, RetrieveOptions=_fake_spec)))
+
+
+class _fake_backend:
+    def __init__(self, count):
+        self.tasks = {}       # task moref -> task info
+        self.vms = {}         # vm name -> (object, {property name: property value})
+        self.next_id = 0
+        # a few IP addresses of the deployment are already used by other virtual machines
+        for i in range(0, count, 100):
+            self.add_vm('other-%05d' % i, {'guest.ipAddress': _ip(i), 'guest.net': []})
+
+    def add_vm(self, name, props):
+        self.next_id += 1
+        props = dict(props, name=name)
+        props.setdefault('guest.ipAddress', None)
+        self.vms[name] = (_fake_obj('vm-%d' % self.next_id), props)
+
+    def add_task(self, failed = False):
+        self.next_id += 1
+        task = _fake_obj('task-%d' % self.next_id)
+        error = None
+        if failed:
+            error = types.SimpleNamespace(msg='duplicate name', localizedMessage='duplicate name',
+                                          fault=types.SimpleNamespace(_wsdlName='DuplicateName'))
+        self.tasks[task._moId] = types.SimpleNamespace(state='error' if failed else 'success', error=error, progress=100,
+                                                       startTime=None, completeTime=None, queueTime=None)
+        return task
+
+    def retrieve_props(self, vimtypes, path_set, obj_list = None):
+        if( obj_list != None and len(obj_list) > 0 and obj_list[0]._moId.startswith('task-') ):
+            return [(task, {'info': self.tasks[task._moId]}) for task in obj_list]
+        if obj_list != None:
+            wanted = set([obj._moId for obj in obj_list])
+            return [(obj, props) for (obj, props) in self.vms.values() if obj._moId in wanted]
+        return list(self.vms.values())
+
+    # the property collector of wait_update_task gets all the task updates at once
+    def WaitForUpdates(self, version):
+        object_set = [types.SimpleNamespace(obj=spec.obj, changeSet=[types.SimpleNamespace(name='info.state', val='success')])
+                      for spec in self.filter_spec.objectSet]
+        return types.SimpleNamespace(filterSet=[types.SimpleNamespace(objectSet=object_set)], version=1)
+
+    def CreateFilter(self, filter_spec, partial):
+        self.filter_spec = filter_spec
+        return types.SimpleNamespace(Destroy=lambda: None)
+
+
+def _ip(i):
+    return '10.%d.%d.%d' % (i // 65536, (i // 256) % 256, i % 256)
+
+
+# run the bookkeeping steps for count virtual machines. Return {step: seconds}.
+#
+def run_steps(count):
+    vmwarevms.vim = _fake_vim()
+    vmwarevms.vmodl = _fake_vmodl()
+    backend = _fake_backend(count)
+    logger = logging.getLogger('bench_scaling')
+    times = collections.OrderedDict()
+
+    start_time = time.perf_counter()
+    vms_obj = vmwarevms.vms(base_vmname='vm-00001', count=count, logger=logger, retry_attempts=1)
+    vms_obj.set_static_ip([_ip(i) for i in range(count)], '255.255.0.0', '10.0.0.1', '10.0.0.2')
+    times['records'] = time.perf_counter() - start_time
+
+    vms_obj.connect_vc = lambda: 0
+    vms_obj.retrieve_props = backend.retrieve_props
+    vms_obj.conn_content = types.SimpleNamespace(propertyCollector=backend)
+    for limiter in vms_obj.limiters.values():
+        limiter.limit = limiter.maximum = count
+        limiter.poll_interval = lambda: 0
+
+    start_time = time.perf_counter()
+    vms_obj.check_vm_exist()
+    times['check_vm_exist'] = time.perf_counter() - start_time
+
+    failed = set(vms_obj.vm_list[::10])
+    def clone(name, folder, spec):
+        if name not in failed:
+            backend.add_vm(name, {'guest.ipAddress': vms_obj.records.get(name).ip, 'guest.net': []})
+        return backend.add_task(name in failed)
+    vms_obj.template_obj = types.SimpleNamespace(Clone=clone)
+
+    start_time = time.perf_counter()
+    vms_obj.known_vms.update(vms_obj.locate_vms(vms_obj.vm_list))
+    (rc, vm_result) = vms_obj.run_task_window(vms_obj.vm_list, vms_obj._submit_clone, 'Virtual machine cloning', 'clone', 3600)
+    vms_obj._drop_failed_vms([record.name for record in vms_obj.records if record.cloned and record.name not in vm_result])
+    vms_obj.known_vms.update(vms_obj.locate_vms(vms_obj.vm_list))
+    times['clone_window'] = time.perf_counter() - start_time
+    if( len(vms_obj.records.ips()) != len(vms_obj.records) ):
+        raise RuntimeError('the virtual machine records lose their static IP addresses')
+
+    start_time = time.perf_counter()
+    update_tasks = dict([(vm_name, backend.add_task()) for vm_name in vms_obj.vm_list])
+    vms_obj.wait_update_task(update_tasks, 'network updating', 3600)
+    times['wait_update_task'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    rc = vms_obj.check_static_ip()
+    times['check_static_ip'] = time.perf_counter() - start_time
+    if(rc != 0):
+        raise RuntimeError('the static IP check fails for %d virtual machines' % count)
+    return times
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', required=False, help='Comma separated virtual machine counts. Default is 1000,2500,5000,10000',
+                        dest='sizes', type=str, default='1000,2500,5000,10000')
+    parser.add_argument('-g', '--maxgrowth', required=False, help='Maximum growth of the time per virtual machine. Default is 3.0',
+                        dest='maxgrowth', type=float, default=3.0)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+
+    sizes = sorted([int(size) for size in args.sizes.split(',')])
+    results = collections.OrderedDict()
+    for count in sizes:
+        results[count] = run_steps(count)
+
+    steps = list(results[sizes[0]].keys())
+    print('%-18s' % 'step' + ''.join(['%14s' % ('%d VMs' % count) for count in sizes]) + '   (microseconds per VM)')
+    rc = 0
+    for step in steps:
+        per_vm = [results[count][step] / count * 1000000 for count in sizes]
+        print('%-18s' % step + ''.join(['%14.1f' % usec for usec in per_vm]))
+        # a linear step keeps its time per virtual machine; a few microseconds are below the timer noise
+        if( per_vm[-1] > max(per_vm[0], 2.0) * args.maxgrowth ):
+            print('%-18s FAILED: the time per virtual machine grows %.1f times' % ('', per_vm[-1] / per_vm[0]))
+            rc = 1
+    return rc
+
+if __name__ == "__main__":
+    rc = main(sys.argv[1:])
+    sys.exit(rc)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python script benchmarks the startup time of "vm_operation.py" for the short
+  commands that should not load pyVmomi: the help menu, and a deployment whose YAML
+  file fails the validation. Every command is run several times in a new python
+  process, and the median wall time and the slowest imported modules are reported.
+  The script exits with 1 if a command is slower than the limit or loads pyVmomi, so
+  it can be run in CI. Run "python3 bench_startup.py -h" for the options.
+"""
+
+import sys
+import os
+import re
+import time
+import argparse
+import tempfile
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# run the command in a new python process with import timing. Return (wall time, {module: cumulative microseconds})
+#
+def run_once(command):
+    start_time = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + command, cwd=SCRIPT_DIR,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start_time
+
+    imports = {}
+    for line in proc.stderr.splitlines():
+        searchObj = re.search(r'^import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)', line)
+        if searchObj:
+            imports[searchObj.group(2)] = int(searchObj.group(1))
+    return (elapsed, imports)
+
+
+def bench(name, command, runs, max_seconds):
+    times, imports = [], {}
+    for i in range(runs):
+        (elapsed, imports) = run_once(command)
+        times.append(elapsed)
+    times.sort()
+    median = times[len(times) // 2]
+
+    heavy = [module for module in imports.keys() if module.split('.')[0] in ('pyVmomi', 'pyVim', 'yaml')]
+    slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:5]
+    print('%-28s median %.3f s, min %.3f s, max %.3f s over %d runs' % (name, median, times[0], times[-1], runs))
+    print('%-28s slowest imports: %s' % ('', ', '.join(['%s %.1f ms' % (module, usec / 1000.0) for (module, usec) in slowest])))
+
+    rc = 0
+    if(median > max_seconds):
+        print('%-28s FAILED: slower than %.2f seconds' % ('', max_seconds))
+        rc = 1
+    if any([module.split('.')[0] in ('pyVmomi', 'pyVim') for module in heavy]):
+        print('%-28s FAILED: pyVmomi is loaded' % '')
+        rc = 1
+    return rc
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--runs', required=False, help='Runs per command. Default is 5', dest='runs', type=int, default=5)
+    parser.add_argument('-m', '--maxseconds', required=False, help='Maximum median startup seconds. Default is 1.0', dest='maxseconds', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    # a YAML file that fails the validation straight away
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as yaml_file:
+        yaml_file.write('VCenter:\n    vcenter_name: vcenter-FQDN\nesx_1:\n    - esx: ESXi-FQDN\n')
+    try:
+        rc = bench('vm_operation.py -h', ['vm_operation.py', '-h'], args.runs, args.maxseconds)
+        rc = bench('invalid YAML deployment', ['vm_operation.py', '-yf', yaml_file.name, '-ys', 'esx_1', '-o', os.devnull],
+                   args.runs, args.maxseconds) or rc
+    finally:
+        os.unlink(yaml_file.name)
+    return rc
+
+if __name__ == "__main__":
+    rc = main(sys.argv[1:])
+    sys.exit(rc)
@@ -16,98 +16,97 @@ import argparse
 import logging
 import re
 import time
-import yaml
+import copy
+import json
+import signal
+import os
+import concurrent.futures
 
 from autoutil import *
-from vmwarevms import vms
+from vmplan import *
+from vmwarevms import vms, disconnect_vcenters
+from vmtrace import TRACE_ENV, write_trace_report
 
-def _get_ip_from_range(ip_range, vm_ips, mylogger):
-    ip_range = ip_range.replace(" ", "")
-    if(re.search(r'-', ip_range, re.M|re.I) == None):   # search if ip is like "192.168.0.41--51"
-        vm_ips.append(ip_range)
-        return 0
+BATCH_COMMANDS = ('delete', 'power', 'snapshot', 'ips', 'push')
 
-    ip_list = re.split('-+', ip_range)      # ip_range is like "192.168.0.41--51" 
-    if(len(ip_list) != 2):                  # ip_list should be ['192.168.0.41', '51'] or ['192.168.0.41', '192.168.0.51']
-        mylogger.warning("Please provide a valid virtual machine IP address or range: %s" % ip_range)
-        return 1
-
-    start_ip = ip_list[0]
-    last_ip = ip_list[1]
-    if( len(ip_list[1]) <= 3 ):
-        last_ip = re.sub('\d+$', ip_list[1], start_ip)
-
-    from ipaddress import ip_address
-    start_int = int(ip_address(start_ip).packed.hex(), 16)
-    last_int = int(ip_address(last_ip).packed.hex(), 16)
-    tmp_ip = [ip_address(ip).exploded for ip in range(start_int, last_int + 1)]
-
-    for ip in tmp_ip:
-        vm_ips.append(ip)
-
-    return 0
-
-
-def get_vm_ip(vc_name, vc_user, vc_pw, vc_ssl_check, mylogger, vm_list):
+def get_vm_ip(vc_name, vc_user, vc_pw, vc_ssl_check, mylogger, vm_list, inventory_file = None):
     vm_ips = []
     vms_obj = vms(vc_name = vc_name, vc_user = vc_user, vc_pw = vc_pw, vc_ssl_check = vc_ssl_check, logger = mylogger)
-    vms_ips = vms_obj.get_vm_ip(vm_list)
+    vms_ips = vms_obj.get_vm_ip(vm_list, inventory_file)
     return vms_ips
 
 
-def create_from_yaml(yamlfile, yaml_section, mylogger, deplogfile):
-    vcdata = {}
-    with open(yamlfile, "r") as file_descr:
-        yaml_item = yaml.load(file_descr, Loader=yaml.FullLoader)
+# Dump all the virtual machines of the vCenter in the YAML file into the inventory snapshot file.
+# If watch is larger than 0, keep refreshing the snapshot incrementally.
+#
+def dump_inventory(yamlfile, mylogger, inventory_file, watch = 0, vcenter_name = None):
+    (rc, vcdata) = load_vcenter(yamlfile, mylogger, vcenter_name)
+    if(rc != 0):
+        return rc
+
+    vms_obj = vms(vc_name = vcdata["vcenter_name"], vc_user = vcdata["vcenter_user"], vc_pw = vcdata["vcenter_pw"],
+                  vc_ssl_check = vcdata["ssl-check"], logger = mylogger)
+    return vms_obj.dump_inventory(inventory_file, watch)
+
+
+def _build_vms(vcdata, cluster_data, mylogger, deplogfile, replica_cache = None):
+    vms_obj = vms(vc_name = vcdata["vcenter_name"], vc_user = vcdata["vcenter_user"], vc_pw = vcdata["vcenter_pw"], vc_ssl_check = vcdata["ssl-check"],
+                  base_vmname = cluster_data["base_vmname"], count = cluster_data["vm_count"], template = cluster_data["template"], vm_user = cluster_data["vm_user"],
+                  vm_password = cluster_data["vm_password"], hostname_update = vcdata["hostname_update"], data_center = vcdata["datacenter"],
+                  folder = vcdata["folder"], cluster = cluster_data["cluster"], esx = cluster_data["esx"], data_store = cluster_data["datastore"],
+                  network = cluster_data["network"], static_ip = cluster_data["static_ip"], power_on = vcdata["power_on"], snapshot_name = vcdata["snapshot_name"],
+                  logger = mylogger, tmplogfile = deplogfile, template_replica = vcdata["template_replica"], replica_cache = replica_cache,
+                  retry_attempts = vcdata["retry_attempts"], probe_ports = vcdata["probe_ports"],
+                  payload_files = cluster_data["payload_files"], payload_dest = cluster_data["payload_dest"])
+    return vms_obj
+
+
+# Check the deployment plan without deploying any virtual machine. All the user specified
+# vCenter objects are resolved, so any typo in the YAML file is reported right away.
+#
+def check_plan(yamlfile, yaml_section, mylogger, vcenter_name = None):
+    (rc, plan) = compile_plan(yamlfile, yaml_section, mylogger, vcenter_name = vcenter_name)
+    if(rc != 0):
+        return rc
+
+    vcdata = plan["vcenter"]
+    for cluster_data in plan["clusters"]:
+        ip_msg = ', '.join(cluster_data["vm_ips"]) if cluster_data["static_ip"] else 'DHCP'
+        mylogger.info("Plan: deploy %s from template %s with IP %s" % (', '.join(cluster_data["vm_list"]), cluster_data["template"], ip_msg))
+
+        vms_obj = _build_vms(vcdata, cluster_data, mylogger, None)
+        vms_obj.set_plan_inventory(plan["inventory"])
+        if(vms_obj.connect_vc() != 0 or vms_obj.resolve_objects() != 0):
+            mylogger.warning("Unable to resolve the deployment plan of YAML section %s in file %s" % (yaml_section, yamlfile))
+            return 1
+        if(update_plan_inventory(plan, vms_obj.plan_inventory) != 0):
+            save_plan(plan, mylogger)
+
+    mylogger.info("The deployment plan of YAML section %s in file %s is valid" % (yaml_section, yamlfile))
+    return 0
 
-    vcenter_items = yaml_item.get("VCenter")
-    vm_cluster = yaml_item.get(yaml_section)
 
-    for key in vcenter_items.keys():
-        vcdata[key] = vcenter_items[key]
+def create_from_yaml(yamlfile, yaml_section, mylogger, deplogfile, vcenter_name = None):
+    (rc, plan) = compile_plan(yamlfile, yaml_section, mylogger, vcenter_name = vcenter_name)
+    if(rc != 0):
+        return (rc, {})
 
-    if( vcdata["snapshot_name"] == "None" ): vcdata["snapshot_name"] = None
-    if( "hostname_update" not in vcdata.keys() ): vcdata["hostname_update"] = False
+    vcdata = copy.deepcopy(plan["vcenter"])
     vcdata["deployed_vm"] = []
 
-    base_vm = vcdata["base_vmname"]
-    for item in vm_cluster:
-        vm_ips = []
-        cluster_data = {}
-        if( re.search("-\[date\]", base_vm, re.M|re.I) != None ):
-            base_vmname = base_vm.replace("-[date]", "")
-            base_vmname = base_vmname + "-" + str(int(time.time()))
-
-        for key in item.keys():
-            value = item[key]
-            if(re.search(r'ip', key, re.M|re.I) != None ):
-                _get_ip_from_range(value, vm_ips, mylogger)
-            else:
-                cluster_data[key] = value 
-
-        static_ip = False if("dhcp" in vm_ips or "DHCP" in vm_ips) else True
-        if( "cluster" not in cluster_data.keys() ): cluster_data["cluster"] = None
-        if( "esx" not in cluster_data.keys() ): cluster_data["esx"] = None
-    
-        vms_obj = vms(vc_name = vcdata["vcenter_name"], vc_user = vcdata["vcenter_user"], vc_pw = vcdata["vcenter_pw"], vc_ssl_check = vcdata["ssl-check"],
-                      base_vmname = base_vmname, count = cluster_data["vm_count"], template = cluster_data["template"], vm_user = cluster_data["vm_user"],
-                      vm_password = cluster_data["vm_password"], hostname_update = vcdata["hostname_update"], data_center = vcdata["datacenter"],
-                      folder = vcdata["folder"], cluster = cluster_data["cluster"], esx = cluster_data["esx"], data_store = cluster_data["datastore"],
-                      network = cluster_data["network"], static_ip = static_ip, power_on = vcdata["power_on"], snapshot_name = vcdata["snapshot_name"],
-                      logger = mylogger, tmplogfile = deplogfile)  
-
-        if(static_ip == True):
-            if( cluster_data["vm_count"] != len(vm_ips) ):
-                mylogger.warning("There are %d IP address defined in YAML section %s for cluster %s. That does not equal to the defined vm_count %d in file %s. "
-                                 "Unable to create VMs." % (len(vm_ips), yaml_section, cluster_data["cluster"], cluster_data["vm_count"], yamlfile))
-                return (1, vcdata)
-
-            vms_obj.set_static_ip(vm_ips, cluster_data["netmask"], cluster_data["gateway"], cluster_data["dns"])
+    for cluster_data in plan["clusters"]:
+        vms_obj = _build_vms(vcdata, cluster_data, mylogger, deplogfile, replica_cache_file(yamlfile))
+        vms_obj.set_plan_inventory(plan["inventory"])
+
+        if(cluster_data["static_ip"] == True):
+            vms_obj.set_static_ip(cluster_data["vm_ips"], cluster_data["netmask"], cluster_data["gateway"], cluster_data["dns"])
 
         try:
             rc = vms_obj.deploy_vm()
+            if(update_plan_inventory(plan, vms_obj.plan_inventory) != 0):
+                save_plan(plan, mylogger)
             if(rc != 0):
-                mylogger("Error creating virtual machine for YAML section %s, cluster %s in file %s" % (yaml_section, cluster_data["cluster"], yamlfile))
+                mylogger.warning("Error creating virtual machine for YAML section %s, cluster %s in file %s" % (yaml_section, cluster_data["cluster"], yamlfile))
                 return (rc, vcdata)
         except Exception as exp:
             mylogger.warning("Catching exception while deploying virtual machines. Exception details: %s" % exp)
@@ -120,26 +119,385 @@ def create_from_yaml(yamlfile, yaml_section, mylogger, deplogfile):
             vm_detail["vm_password"] = cluster_data["vm_password"]
             vcdata["deployed_vm"].append(vm_detail)
 
-        if( re.search("-\[date\]", base_vm, re.M|re.I) != None ):  #base_vm is "vm-[date]"
-            continue
-        tmp_vm_list = build_vmname(base_vm, cluster_data["vm_count"] + 1)
-        base_vm = tmp_vm_list[-1]
-
     return (0, vcdata)    # all the specified vms have been successfully deployed here
 
 
+# Reconcile the virtual machines of the YAML section with vCenter: read the current state in
+# one bulk query and only run the actions that are needed. With prune, the virtual machines
+# named like the section but not in it are deleted. With plan_only, the actions are only shown.
+#
+def reconcile_from_yaml(yamlfile, yaml_section, mylogger, deplogfile, vcenter_name = None, prune = False, plan_only = False):
+    (rc, plan) = compile_plan(yamlfile, yaml_section, mylogger, vcenter_name = vcenter_name)
+    if(rc != 0):
+        return (rc, {})
+    if( re.search(r"-\[date\]", str(plan["vcenter"]["base_vmname"]), re.M|re.I) != None ):
+        mylogger.warning("Reconcile needs fixed virtual machine names. base_vmname '%s' builds new names on every run" % plan["vcenter"]["base_vmname"])
+        return (1, {})
+
+    keep_names = set([vm_name for cluster_data in plan["clusters"] for vm_name in cluster_data["vm_list"]])
+    all_actions = {}
+    for cluster_data in plan["clusters"]:
+        vms_obj = _build_vms(plan["vcenter"], cluster_data, mylogger, deplogfile, replica_cache_file(yamlfile))
+        vms_obj.set_plan_inventory(plan["inventory"])
+        if(cluster_data["static_ip"] == True):
+            vms_obj.set_static_ip(cluster_data["vm_ips"], cluster_data["netmask"], cluster_data["gateway"], cluster_data["dns"])
+
+        (cluster_rc, actions) = vms_obj.reconcile(keep_names, prune, plan_only)
+        if(vms_obj.plan_inventory != None and update_plan_inventory(plan, vms_obj.plan_inventory) != 0):
+            save_plan(plan, mylogger)
+        for action in actions.keys():
+            all_actions.setdefault(action, []).extend(actions[action])
+        if(cluster_rc != 0):
+            mylogger.warning("Error reconciling virtual machines for YAML section %s, cluster %s in file %s" % (yaml_section, cluster_data["cluster"], yamlfile))
+            rc = cluster_rc
+        if(vms_obj.abort_reason != None):
+            mylogger.warning("Reconciling YAML section %s is aborted: %s" % (yaml_section, vms_obj.abort_reason))
+            break
+    return (rc, {"actions": all_actions})
+
+
+# Copy the templates of the YAML section to the datastores of the section items once, so the
+# later deployments clone from the template replica on the same datastore.
+#
+def replicate_from_yaml(yamlfile, yaml_section, mylogger, vcenter_name = None):
+    (rc, plan) = compile_plan(yamlfile, yaml_section, mylogger, vcenter_name = vcenter_name)
+    if(rc != 0):
+        return rc
+
+    template_items = {}
+    for cluster_data in plan["clusters"]:
+        if cluster_data["datastore"]:
+            template_items.setdefault(cluster_data["template"], []).append(cluster_data)
+
+    for template in template_items.keys():
+        vms_obj = _build_vms(plan["vcenter"], template_items[template][0], mylogger, None, replica_cache_file(yamlfile))
+        if(vms_obj.connect_vc() != 0):
+            return 1
+
+        datastore_names = sorted(set([str(cluster_data["datastore"]) for cluster_data in template_items[template]]))
+        rc = vms_obj.replicate_template(datastore_names)
+        if(rc != 0):
+            mylogger.warning("Unable to replicate template %s to datastores %s" % (template, ', '.join(datastore_names)))
+            return rc
+    return 0
+
+
+# Delete the virtual machines in vm_list through the vCenter in the YAML file
+#
+def delete_from_list(yamlfile, mylogger, vm_list, vcenter_name = None):
+    (rc, vcdata) = load_vcenter(yamlfile, mylogger, vcenter_name)
+    if(rc != 0):
+        return rc
+
+    vms_obj = vms(vc_name = vcdata["vcenter_name"], vc_user = vcdata["vcenter_user"], vc_pw = vcdata["vcenter_pw"],
+                  vc_ssl_check = vcdata["ssl-check"], logger = mylogger)
+    vms_obj.vm_list = copy.deepcopy(vm_list)
+    return vms_obj.delete_vm()
+
+
+# Read the virtual machine names of the explicit selectors: the comma separated names, the list
+# file with one name per line and the virtual machines deployed in a deploy record. Return None
+# if there is no explicit selector, so all the virtual machines are candidates.
+#
+def _selector_names(options):
+    names = None
+    if options.get("vms"):
+        names = list(options["vms"])
+    if options.get("listfile"):
+        with open(options["listfile"]) as list_file:
+            lines = [line.strip() for line in list_file]
+        names = (names or []) + [line for line in lines if line and not line.startswith('#')]
+    if options.get("deploylog"):
+        deployed = [event.get("vm") for event in readevents(options["deploylog"], phase='deploy', state='deployed')]
+        destroyed = set([event.get("vm") for event in readevents(options["deploylog"], phase='abort', state='destroyed')])
+        names = (names or []) + [vm_name for vm_name in deployed if vm_name not in destroyed]
+    return list(dict.fromkeys(names)) if names != None else None
+
+
+# write one batch result as a JSON line to stdout right away
+#
+def _stream_result(record):
+    sys.stdout.write(json.dumps(record) + '\n')
+    sys.stdout.flush()
+
+
+# Run a batch subcommand (delete, power, snapshot or ips) on the selected virtual machines of
+# the vCenter in the YAML file. The virtual machines are selected in one inventory pass, and
+# every virtual machine's result is streamed as one JSON line as soon as it is done.
+# Return (rc, detail) where detail has the selected number, the failed and the missing names.
+#
+def run_batch(options, mylogger, vcenter_name = None):
+    command = options["command"]
+    try:
+        names = _selector_names(options)
+    except (IOError, OSError) as error:
+        mylogger.warning("Unable to read the virtual machine selector file. Error: %s" % error)
+        return (1, {})
+    if(names == None and not options.get("regex") and not options.get("folder")):
+        mylogger.warning("Please select the virtual machines with --vms, --list, --deploylog, --regex or --folder")
+        return (1, {})
+
+    (rc, vcdata) = load_vcenter(options["yamlfile"], mylogger, vcenter_name)
+    if(rc != 0):
+        return (rc, {})
+    vms_obj = vms(vc_name = vcdata["vcenter_name"], vc_user = vcdata["vcenter_user"], vc_pw = vcdata["vcenter_pw"],
+                  vc_ssl_check = vcdata["ssl-check"], logger = mylogger)
+    if(vms_obj.connect_vc() != 0):
+        return (1, {})
+    vms_obj.set_concurrency(options["concurrency"])
+
+    try:
+        selected = vms_obj.select_vms(names, options.get("regex"), options.get("folder"))
+    except re.error as error:
+        mylogger.warning("The virtual machine name regex %s is not valid. Error: %s" % (options.get("regex"), error))
+        return (1, {})
+    missing = [vm_name for vm_name in names if vm_name not in selected] if names != None else []
+    mylogger.info("Selected %d virtual machines in vCenter %s for %s" % (len(selected), vcdata["vcenter_name"], command))
+
+    results = {}
+    def on_done(vm_name, state, message = None):
+        results[vm_name] = state
+        record = {"vcenter": vcdata["vcenter_name"], "vm": vm_name, "op": command, "state": state}
+        if message:
+            record["message"] = message
+        _stream_result(record)
+
+    if(command == 'ips'):
+        for vm_name in sorted(selected.keys()):
+            vm_ip = selected[vm_name][1].get('guest.ipAddress')
+            results[vm_name] = 'success' if vm_ip else 'error'
+            _stream_result({"vcenter": vcdata["vcenter_name"], "vm": vm_name, "op": command, "state": results[vm_name], "ip": vm_ip})
+    elif(command == 'power'):
+        vms_obj.batch_power(selected, options["state"] == 'on', on_done)
+    elif(command == 'snapshot'):
+        vms_obj.batch_snapshot(selected, options["name"], options["memory"], on_done)
+    elif(command == 'delete'):
+        vms_obj.batch_delete(selected, on_done)
+    elif(command == 'push'):
+        vms_obj.vm_user = options["user"]
+        vms_obj.vm_password = options["password"] or os.environ.get("VM_PASSWORD")
+        vm_objs = dict([(vm_name, selected[vm_name][0]) for vm_name in selected.keys()])
+        vms_obj.push_files(options["src"], options["dest"], vm_objs, options["concurrency"], on_done)
+
+    # a virtual machine only exists in one of the vCenters, so the fleet decides on the missing ones
+    if not options.get("fleet"):
+        for vm_name in missing:
+            _stream_result({"vcenter": vcdata["vcenter_name"], "vm": vm_name, "op": command, "state": "not_found"})
+    failed = [vm_name for vm_name in sorted(selected.keys()) if results.get(vm_name) not in ('success', 'skipped')]
+    rc = 0 if( len(failed) == 0 and (options.get("fleet") or len(missing) == 0) ) else 1
+    return (rc, {"selected": len(selected), "failed": failed, "missing": missing})
+
+
+# Run the user specified operation against one vCenter. vcenter_name is None if the YAML
+# file only defines one vCenter. Return (rc, detail) where detail is a summary of the result.
+#
+def run_operation(options, mylogger, outlogfile, vcenter_name = None):
+    yamlfile = options["yamlfile"]
+    yaml_section = options["yamlsection"]
+
+    if options.get("command") in BATCH_COMMANDS:
+        return run_batch(options, mylogger, vcenter_name)
+
+    if(options.get("command") == 'reconcile'):
+        return reconcile_from_yaml(yamlfile, yaml_section, mylogger, outlogfile + '_dep', vcenter_name, options["prune"], options["plan"])
+
+    if options["dumpinventory"]:
+        inventory_file = options["dumpinventory"]
+        if(vcenter_name != None):
+            inventory_file = '%s_%s' % (inventory_file, vcenter_name)
+        rc = dump_inventory(yamlfile, mylogger, inventory_file, options["inventorywatch"], vcenter_name)
+        return (rc, {"inventory_file": inventory_file})
+
+    if options["vmips"]:
+        if options["inventoryfile"]:
+            vm_ips = vms(logger = mylogger).get_vm_ip(options["vmips"], options["inventoryfile"])
+        else:
+            (rc, vcdata) = load_vcenter(yamlfile, mylogger, vcenter_name)
+            if(rc != 0):
+                return (rc, {})
+            vm_ips = get_vm_ip(vcdata["vcenter_name"], vcdata["vcenter_user"], vcdata["vcenter_pw"], vcdata["ssl-check"], mylogger, options["vmips"])
+        rc = 0 if( len(vm_ips) == len(options["vmips"]) ) else 1
+        return (rc, {"vm_ips": vm_ips})
+
+    if options["deletevms"]:
+        rc = delete_from_list(yamlfile, mylogger, options["deletevms"], vcenter_name)
+        return (rc, {"deleted_vm": options["deletevms"] if rc == 0 else []})
+
+    if options["replicatetemplate"]:
+        return (replicate_from_yaml(yamlfile, yaml_section, mylogger, vcenter_name), {})
+
+    if options["dryrun"]:
+        return (check_plan(yamlfile, yaml_section, mylogger, vcenter_name), {})
+
+    (rc, vcdata) = create_from_yaml(yamlfile, yaml_section, mylogger, outlogfile + '_dep', vcenter_name)
+    return (rc, {"deployed_vm": [vm["vm_name"] for vm in vcdata.get("deployed_vm", [])]})
+
+
+def _setup_logging(outlogfile, loglevel, prefix = ''):
+    # the log records are written by a background thread through a queue
+    log_format = logging.Formatter('%(asctime)s.%(msecs)03d %(levelname)s ' + prefix + '{%(module)s} [%(funcName)s] %(message)s',
+                                   datefmt='%Y-%m-%d %H:%M:%S')
+    log_handlers = [logging.FileHandler(outlogfile), logging.StreamHandler()]
+    for handler in log_handlers:
+        handler.setFormatter(log_format)
+    return start_log_queue(log_handlers, loglevel)
+
+
+# Worker process of the multi-vCenter operation. Every worker has its own log file and
+# its own vCenter session.
+#
+# SIGTERM stops the operation the same way as SIGINT, so a deployment is aborted and the
+# virtual machines it has created are destroyed
+#
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _vcenter_worker(options, vcenter_name, outlogfile, loglevel):
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+
+    vc_logfile = '%s_%s' % (outlogfile, vcenter_name)
+    if options.get("trace"):
+        os.environ[TRACE_ENV] = '%s_%s' % (os.path.abspath(options["trace"]), vcenter_name)
+    listener = _setup_logging(vc_logfile, loglevel, '[%s] ' % vcenter_name)
+    mylogger = logging.getLogger(__name__)
+
+    start_time = time.time()
+    try:
+        (rc, detail) = run_operation(options, mylogger, vc_logfile, vcenter_name)
+    except Exception as exp:
+        mylogger.warning("Catching exception while running operation through vCenter %s. Exception details: %s" % (vcenter_name, exp))
+        (rc, detail) = (1, {})
+    finally:
+        # the pool worker process does not run the exit handlers, so disconnect from vCenter,
+        # save the SOAP trace and flush the log files here
+        disconnect_vcenters()
+        write_trace_report()
+        flush_logs()
+        stop_log_queue(listener)
+
+    return {"vcenter": vcenter_name, "rc": rc, "elapsed": round(time.time() - start_time, 3), "logfile": vc_logfile, "detail": detail}
+
+
+# Run the user specified operation against all the vCenters at once, one worker process
+# per vCenter. The results of all the vCenters are combined into one report.
+#
+def run_fleet(options, vcenter_names, mylogger, outlogfile, loglevel):
+    mylogger.info("Running operation through %d vCenters: %s" % (len(vcenter_names), ', '.join(vcenter_names)))
+    start_time = time.time()
+    flush_logs()
+
+    # the worker processes are spawned instead of forked from this process, which already
+    # runs the background logging threads
+    import multiprocessing
+    results = []
+    options = dict(options, fleet=True)
+    mp_context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(vcenter_names), mp_context=mp_context) as executor:
+        futures = {}
+        for vcenter_name in vcenter_names:
+            futures[executor.submit(_vcenter_worker, options, vcenter_name, outlogfile, loglevel)] = vcenter_name
+
+        for future in concurrent.futures.as_completed(futures):
+            vcenter_name = futures[future]
+            try:
+                result = future.result()
+            except Exception as exp:
+                mylogger.warning("vCenter %s worker process has quit with exception: %s" % (vcenter_name, exp))
+                result = {"vcenter": vcenter_name, "rc": 1, "elapsed": round(time.time() - start_time, 3), "logfile": None, "detail": {}}
+            mylogger.info("vCenter %s finished with return code %d in %.1f seconds" % (vcenter_name, result["rc"], result["elapsed"]))
+            results.append(result)
+
+    results.sort(key=lambda result: vcenter_names.index(result["vcenter"]))
+    elapsed = round(time.time() - start_time, 3)
+    rc = 0 if all([result["rc"] == 0 for result in results]) else 1
+
+    # a virtual machine only exists in one of the vCenters
+    if options["vmips"]:
+        found = set([vm["vm_name"] for result in results for vm in result["detail"].get("vm_ips", [])])
+        rc = 0 if( len(found) == len(set(options["vmips"])) ) else 1
+
+    # a selected virtual machine name is missing if no vCenter has it
+    if options.get("command") in BATCH_COMMANDS:
+        missing = None
+        for result in results:
+            result_missing = set(result["detail"].get("missing", []))
+            missing = result_missing if missing == None else (missing & result_missing)
+        for vm_name in sorted(missing or []):
+            _stream_result({"vcenter": None, "vm": vm_name, "op": options["command"], "state": "not_found"})
+        if( len(missing or []) > 0 ):
+            rc = 1
+
+    report = {"rc": rc, "elapsed": elapsed, "serial_elapsed": round(sum([result["elapsed"] for result in results]), 3), "vcenters": results}
+    report_file = outlogfile + '_report.json'
+    with open(report_file, 'w') as file_descr:
+        json.dump(report, file_descr, indent=1)
+
+    mylogger.info('='*15 + 'Operation through %d vCenters finished in %.1f seconds (%.1f seconds one after another)' % \
+                  (len(results), elapsed, report["serial_elapsed"]) + '='*15)
+    for result in results:
+        mylogger.info("vCenter %s: return code %d, %.1f seconds, log file %s" % (result["vcenter"], result["rc"], result["elapsed"], result["logfile"]))
+    mylogger.info("The combined report is saved in %s" % report_file)
+    return (rc, report)
+
+
 def main(argv):
     #get script parameter arguments
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-yf', '--yamlfile', required=False, help='YAML file', dest='yamlfile', type=str)
     parser.add_argument('-ys', '--yamlsection', required=False, help='YAML file section', dest='yamlsection', type=str)
+    parser.add_argument('-vc', '--vcenter', required=False, help='Only run through this vCenter when the YAML file defines several vCenters', dest='vcenter', type=str)
     parser.add_argument('-l', '--loglevel', nargs=1, required=False, help='Log Level. Default is INFO', dest='loglevel', type=str)
     parser.add_argument('-o', '--outlogfile', nargs=1, required=False, help='Output Log File Name. Default is vm_oper_$date.log', dest='outlogfile', type=str)
+    parser.add_argument('-di', '--dumpinventory', required=False, help='Dump all the virtual machines into this inventory snapshot file', dest='dumpinventory', type=str)
+    parser.add_argument('-iw', '--inventorywatch', required=False, help='Keep refreshing the inventory snapshot every this many seconds', dest='inventorywatch', type=int, default=0)
+    parser.add_argument('-ip', '--vmips', required=False, help='Comma separated virtual machine names to get IP addresses for', dest='vmips', type=str)
+    parser.add_argument('-if', '--inventoryfile', required=False, help='Get virtual machine IP addresses from this inventory snapshot file', dest='inventoryfile', type=str)
+    parser.add_argument('-dv', '--deletevms', required=False, help='Comma separated virtual machine names to delete', dest='deletevms', type=str)
+    parser.add_argument('-rt', '--replicatetemplate', required=False, help='Copy the templates of the YAML section to the datastores of the section', dest='replicatetemplate', action='store_true')
+    parser.add_argument('-tr', '--trace', required=False, help='Trace the vCenter SOAP calls and save the summary into this file', dest='trace', type=str)
+    parser.add_argument('-dr', '--dryrun', required=False, help='Only check the YAML file and resolve the vCenter objects', dest='dryrun', action='store_true')
+
+    # the batch subcommands select the virtual machines with these options
+    selector = argparse.ArgumentParser(add_help=False)
+    selector.add_argument('--vms', required=False, help='Comma separated virtual machine names', dest='vms', type=str)
+    selector.add_argument('--list', required=False, help='File with one virtual machine name per line', dest='listfile', type=str)
+    selector.add_argument('--deploylog', required=False, help='Virtual machines deployed in this deploy record', dest='deploylog', type=str)
+    selector.add_argument('--regex', required=False, help='Virtual machine names matching this regex', dest='regex', type=str)
+    selector.add_argument('--folder', required=False, help='Virtual machines in this vCenter folder', dest='folder', type=str)
+    selector.add_argument('--concurrency', required=False, help='Maximum number of tasks in flight. Default is 32', dest='concurrency', type=int, default=32)
+
+    subparsers = parser.add_subparsers(dest='command', help='Batch operation. Without a subcommand, the options above select the operation')
+    subparsers.add_parser('deploy', help='Deploy the virtual machines of the YAML section')
+    subparsers.add_parser('delete', parents=[selector], help='Power off and delete the selected virtual machines')
+    power_parser = subparsers.add_parser('power', parents=[selector], help='Power on or off the selected virtual machines')
+    power_parser.add_argument('--state', required=True, help='Power state', dest='state', choices=['on', 'off'])
+    snapshot_parser = subparsers.add_parser('snapshot', parents=[selector], help='Create a snapshot of the selected virtual machines')
+    snapshot_parser.add_argument('--name', required=True, help='Snapshot name', dest='name', type=str)
+    snapshot_parser.add_argument('--memory', required=False, help='Include the virtual machine memory', dest='memory', action='store_true')
+    subparsers.add_parser('ips', parents=[selector], help='Show the IP addresses of the selected virtual machines')
+    push_parser = subparsers.add_parser('push', parents=[selector], help='Push local files into the guests of the selected virtual machines')
+    push_parser.add_argument('--src', required=True, nargs='+', help='Local files to push', dest='src', type=str)
+    push_parser.add_argument('--dest', required=True, help='Guest directory to push the files into', dest='dest', type=str)
+    push_parser.add_argument('--user', required=True, help='Guest user name', dest='user', type=str)
+    push_parser.add_argument('--password', required=False, help='Guest password. Default is the VM_PASSWORD environment variable', dest='password', type=str)
+    reconcile_parser = subparsers.add_parser('reconcile', help='Only run the actions that bring vCenter in line with the YAML section')
+    reconcile_parser.add_argument('--prune', required=False, help='Delete the virtual machines named like the section but not in it', dest='prune', action='store_true')
+    reconcile_parser.add_argument('--plan', required=False, help='Only show the actions', dest='plan', action='store_true')
 
     args = parser.parse_args()
-    yamlfile = args.yamlfile
-    yaml_section = args.yamlsection
+    options = vars(args)
+    if(args.command in BATCH_COMMANDS + ('reconcile',) and not args.yamlfile):
+        parser.error('the %s subcommand requires the YAML file option -yf' % args.command)
+    if(args.command == 'reconcile' and not args.yamlsection):
+        parser.error('the reconcile subcommand requires the YAML section option -ys')
+    for key in ["vmips", "deletevms", "vms"]:
+        if options.get(key):
+            options[key] = [vm_name.strip() for vm_name in options[key].split(',') if vm_name.strip()]
 
     if not args.loglevel:
         loglevel = logging.INFO
@@ -159,19 +517,35 @@ def main(argv):
     else:
         outlogfile = args.outlogfile[0]
 
-    deplogfile = outlogfile + '_dep'
+    # the SOAP tracing is also enabled in the worker processes through the environment
+    if args.trace:
+        os.environ[TRACE_ENV] = os.path.abspath(args.trace)
 
     # configure logging levels
-    logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)s {%(module)s} [%(funcName)s] %(message)s', 
-                        datefmt='%Y-%m-%d %H:%M:%S', level=loglevel,
-                        handlers=[logging.FileHandler(outlogfile), logging.StreamHandler()])
+    _setup_logging(outlogfile, loglevel)
+    signal.signal(signal.SIGTERM, _raise_interrupt)
 
     mylogger = logging.getLogger(__name__)
     # start operation
     mylogger.info('Start Operation')
 
-    (rc, vcdata) = create_from_yaml(yamlfile, yaml_section, mylogger, deplogfile)
+    # the operation runs through every vCenter defined in the YAML file at once
+    vcenter_names = [args.vcenter] if args.vcenter else []
+    if( not args.vcenter and args.yamlfile and not (args.vmips and args.inventoryfile) ):
+        (rc, vcenter_names) = list_vcenters(args.yamlfile, mylogger)
+        if(rc != 0):
+            return rc
+
+    if( len(vcenter_names) > 1 ):
+        (rc, report) = run_fleet(options, vcenter_names, mylogger, outlogfile, loglevel)
+        vm_ips = [vm for result in report["vcenters"] for vm in result["detail"].get("vm_ips", [])]
+    else:
+        vcenter_name = vcenter_names[0] if args.vcenter else None
+        (rc, detail) = run_operation(options, mylogger, outlogfile, vcenter_name)
+        vm_ips = detail.get("vm_ips", [])
 
+    for vm in vm_ips:
+        print("%s %s" % (vm["vm_name"], vm["vm_ip"]))
     return rc
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python module keeps an offline inventory snapshot of vCenter virtual machines
+  in a local SQLite file. For every virtual machine, the snapshot has its name, managed
+  object reference, power state, IP addresses, ESXi host, datastores and folder. The
+  snapshot is filled by "vmwarevms.py" from property collector updates, so it can be
+  refreshed incrementally, and the virtual machine IP addresses can be queried from
+  the snapshot without logging into vCenter.
+"""
+
+import os
+import time
+import json
+import sqlite3
+
+__all__ = ['VM_PROPS', 'inventory_store', 'query_inventory', 'query_vm_ip']
+
+INVENTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS vm (moref TEXT PRIMARY KEY, name TEXT, power_state TEXT, ip TEXT, ips TEXT,
+                               host TEXT, datastore TEXT, folder TEXT);
+CREATE INDEX IF NOT EXISTS vm_name ON vm (name);
+CREATE TABLE IF NOT EXISTS entity (moref TEXT PRIMARY KEY, type TEXT, name TEXT);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+'''
+
+# the virtual machine properties retrieved from vCenter and their snapshot columns
+VM_PROPS = {'name': 'name', 'runtime.powerState': 'power_state', 'guest.ipAddress': 'ip', 'guest.net': 'ips',
+            'runtime.host': 'host', 'datastore': 'datastore', 'parent': 'folder'}
+
+
+def _moref(obj):
+    return getattr(obj, '_moId', None)
+
+
+# convert a property collector value into the value saved in the snapshot
+#
+def _prop_value(prop_name, val):
+    if val is None:
+        return None
+    if(prop_name == 'guest.net'):
+        ips = []
+        for nic in val:
+            for ip in (nic.ipAddress or []):
+                ips.append(ip)
+        return json.dumps(ips)
+    if(prop_name == 'datastore'):
+        return json.dumps([_moref(obj) for obj in val])
+    if(prop_name in ('runtime.host', 'parent')):
+        return _moref(val)
+    return str(val)
+
+
+# SQLite backed inventory snapshot. The property collector updates are applied in one
+# transaction, and the property collector version is saved with the snapshot.
+#
+class inventory_store:
+    def __init__(self, inventory_file):
+        self.inventory_file = inventory_file
+        self.conn = sqlite3.connect(inventory_file)
+        self.conn.executescript(INVENTORY_SCHEMA)
+        os.chmod(inventory_file, 0o600)
+
+    # remove all the virtual machines before a full dump
+    def reset(self, vc_name):
+        self.conn.execute('DELETE FROM vm')
+        self.conn.execute('DELETE FROM entity')
+        self.conn.execute('DELETE FROM meta')
+        self._set_meta('vcenter', vc_name)
+
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    # apply the object changes of a property collector update
+    def apply_update(self, filter_sets):
+        for filter_set in filter_sets:
+            for obj_set in filter_set.objectSet:
+                obj = obj_set.obj
+                moref = _moref(obj)
+                if(obj_set.kind == 'leave'):
+                    self.conn.execute('DELETE FROM vm WHERE moref = ?', (moref,))
+                    self.conn.execute('DELETE FROM entity WHERE moref = ?', (moref,))
+                    continue
+
+                if(obj._wsdlName == 'VirtualMachine'):
+                    self.conn.execute('INSERT OR IGNORE INTO vm (moref) VALUES (?)', (moref,))
+                    for change in obj_set.changeSet:
+                        column = VM_PROPS.get(change.name)
+                        if column is None:
+                            continue
+                        val = None if change.op in ('remove', 'indirectRemove') else _prop_value(change.name, change.val)
+                        self.conn.execute('UPDATE vm SET %s = ? WHERE moref = ?' % column, (val, moref))
+                else:
+                    for change in obj_set.changeSet:
+                        if(change.name == 'name'):
+                            self.conn.execute('INSERT OR REPLACE INTO entity (moref, type, name) VALUES (?, ?, ?)',
+                                              (moref, obj._wsdlName, change.val))
+
+    # save the property collector version and commit the changes
+    def commit(self, version):
+        self._set_meta('version', version)
+        self._set_meta('updated', str(time.time()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# Query the virtual machines from the inventory snapshot. If vm_list is empty, all the
+# virtual machines are returned. Every virtual machine is returned as a dictionary with
+# vm_name, moref, power_state, vm_ip, ips, host, datastore and folder.
+#
+def query_inventory(inventory_file, vm_list = []):
+    conn = sqlite3.connect('file:%s?mode=ro' % inventory_file, uri=True)
+    try:
+        names = {}
+        for (moref, name) in conn.execute('SELECT moref, name FROM entity'):
+            names[moref] = name
+
+        sql = 'SELECT moref, name, power_state, ip, ips, host, datastore, folder FROM vm'
+        if( len(vm_list) > 0 ):
+            rows = []
+            for start in range(0, len(vm_list), 500):
+                chunk = vm_list[start:start + 500]
+                rows.extend(conn.execute(sql + ' WHERE name IN (%s)' % ','.join(['?'] * len(chunk)), chunk).fetchall())
+        else:
+            rows = conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+    vm_details = []
+    for (moref, name, power_state, ip, ips, host, datastore, folder) in rows:
+        vm = {}
+        vm["vm_name"] = name
+        vm["moref"] = moref
+        vm["power_state"] = power_state
+        vm["vm_ip"] = ip
+        vm["ips"] = json.loads(ips) if ips else []
+        vm["host"] = names.get(host, host)
+        vm["datastore"] = [names.get(ds, ds) for ds in (json.loads(datastore) if datastore else [])]
+        vm["folder"] = names.get(folder, folder)
+        vm_details.append(vm)
+    return vm_details
+
+
+# Get virtual machines' IP addresses from the inventory snapshot, in the same format as
+# vms.get_vm_ip: [{'vm_name': 'vm1', 'vm_ip': '192.168.51.x'},,]
+#
+def query_vm_ip(inventory_file, vm_list, logger):
+    vm_details = {}
+    for vm in query_inventory(inventory_file, vm_list):
+        vm_details[vm["vm_name"]] = vm
+
+    ipaddress_list = []
+    for vm_name in vm_list:
+        vm = vm_details.get(vm_name)
+        if vm is None:
+            logger.warning('Virtual machine %s does not exist in inventory snapshot %s' % (vm_name, inventory_file))
+            continue
+        if( (vm["vm_ip"] == None) or (len(vm["vm_ip"]) == 0) ):
+            logger.warning('Error getting virtual machine %s IP address from inventory snapshot %s' % (vm_name, inventory_file))
+            continue
+        ipaddress_list.append({"vm_name": vm_name, "vm_ip": vm["vm_ip"]})
+    return ipaddress_list
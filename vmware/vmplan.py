@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python module compiles the user provided deployment yaml file into a deployment
+  plan. The plan contains the validated vCenter information, the expanded virtual machine
+  names and IP addresses of every ESXi section item, and the vCenter object inventory
+  (template, datacenter, folder, cluster, ESXi host, datastore and network) resolved
+  by "vmwarevms.py". The plan is cached on disk keyed by the yaml file hash, and the
+  resolved inventory is keyed by the vCenter instance, so repeated runs and dry runs
+  do not need to parse the yaml file or walk the vCenter inventory again.
+"""
+
+import os
+import re
+import time
+import json
+import hashlib
+import copy
+
+from autoutil import *
+
+__all__ = ['compile_plan', 'replica_cache_file', 'list_vcenters', 'load_vcenter', 'save_plan', 'update_plan_inventory', 'get_ip_from_range']
+
+PLAN_FORMAT = 4
+PLAN_CACHE_DIR = '.vmplan_cache'
+
+VCENTER_REQUIRED = ['vcenter_name', 'vcenter_user', 'vcenter_pw', 'base_vmname']
+VCENTER_DEFAULTS = {'ssl-check': False, 'datacenter': None, 'folder': None, 'hostname_update': False,
+                    'power_on': True, 'snapshot_name': None, 'template_replica': False, 'retry_attempts': 3,
+                    'probe_ports': None}
+CLUSTER_REQUIRED = ['template', 'vm_user', 'vm_password', 'vm_count']
+CLUSTER_DEFAULTS = {'cluster': None, 'esx': None, 'datastore': None, 'network': None,
+                    'netmask': None, 'gateway': None, 'dns': None, 'payload_files': None, 'payload_dest': None}
+
+
+# Get the IP addresses from an IP range like "192.168.0.41--51" or "192.168.0.41-192.168.0.51".
+# The IP addresses are appended into vm_ips. Return 1 if the IP range is not valid.
+#
+def get_ip_from_range(ip_range, vm_ips, mylogger):
+    ip_range = str(ip_range).replace(" ", "")
+    if(re.search(r'-', ip_range, re.M|re.I) == None):   # search if ip is like "192.168.0.41--51"
+        vm_ips.append(ip_range)
+        return 0
+
+    ip_list = re.split('-+', ip_range)      # ip_range is like "192.168.0.41--51"
+    if(len(ip_list) != 2):                  # ip_list should be ['192.168.0.41', '51'] or ['192.168.0.41', '192.168.0.51']
+        mylogger.warning("Please provide a valid virtual machine IP address or range: %s" % ip_range)
+        return 1
+
+    start_ip = ip_list[0]
+    last_ip = ip_list[1]
+    if( len(ip_list[1]) <= 3 ):
+        last_ip = re.sub(r'\d+$', ip_list[1], start_ip)
+
+    from ipaddress import ip_address
+    try:
+        start_int = int(ip_address(start_ip).packed.hex(), 16)
+        last_int = int(ip_address(last_ip).packed.hex(), 16)
+    except ValueError as exp:
+        mylogger.warning("Please provide a valid virtual machine IP address or range: %s. Error: %s" % (ip_range, exp))
+        return 1
+
+    if(last_int < start_int):
+        mylogger.warning("The virtual machine IP range %s ends before it starts" % ip_range)
+        return 1
+
+    for ip in range(start_int, last_int + 1):
+        vm_ips.append(ip_address(ip).exploded)
+
+    return 0
+
+
+# Load the yaml file content. The libyaml based C loader is used when it is available
+# as it is much faster than the pure python loader.
+#
+def _load_yaml(yaml_bytes):
+    import yaml
+    loader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+    return yaml.load(yaml_bytes, Loader=loader)
+
+
+def _plan_cache_file(yamlfile, yaml_section, file_hash, vcenter_name = None):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(yamlfile)), PLAN_CACHE_DIR)
+    section = re.sub(r'[^\w.-]', '_', str(yaml_section))
+    if(vcenter_name != None):
+        section = section + '_' + re.sub(r'[^\w.-]', '_', str(vcenter_name))
+    return os.path.join(cache_dir, '%s_%s.json' % (file_hash[0:16], section))
+
+
+# The template replica cache file is kept in the plan cache directory next to the yaml file
+#
+def replica_cache_file(yamlfile):
+    return os.path.join(os.path.dirname(os.path.abspath(yamlfile)), PLAN_CACHE_DIR, 'template_replicas.json')
+
+
+# Assign virtual machine names to every ESXi section item. The base virtual machine name
+# of the next item continues from the last virtual machine name of the previous item.
+# For base_vmname like "vm-[date]", the names are built from the current time, so they
+# are assigned again every time the plan is used.
+#
+def _assign_vm_names(plan):
+    base_vm = plan["vcenter"]["base_vmname"]
+    date_name = re.search(r"-\[date\]", base_vm, re.M|re.I) != None
+
+    for item in plan["clusters"]:
+        if(date_name == True):
+            base_vmname = base_vm.replace("-[date]", "") + "-" + str(int(time.time()))
+        else:
+            base_vmname = base_vm
+
+        item["base_vmname"] = base_vmname
+        item["vm_list"] = build_vmname(base_vmname, item["vm_count"])
+
+        if(date_name == True):
+            continue
+        tmp_vm_list = build_vmname(base_vm, item["vm_count"] + 1)
+        base_vm = tmp_vm_list[-1]
+
+
+# Get the vCenter definitions of the yaml content. The VCenter section can be one mapping,
+# or a list of mappings when the virtual machines are deployed through several vCenters.
+#
+def _vcenter_items(yaml_item, errors):
+    vcenter_items = yaml_item.get("VCenter")
+    if isinstance(vcenter_items, dict):
+        return [vcenter_items]
+    if( isinstance(vcenter_items, list) and len(vcenter_items) > 0 and all([isinstance(item, dict) for item in vcenter_items]) ):
+        names = [str(item.get("vcenter_name")) for item in vcenter_items]
+        if( len(set(names)) != len(names) ):
+            errors.append("section VCenter defines the same vcenter_name more than once")
+        return vcenter_items
+    errors.append("section VCenter is missing or is not a mapping or a list of mappings")
+    return []
+
+
+# Validate the VCenter section of the yaml content. If the section defines several vCenters,
+# vcenter_name selects one of them. The problems are appended into errors.
+#
+def _check_vcenter(yaml_item, errors, required = VCENTER_REQUIRED, vcenter_name = None):
+    vcenter_list = _vcenter_items(yaml_item, errors)
+    vcenter_items = {}
+    if(vcenter_name == None):
+        if( len(vcenter_list) > 1 ):
+            errors.append("section VCenter defines %d vCenters. Please choose one of them" % len(vcenter_list))
+        elif( len(vcenter_list) == 1 ):
+            vcenter_items = vcenter_list[0]
+    else:
+        matched = [item for item in vcenter_list if str(item.get("vcenter_name")) == vcenter_name]
+        if( len(matched) == 0 ):
+            errors.append("vCenter %s is not defined in section VCenter" % vcenter_name)
+        else:
+            vcenter_items = matched[0]
+    if( len(vcenter_items) == 0 ):
+        return copy.deepcopy(VCENTER_DEFAULTS)
+
+    vcdata = copy.deepcopy(VCENTER_DEFAULTS)
+    for key in vcenter_items.keys():
+        vcdata[key] = vcenter_items[key]
+    for key in required:
+        if( vcdata.get(key) in (None, "") ):
+            errors.append("VCenter key '%s' is missing" % key)
+    if( vcdata["snapshot_name"] == "None" ): vcdata["snapshot_name"] = None
+    if( not isinstance(vcdata["retry_attempts"], int) or vcdata["retry_attempts"] < 1 ):
+        errors.append("VCenter retry_attempts '%s' should be a number not less than 1" % vcdata["retry_attempts"])
+    probe_ports = vcdata["probe_ports"]
+    if( probe_ports != None and (not isinstance(probe_ports, list) or
+                                 not all([isinstance(port, int) and 0 < port < 65536 for port in probe_ports])) ):
+        errors.append("VCenter probe_ports '%s' should be a list of TCP port numbers like [22, 3389]" % probe_ports)
+
+    if "base_vmname" in required:
+        base_vm = str(vcdata.get("base_vmname"))
+        if( re.search(r"-\[date\]", base_vm, re.M|re.I) == None and re.search(r'\d+$', base_vm) == None ):
+            errors.append("VCenter base_vmname '%s' should end with a number like 'vm-001' or be like 'vm-[date]'" % base_vm)
+    return vcdata
+
+
+# Validate the yaml content and build the deployment plan. All the problems found in
+# the yaml file are reported together. Return (0, plan) or (1, None).
+#
+def _build_plan(yaml_item, yamlfile, yaml_section, file_hash, mylogger, vcenter_name = None):
+    errors = []
+    if not isinstance(yaml_item, dict):
+        mylogger.warning("YAML file %s does not contain any section" % yamlfile)
+        return (1, None)
+
+    vcdata = _check_vcenter(yaml_item, errors, VCENTER_REQUIRED, vcenter_name)
+    vcenter_names = [str(item.get("vcenter_name")) for item in _vcenter_items(yaml_item, [])]
+
+    vm_cluster = yaml_item.get(yaml_section)
+    if not isinstance(vm_cluster, list) or len(vm_cluster) == 0:
+        errors.append("section %s is missing or is not a list of ESXi items" % yaml_section)
+        vm_cluster = []
+
+    clusters = []
+    for (index, item) in enumerate(vm_cluster):
+        where = "%s item %d" % (yaml_section, index + 1)
+        if not isinstance(item, dict):
+            errors.append("%s is not a mapping" % where)
+            continue
+
+        # the item with "vcenter" key is only deployed through that vCenter
+        item_vcenter = item.get("vcenter")
+        if(item_vcenter != None):
+            if(str(item_vcenter) not in vcenter_names):
+                errors.append("%s uses vCenter %s which is not defined in section VCenter" % (where, item_vcenter))
+            elif(str(item_vcenter) != str(vcdata.get("vcenter_name"))):
+                continue
+
+        vm_ips = []
+        cluster_data = copy.deepcopy(CLUSTER_DEFAULTS)
+        for key in item.keys():
+            value = item[key]
+            if(key == "vcenter"):
+                continue
+            if(re.search(r'ip', key, re.M|re.I) != None ):
+                if(get_ip_from_range(value, vm_ips, mylogger) != 0):
+                    errors.append("%s has invalid IP address or range '%s'" % (where, value))
+            else:
+                cluster_data[key] = value
+
+        for key in CLUSTER_REQUIRED:
+            if( cluster_data.get(key) in (None, "") ):
+                errors.append("%s key '%s' is missing" % (where, key))
+        if not isinstance(cluster_data.get("vm_count"), int) or cluster_data["vm_count"] <= 0:
+            errors.append("%s vm_count should be a positive number" % where)
+            cluster_data["vm_count"] = 0
+
+        # the payload files are pushed into the guests after the deployment. A relative path is
+        # relative to the yaml file.
+        payload_files = cluster_data["payload_files"]
+        if(payload_files != None):
+            if( not isinstance(payload_files, list) or len(payload_files) == 0 ):
+                errors.append("%s payload_files should be a list of local file paths" % where)
+            else:
+                yaml_dir = os.path.dirname(os.path.abspath(yamlfile))
+                cluster_data["payload_files"] = [os.path.join(yaml_dir, str(path)) for path in payload_files]
+                for path in cluster_data["payload_files"]:
+                    if not os.path.isfile(path):
+                        errors.append("%s payload file '%s' does not exist" % (where, path))
+            if( cluster_data["payload_dest"] in (None, "") ):
+                errors.append("%s key 'payload_dest' is required for payload_files" % where)
+
+        static_ip = False if("dhcp" in vm_ips or "DHCP" in vm_ips) else True
+        if(static_ip == True):
+            if( cluster_data["vm_count"] != len(vm_ips) ):
+                errors.append("%s defines %d IP addresses. That does not equal to the defined vm_count %s" % \
+                              (where, len(vm_ips), cluster_data["vm_count"]))
+            for key in ["netmask", "gateway", "dns"]:
+                if( cluster_data[key] == None ):
+                    errors.append("%s key '%s' is required for static IP addresses" % (where, key))
+        else:
+            vm_ips = []
+
+        cluster_data["static_ip"] = static_ip
+        cluster_data["vm_ips"] = vm_ips
+        clusters.append(cluster_data)
+
+    if( len(errors) > 0 ):
+        for error in errors:
+            mylogger.warning("YAML file %s: %s" % (yamlfile, error))
+        return (1, None)
+
+    plan = {}
+    plan["format"] = PLAN_FORMAT
+    plan["yamlfile"] = os.path.abspath(yamlfile)
+    plan["section"] = yaml_section
+    plan["vcenter_name"] = vcenter_name
+    plan["file_hash"] = file_hash
+    plan["vcenter"] = vcdata
+    plan["clusters"] = clusters
+    plan["inventory"] = None
+    _assign_vm_names(plan)
+
+    return (0, plan)
+
+
+# check that the yaml file is given and exists. Return 0 if it does, 1 if not.
+#
+def _check_yaml_file(yamlfile, mylogger):
+    if(yamlfile == None):
+        mylogger.warning("The YAML file is not specified. Please specify it with the -yf option")
+        return 1
+    if( not os.path.isfile(yamlfile) ):
+        mylogger.warning("The YAML file %s does not exist" % yamlfile)
+        return 1
+    return 0
+
+
+# Compile the yaml file section into a deployment plan. If the yaml file defines several
+# vCenters, vcenter_name selects the vCenter and only the section items for that vCenter
+# are in the plan. A cached plan is used if the yaml file has not been changed since the
+# plan was compiled. Return (rc, plan).
+#
+def compile_plan(yamlfile, yaml_section, mylogger, use_cache = True, vcenter_name = None):
+    if(_check_yaml_file(yamlfile, mylogger) != 0):
+        return (1, None)
+    try:
+        with open(yamlfile, "rb") as file_descr:
+            yaml_bytes = file_descr.read()
+    except IOError as error:
+        mylogger.warning("Unable to read YAML file %s. Error: %s" % (yamlfile, error))
+        return (1, None)
+
+    file_hash = hashlib.sha256(yaml_bytes).hexdigest()
+    cache_file = _plan_cache_file(yamlfile, yaml_section, file_hash, vcenter_name)
+
+    if(use_cache == True and os.path.exists(cache_file)):
+        try:
+            with open(cache_file, "r") as file_descr:
+                plan = json.load(file_descr)
+            if( plan.get("format") == PLAN_FORMAT and plan.get("file_hash") == file_hash and plan.get("section") == yaml_section and \
+                plan.get("vcenter_name") == vcenter_name ):
+                _assign_vm_names(plan)
+                mylogger.debug("Using cached deployment plan %s" % cache_file)
+                return (0, plan)
+        except (IOError, ValueError) as error:
+            mylogger.debug("Ignoring invalid cached deployment plan %s. Error: %s" % (cache_file, error))
+
+    try:
+        yaml_item = _load_yaml(yaml_bytes)
+    except Exception as exp:
+        mylogger.warning("Unable to parse YAML file %s. Exception: %s" % (yamlfile, exp))
+        return (1, None)
+
+    (rc, plan) = _build_plan(yaml_item, yamlfile, yaml_section, file_hash, mylogger, vcenter_name)
+    if(rc != 0):
+        return (rc, None)
+
+    if(use_cache == True):
+        save_plan(plan, mylogger)
+    return (0, plan)
+
+
+def _load_yaml_file(yamlfile, mylogger):
+    if(_check_yaml_file(yamlfile, mylogger) != 0):
+        return None
+    try:
+        with open(yamlfile, "rb") as file_descr:
+            yaml_item = _load_yaml(file_descr.read())
+    except Exception as exp:
+        mylogger.warning("Unable to load YAML file %s. Exception: %s" % (yamlfile, exp))
+        return None
+    return yaml_item if isinstance(yaml_item, dict) else {}
+
+
+# Get the names of all the vCenters defined in the VCenter section of the yaml file.
+# Return (rc, vcenter_names).
+#
+def list_vcenters(yamlfile, mylogger):
+    yaml_item = _load_yaml_file(yamlfile, mylogger)
+    if(yaml_item == None):
+        return (1, [])
+
+    errors = []
+    vcenter_list = _vcenter_items(yaml_item, errors)
+    if( len(errors) > 0 ):
+        for error in errors:
+            mylogger.warning("YAML file %s: %s" % (yamlfile, error))
+        return (1, [])
+    return (0, [str(item.get("vcenter_name")) for item in vcenter_list])
+
+
+# Load and validate only the VCenter section of the yaml file, for the operations that
+# do not deploy virtual machines. Return (rc, vcdata).
+#
+def load_vcenter(yamlfile, mylogger, vcenter_name = None):
+    yaml_item = _load_yaml_file(yamlfile, mylogger)
+    if(yaml_item == None):
+        return (1, None)
+
+    errors = []
+    vcdata = _check_vcenter(yaml_item, errors, ['vcenter_name', 'vcenter_user', 'vcenter_pw'], vcenter_name)
+    if( len(errors) > 0 ):
+        for error in errors:
+            mylogger.warning("YAML file %s: %s" % (yamlfile, error))
+        return (1, None)
+    return (0, vcdata)
+
+
+# Save the deployment plan into the plan cache. The cache file has the same secrets
+# as the yaml file, so only the owner can read it.
+#
+def save_plan(plan, mylogger):
+    cache_file = _plan_cache_file(plan["yamlfile"], plan["section"], plan["file_hash"], plan.get("vcenter_name"))
+    tmp_file = cache_file + '.%d' % os.getpid()
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        fd = os.open(tmp_file, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file_descr:
+            json.dump(plan, file_descr, indent=1)
+        os.replace(tmp_file, cache_file)
+    except (IOError, OSError) as error:
+        mylogger.debug("Unable to save deployment plan %s. Error: %s" % (cache_file, error))
+        return 1
+    return 0
+
+
+# Merge the vCenter object inventory resolved by "vmwarevms.py" into the plan. The
+# inventory from a different vCenter instance replaces the cached one.
+#
+def update_plan_inventory(plan, inventory):
+    if not inventory:
+        return 0
+    cached = plan.get("inventory")
+    if( cached == None or cached.get("vcenter_uuid") != inventory.get("vcenter_uuid") ):
+        plan["inventory"] = copy.deepcopy(inventory)
+        return 1
+
+    changed = 0
+    for key in inventory["objects"].keys():
+        if( cached["objects"].get(key) != inventory["objects"][key] ):
+            cached["objects"][key] = inventory["objects"][key]
+            changed = 1
+    return changed
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python module provides the TCP readiness probes used by "vmwarevms.py" to decide
+  when a deployed virtual machine is usable. A virtual machine is ready when all of its
+  probe ports (like 22 for SSH or 3389 for RDP) accept TCP connections. All the virtual
+  machines are probed at once with asyncio, every probe has its own timeout, and a virtual
+  machine that is not ready yet is probed again with backoff. After a reboot is started,
+  the ports are first waited to go down, so the services of the old boot are not taken as
+  ready. The wait stops early when the optional stop_event (a threading.Event) is set.
+"""
+
+import time
+import random
+import asyncio
+
+from autoutil import progress_reporter
+
+__all__ = ['wait_ports']
+
+
+# whether the port accepts a TCP connection within timeout seconds
+#
+async def _port_open(ip, port, timeout):
+    try:
+        (reader, writer) = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, AttributeError):
+        pass
+    return True
+
+
+class _prober:
+    def __init__(self, ports, timeout, probe_timeout, initial_delay, max_delay, concurrency, after_reboot, down_timeout, progress,
+                 stop_event = None):
+        self.ports = ports
+        self.probe_timeout = probe_timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.after_reboot = after_reboot
+        self.down_timeout = down_timeout
+        self.progress = progress
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.start_time = time.time()
+        self.deadline = self.start_time + timeout
+        self.stop_event = stop_event
+
+    def stopped(self):
+        return self.stop_event != None and self.stop_event.is_set()
+
+    # sleep for seconds, in slices of at most one second so a stop is seen soon
+    async def sleep(self, seconds):
+        end_time = time.time() + seconds
+        while( not self.stopped() and time.time() < end_time ):
+            await asyncio.sleep(min(1.0, max(0, end_time - time.time())))
+
+    async def ports_open(self, ip):
+        async with self.semaphore:
+            results = await asyncio.gather(*[_port_open(ip, port, self.probe_timeout) for port in self.ports])
+        return all(results)
+
+    async def wait_target(self, name, ip):
+        # after a reboot is started, wait until the ports go down, or at most down_timeout seconds
+        if self.after_reboot:
+            self.progress.update(name, 'rebooting')
+            down_deadline = min(self.deadline, time.time() + self.down_timeout)
+            while( time.time() < down_deadline and not self.stopped() and await self.ports_open(ip) ):
+                await self.sleep(1)
+
+        self.progress.update(name, 'waiting')
+        delay = self.initial_delay
+        while( time.time() < self.deadline and not self.stopped() ):
+            if await self.ports_open(ip):
+                self.progress.update(name, 'ready')
+                return (name, round(time.time() - self.start_time, 1))
+            await self.sleep(min(delay * random.uniform(0.8, 1.2), max(0, self.deadline - time.time())))
+            delay = min(self.max_delay, delay * 1.5)
+        self.progress.update(name, 'timeout')
+        return (name, None)
+
+    async def run(self, targets):
+        self.semaphore = asyncio.Semaphore(self.concurrency)    # created in the running event loop
+        ready = {}
+        for future in asyncio.as_completed([self.wait_target(name, ip) for (name, ip) in targets.items()]):
+            (name, seconds) = await future
+            if seconds is not None:
+                ready[name] = seconds
+            self.progress.report()
+        self.progress.report(True)
+        return ready
+
+
+# Wait until all the ports of every target accept TCP connections. targets is {name: ip}.
+# Return (ready, not_ready) where ready is {name: seconds until ready} and not_ready is the
+# list of names that are not ready within timeout seconds, or before stop_event is set.
+#
+def wait_ports(targets, ports, timeout = 1800, probe_timeout = 3.0, initial_delay = 1.0, max_delay = 15.0,
+               concurrency = 256, after_reboot = False, down_timeout = 120, logger = None, stop_event = None):
+    if( len(targets) == 0 ):
+        return ({}, [])
+
+    progress = progress_reporter(logger, 'Virtual machine port %s readiness' % ','.join([str(port) for port in ports]),
+                                 len(targets), done_states=('ready', 'timeout'))
+    prober = _prober(ports, timeout, probe_timeout, initial_delay, max_delay, concurrency, after_reboot, down_timeout, progress,
+                     stop_event)
+    ready = asyncio.run(prober.run(targets))
+    not_ready = sorted([name for name in targets.keys() if name not in ready])
+    return (ready, not_ready)
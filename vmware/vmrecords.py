@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python module provides the per virtual machine bookkeeping used by "vmwarevms.py".
+  Every virtual machine of a deployment has one compact record with its name, static IP
+  address, current task and deployment flags. The records are kept in deployment order
+  and are indexed by virtual machine name, static IP address and task managed object
+  reference, so looking up the virtual machine of a task update or of an IP address does
+  not scan all the virtual machines, and the name and the IP address of a virtual machine
+  can not get out of step.
+"""
+
+import collections
+
+__all__ = ['vm_record', 'vm_records', 'task_key']
+
+
+# the key of a vCenter task in the task index: its managed object reference
+#
+def task_key(task):
+    return getattr(task, '_moId', None) or str(task)
+
+
+class vm_record:
+    __slots__ = ('name', 'ip', 'task', 'cloned', 'deployed')
+
+    def __init__(self, name, ip = None):
+        self.name = name
+        self.ip = ip
+        self.task = None
+        self.cloned = False      # the clone of this virtual machine is submitted by this run
+        self.deployed = False    # the virtual machine is deployed or already exists
+
+    def __repr__(self):
+        return 'vm_record(%r, %r)' % (self.name, self.ip)
+
+
+class vm_records:
+    def __init__(self, names = None, ips = None):
+        self.records = collections.OrderedDict()    # name -> vm_record, in deployment order
+        self.ip_index = {}                          # static IP address -> vm_record
+        self.task_index = {}                        # task moref -> vm_record
+        for (i, name) in enumerate(names or []):
+            self.add(name, ips[i] if ips and i < len(ips) else None)
+
+    # build the records of the {vm_name: task} dictionary of a task wait
+    @classmethod
+    def from_tasks(cls, vm_tasks):
+        records = cls()
+        for (name, task) in vm_tasks.items():
+            records.set_task(records.add(name), task)
+        return records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(list(self.records.values()))
+
+    def __contains__(self, name):
+        return name in self.records
+
+    # the record of name, added if it is new. The IP address of a record is only replaced by a new one.
+    def add(self, name, ip = None):
+        record = self.records.get(name)
+        if record is None:
+            record = vm_record(name)
+            self.records[name] = record
+        if ip is not None:
+            self.set_ip(record, ip)
+        return record
+
+    def get(self, name):
+        return self.records.get(name)
+
+    def remove(self, name):
+        record = self.records.pop(name, None)
+        if record is not None:
+            self.set_ip(record, None)
+            self.set_task(record, None)
+        return record
+
+    def set_ip(self, record, ip):
+        if( record.ip is not None and self.ip_index.get(record.ip) is record ):
+            del self.ip_index[record.ip]
+        record.ip = ip
+        if ip is not None:
+            self.ip_index[ip] = record
+
+    def set_task(self, record, task):
+        if( record.task is not None and self.task_index.get(task_key(record.task)) is record ):
+            del self.task_index[task_key(record.task)]
+        record.task = task
+        if task is not None:
+            self.task_index[task_key(task)] = record
+
+    def by_ip(self, ip):
+        return self.ip_index.get(ip)
+
+    def by_task(self, task):
+        return self.task_index.get(task_key(task))
+
+    # the virtual machine names, in deployment order
+    def names(self):
+        return list(self.records.keys())
+
+    # the static IP addresses, in deployment order
+    def ip_list(self):
+        return [record.ip for record in self.records.values() if record.ip is not None]
+
+    # {vm_name: static IP address} of the virtual machines with a static IP address
+    def ips(self):
+        return collections.OrderedDict([(record.name, record.ip) for record in self.records.values() if record.ip is not None])
+
+    # replace the virtual machines with names. The static IP address of a kept virtual
+    # machine is kept, unless ips gives the new IP addresses by position.
+    def reset(self, names, ips = None):
+        old_ips = dict([(record.name, record.ip) for record in self.records.values()])
+        self.records = collections.OrderedDict()
+        self.ip_index = {}
+        self.task_index = {}
+        for (i, name) in enumerate(names):
+            if ips is not None:
+                self.add(name, ips[i] if i < len(ips) else None)
+            else:
+                self.add(name, old_ips.get(name))
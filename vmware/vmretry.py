@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python module provides the retry policy used by "vmwarevms.py" for the per virtual
+  machine vCenter tasks like clone and customize. A failed task is classified as a
+  transient or a permanent fault. Only the transient faults are retried, with exponential
+  backoff and a limited number of attempts per virtual machine.
+"""
+
+import random
+
+__all__ = ['retry_policy', 'classify_fault']
+
+# the vSphere faults that will fail again no matter how many times the task is retried
+PERMANENT_FAULTS = set([
+    'DuplicateName', 'FileAlreadyExists', 'InvalidArgument', 'InvalidName', 'InvalidDatastore',
+    'InvalidDatastorePath', 'InvalidType', 'InvalidRequest', 'InvalidLogin', 'NotFound', 'NotSupported',
+    'NoPermission', 'NotAuthenticated', 'ManagedObjectNotFound', 'NoDiskSpace', 'FileNotFound',
+    'CustomizationFault', 'MissingLinuxCustName', 'MissingWindowsCustResources', 'UncustomizableGuest',
+    'VmConfigFault', 'LicenseRestricted', 'RequestCanceled', 'InvalidPowerState', 'AlreadyExists',
+    'InvalidGuestLogin', 'GuestPermissionDenied', 'GuestComponentsOutOfDate', 'OperationNotSupportedByGuest',
+])
+
+# the python exceptions raised when the connection to vCenter is broken for a moment. The
+# modules are imported here, so importing this module does not load them at script start.
+def _transient_errors():
+    import socket
+    import http.client
+    return (ConnectionError, TimeoutError, socket.error, http.client.HTTPException)
+
+
+# Classify a vSphere fault or a python exception as 'transient' or 'permanent'. The
+# task error of a vCenter task is a LocalizedMethodFault, and its "fault" is classified.
+#
+def classify_fault(fault):
+    if fault is None:
+        return 'transient'
+    if( hasattr(fault, 'fault') and hasattr(fault, 'localizedMessage') ):
+        fault = fault.fault
+
+    if isinstance(fault, _transient_errors()):
+        return 'transient'
+
+    fault_name = getattr(fault, '_wsdlName', None) or type(fault).__name__
+    fault_name = fault_name.split('.')[-1]
+    return 'permanent' if fault_name in PERMANENT_FAULTS else 'transient'
+
+
+class retry_policy:
+    def __init__(self, max_attempts = 3, base_delay = 10, factor = 2, max_delay = 300):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+
+    # the seconds to wait before the next attempt, after "attempt" attempts have failed
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (self.factor ** (attempt - 1)))
+        return delay * random.uniform(0.8, 1.2)    # spread the retries of a batch
+
+    # whether a virtual machine task that has failed "attempt" times with fault can be retried
+    def should_retry(self, fault, attempt):
+        return attempt < self.max_attempts and classify_fault(fault) == 'transient'
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python module provides the adaptive concurrency controller used by "vmwarevms.py"
+  to decide how many vCenter tasks (clones, reconfigures and power operations) can be in
+  flight at the same time. The controller watches how long the tasks are queued in
+  vCenter, how long they run and how long the vCenter API calls take. It raises the
+  in-flight limit additively while vCenter keeps up, and cuts it multiplicatively when
+  vCenter becomes busy (AIMD), so the throughput settles near the best level without
+  hand tuning.
+"""
+
+import time
+
+__all__ = ['aimd_limiter']
+
+
+class aimd_limiter:
+    def __init__(self, name, initial = 10, minimum = 1, maximum = 64, increase = 1, decrease = 0.5,
+                 queued_target = 10.0, latency_target = 2.0, logger = None):
+        self.name = name
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.queued_target = queued_target      # seconds a task may be queued in vCenter before it runs
+        self.latency_target = latency_target    # seconds a vCenter API call may take
+        self.logger = logger
+
+        self.queued_times = []
+        self.run_times = []
+        self.api_latency = None
+        self.last_decrease = 0
+
+    # record the queued time and the run time of a finished task
+    def observe_task(self, queued_seconds, run_seconds):
+        if queued_seconds is not None:
+            self.queued_times.append(max(queued_seconds, 0))
+        if run_seconds is not None:
+            self.run_times.append(max(run_seconds, 0))
+        self.queued_times = self.queued_times[-50:]
+        self.run_times = self.run_times[-50:]
+
+    # record the latency of a vCenter API call as an exponential moving average
+    def observe_api(self, latency):
+        if self.api_latency is None:
+            self.api_latency = latency
+        else:
+            self.api_latency = 0.8 * self.api_latency + 0.2 * latency
+
+    def _average(self, values):
+        return sum(values) / len(values) if len(values) > 0 else None
+
+    # adjust the in-flight limit after every poll. in_flight is the number of running and queued
+    # tasks, queued is the number of tasks that are still queued in vCenter.
+    def adjust(self, in_flight, queued = 0):
+        old_limit = self.limit
+        avg_queued = self._average(self.queued_times[-10:])
+        busy = (queued > 0 and avg_queued is not None and avg_queued > self.queued_target) or \
+               (self.api_latency is not None and self.api_latency > self.latency_target)
+
+        if busy:
+            # decrease at most once per average task run time, so one slow period is not counted many times
+            hold = self._average(self.run_times[-10:]) or 0
+            if(time.time() - self.last_decrease >= hold):
+                self.limit = max(self.minimum, int(self.limit * self.decrease))
+                self.last_decrease = time.time()
+        elif(in_flight >= self.limit):
+            self.limit = min(self.maximum, self.limit + self.increase)
+
+        if(self.logger is not None and self.limit != old_limit):
+            self.logger.debug('%s in-flight limit changes from %d to %d (queued %s s, API latency %s s)' % \
+                              (self.name, old_limit, self.limit, avg_queued and round(avg_queued, 1), self.api_latency and round(self.api_latency, 2)))
+        return self.limit
+
+    # the time to wait before the next poll, about a quarter of the average task run time
+    def poll_interval(self, minimum = 2, maximum = 20):
+        avg_run = self._average(self.run_times[-10:])
+        if avg_run is None:
+            return minimum * 2
+        return min(maximum, max(minimum, avg_run / 4))
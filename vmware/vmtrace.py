@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python module provides the opt-in SOAP call tracing used by "vmwarevms.py". When the
+  environment variable VMWARE_SOAP_TRACE is set to a file name (the "-tr" option of
+  "vm_operation.py" sets it), every vCenter API call made through the pyVmomi stub adapter
+  is recorded with its method, target object type, calling "vms" method, latency and request
+  payload size. Lazy property reads like "tmp_vm.guest.toolsStatus" are recorded as "Fetch"
+  calls of the property. At script exit, a per-method summary (count, total and p95 latency)
+  is saved to the trace file, and the call stacks are saved in the folded flame graph format
+  to the trace file with the ".folded" suffix.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+
+__all__ = ['TRACE_ENV', 'trace_file', 'trace_stub', 'write_trace_report', 'soap_tracer']
+
+TRACE_ENV = 'VMWARE_SOAP_TRACE'
+
+
+# the trace file of this process, or None if the SOAP tracing is not enabled
+#
+def trace_file():
+    return os.environ.get(TRACE_ENV) or None
+
+
+def _p95(values):
+    values = sorted(values)
+    return values[max(0, int(len(values) * 0.95 + 0.5) - 1)]
+
+
+class soap_tracer:
+    def __init__(self, output_file, logger = None):
+        self.output_file = output_file
+        self.logger = logger
+        self.records = []    # (method, target type, caller, latency, request bytes, stack)
+        self.code_dir = os.path.dirname(os.path.abspath(__file__))
+        self.code_files = {}
+        self.local = threading.local()
+
+    # wrap the InvokeMethod and InvokeAccessor calls of a pyVmomi stub adapter. The request
+    # size is taken from the stub's request modifier hook.
+    def wrap(self, stub):
+        if getattr(stub, '_soap_tracer', None) is self:
+            return
+        stub._soap_tracer = self
+        stub.InvokeMethod = self._traced(stub.InvokeMethod, False)
+        stub.InvokeAccessor = self._traced(stub.InvokeAccessor, True)
+        if isinstance(getattr(stub, 'requestModifierList', None), list):
+            stub.requestModifierList.append(self._request_size)
+
+    def _request_size(self, request):
+        self.local.request_bytes = len(request)
+        return request
+
+    def _traced(self, invoke, accessor):
+        def traced_invoke(mo, info, *args, **kwargs):
+            # an accessor call goes through InvokeMethod, only the outer call is recorded
+            if getattr(self.local, 'depth', 0) > 0:
+                return invoke(mo, info, *args, **kwargs)
+
+            self.local.depth = 1
+            self.local.request_bytes = 0
+            start_time = time.perf_counter()
+            try:
+                return invoke(mo, info, *args, **kwargs)
+            finally:
+                latency = time.perf_counter() - start_time
+                self.local.depth = 0
+                if accessor:
+                    method = 'Fetch:%s' % info.name
+                else:
+                    method = getattr(info, 'wsdlName', None) or info.name
+                    if method == 'Fetch' and args:
+                        method = 'Fetch:%s' % args[0][0]
+                target = getattr(mo, '_wsdlName', type(mo).__name__)
+                (caller, stack) = self._call_stack()
+                self.records.append((method, target, caller, latency, self.local.request_bytes, stack))
+        return traced_invoke
+
+    # the calling functions of this package, outermost first, and the nearest "vms" method
+    def _call_stack(self):
+        stack, caller = [], None
+        frame = sys._getframe(2)
+        while frame is not None:
+            code = frame.f_code
+            code_file = self.code_files.get(code.co_filename)
+            if code_file is None:
+                path = os.path.abspath(code.co_filename)
+                code_file = os.path.basename(path) if os.path.dirname(path) == self.code_dir else ''
+                self.code_files[code.co_filename] = code_file
+            if code_file not in ('', 'vmtrace.py'):
+                stack.append(code.co_name)
+                if(caller is None and code_file == 'vmwarevms.py'):
+                    caller = code.co_name
+            frame = frame.f_back
+        stack.reverse()
+        return (caller or (stack[-1] if stack else '?'), tuple(stack))
+
+    def _summary(self, key_fn):
+        groups = {}
+        for record in self.records:
+            groups.setdefault(key_fn(record), []).append(record)
+        rows = []
+        for (key, records) in groups.items():
+            latencies = [record[3] for record in records]
+            rows.append({'name': key, 'count': len(records), 'total': round(sum(latencies), 3),
+                         'p95': round(_p95(latencies), 4), 'request_bytes': sum([record[4] for record in records])})
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows
+
+    # save the per-method and per-caller summaries and the folded stacks
+    def write_report(self):
+        if( len(self.records) == 0 ):
+            return
+        methods = self._summary(lambda record: '%s.%s' % (record[1], record[0]))
+        callers = self._summary(lambda record: '%s -> %s.%s' % (record[2], record[1], record[0]))
+        report = {'calls': len(self.records), 'total': round(sum([record[3] for record in self.records]), 3),
+                  'methods': methods, 'callers': callers}
+        try:
+            with open(self.output_file, 'w') as file_descr:
+                json.dump(report, file_descr, indent=1)
+
+            # folded stacks weighted by microseconds, for flamegraph.pl or speedscope
+            folded = {}
+            for record in self.records:
+                line = ';'.join(record[5] + ('%s.%s' % (record[1], record[0]),))
+                folded[line] = folded.get(line, 0) + int(record[3] * 1000000)
+            with open(self.output_file + '.folded', 'w') as file_descr:
+                for line in sorted(folded.keys()):
+                    file_descr.write('%s %d\n' % (line, folded[line]))
+        except (IOError, OSError) as error:
+            sys.stderr.write('Unable to write SOAP trace file %s. Error: %s\n' % (self.output_file, error))
+            return
+
+        if self.logger is not None:
+            self.logger.info('SOAP trace: %d calls, %.1f seconds in total, saved in %s' % (report['calls'], report['total'], self.output_file))
+            for row in callers[:15]:
+                self.logger.info('SOAP trace: %-60s %6d calls %8.1f s total %8.1f ms p95' % (row['name'], row['count'], row['total'], row['p95'] * 1000))
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+# Trace the SOAP calls of a pyVmomi stub adapter if the tracing is enabled. All the stubs of
+# the process share one tracer, and its report is saved at script exit.
+#
+def trace_stub(stub, logger = None):
+    global _tracer
+    output_file = trace_file()
+    if output_file is None:
+        return None
+    with _tracer_lock:
+        if _tracer is None or _tracer.output_file != output_file:
+            _tracer = soap_tracer(output_file, logger)
+            atexit.register(_tracer.write_report)
+        _tracer.wrap(stub)
+    return _tracer
+
+
+# Save the report of the SOAP tracer now, instead of at script exit. This is for the worker
+# processes that do not run the exit handlers.
+#
+def write_trace_report():
+    with _tracer_lock:
+        tracer = _tracer
+    if tracer is not None:
+        atexit.unregister(tracer.write_report)
+        tracer.write_report()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+  Description:
+
+  This python module provides the HTTP side of the guest file transfer used by
+  "vmwarevms.py". The file transfer URLs returned by vCenter point to the ESXi hosts, and
+  the files are streamed to them chunk by chunk over a pool of keep-alive HTTPS
+  connections, so a large payload is never read into memory and the connections are
+  reused across files and virtual machines. The local file checksums are computed once
+  and shared by all the virtual machines.
+"""
+
+import os
+import ssl
+import hashlib
+import threading
+import http.client
+import urllib.parse
+
+__all__ = ['http_pool', 'file_checksum']
+
+_checksums = {}
+_checksums_lock = threading.Lock()
+
+
+# sha256 checksum of a local file, computed once per file and modification time
+#
+def file_checksum(path, chunk_size = 1 << 20):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    with _checksums_lock:
+        if key in _checksums:
+            return _checksums[key]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_descr:
+        for chunk in iter(lambda: file_descr.read(chunk_size), b''):
+            digest.update(chunk)
+    with _checksums_lock:
+        _checksums[key] = digest.hexdigest()
+    return _checksums[key]
+
+
+# Pool of keep-alive HTTP(S) connections by host. A connection is taken from the pool for
+# one request and put back when the response is fully read.
+#
+class http_pool:
+    def __init__(self, ssl_check = False, timeout = 300, chunk_size = 1 << 20):
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.idle = {}    # (scheme, netloc) -> [connection]
+        self.lock = threading.Lock()
+        if(ssl_check == True):
+            self.context = ssl.create_default_context()
+        else:
+            self.context = ssl._create_unverified_context()
+
+    def _new(self, key):
+        (scheme, netloc) = key
+        if(scheme == 'https'):
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self.context)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    # an idle connection of the host and True, or a new connection and False
+    def _get(self, key):
+        with self.lock:
+            if( len(self.idle.get(key, [])) > 0 ):
+                return (self.idle[key].pop(), True)
+        return (self._new(key), False)
+
+    def _put_back(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+    def _send(self, conn, method, path, body, size):
+        conn.putrequest(method, path)
+        conn.putheader('Content-Length', str(size))
+        conn.putheader('Content-Type', 'application/octet-stream')
+        conn.endheaders()
+        if isinstance(body, bytes):
+            conn.send(body)
+        elif body is not None:
+            with open(body, 'rb') as file_descr:
+                for chunk in iter(lambda: file_descr.read(self.chunk_size), b''):
+                    conn.send(chunk)
+        response = conn.getresponse()
+        return (response, response.read())
+
+    # Send one request. body is None, bytes or a local file path that is streamed.
+    # Return (HTTP status, response data).
+    def request(self, method, url, body = None):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        if body is None:
+            size = 0
+        elif isinstance(body, bytes):
+            size = len(body)
+        else:
+            size = os.path.getsize(body)
+
+        (conn, reused) = self._get(key)
+        try:
+            (response, data) = self._send(conn, method, path, body, size)
+        except (http.client.HTTPException, ConnectionError):
+            conn.close()
+            if not reused:
+                raise
+            # the server has closed the idle keep-alive connection, send it again on a new one
+            conn = self._new(key)
+            try:
+                (response, data) = self._send(conn, method, path, body, size)
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._put_back(key, conn)
+        return (response.status, data)
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
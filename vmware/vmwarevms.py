@@ -25,16 +25,49 @@ import logging
 import re
 import copy
 import time
+import os
+import json
+import collections
+import heapq
+import threading
+import concurrent.futures
 
 from autoutil import *
-
-from pyVim.connect import SmartConnect, SmartConnectNoSSL, Disconnect
-from pyVmomi import vim, vmodl
+from vminventory import *
+from vmthrottle import *
+from vmretry import *
+from vmtrace import *
+from vmprobe import *
+from vmrecords import *
+
+# pyVmomi takes seconds to import, it is only loaded when a vms method uses the vim types
+vim = lazy_module('pyVmomi', 'vim')
+vmodl = lazy_module('pyVmomi', 'vmodl')
+
+# the vCenter connections of this process, disconnected at script exit
+_connections = []
+
+# Disconnect all the vCenter connections of this process now, instead of at script exit.
+# This is for the worker processes that do not run the exit handlers.
+#
+def disconnect_vcenters():
+    if( len(_connections) == 0 ):
+        return
+    from pyVim.connect import Disconnect
+    atexit.unregister(Disconnect)
+    while( len(_connections) > 0 ):
+        conn_obj = _connections.pop()
+        try:
+            Disconnect(conn_obj)
+        except Exception as exp:
+            logging.getLogger(__name__).warning('Having problem while disconnecting from vcenter. Exception: %s' % exp)
 
 class vms:
     def __init__(self, vc_name = None, vc_user = None, vc_pw = None, vc_ssl_check = False, vc_port = 443, base_vmname = None, count = 1, template = None,
                  vm_user = None, vm_password = None, hostname_update = False, data_center = None, folder = None, cluster = None, esx = None, data_store = None, 
-                 network = None, network_vds = True, static_ip = False, power_on = True, snapshot_name = None, logger = None, tmplogfile = None):
+                 network = None, network_vds = True, static_ip = False, power_on = True, snapshot_name = None, logger = None, tmplogfile = None,
+                 template_replica = False, replica_cache = None, retry_attempts = 3, probe_ports = None,
+                 payload_files = None, payload_dest = None):
  
         # initialize class object values
         self.vc_name = vc_name
@@ -60,6 +93,11 @@ class vms:
         self.snapshot_name = snapshot_name
         self.logger = logger
         self.tmplogfile = tmplogfile
+        self.template_replica = template_replica
+        self.replica_cache = replica_cache if replica_cache else '.template_replicas.json'
+        self.probe_ports = probe_ports    # None for the default port of the OS, [] to use fixed waits
+        self.payload_files = payload_files    # local files pushed into payload_dest of the guests after the deployment
+        self.payload_dest = payload_dest
 
         self.conn_obj = None
         self.conn_content = None
@@ -67,9 +105,21 @@ class vms:
         self.folder_obj = None
         self.vm_spec = None
         self.vm_ostype = None
+        self.plan_inventory = None
+        self.network_obj = None
+        self.known_vms = {}    # virtual machine objects found by a bulk read, by name
+
+        # failed clone and customize tasks are retried per virtual machine on transient faults
+        self.retry = retry_policy(max_attempts=retry_attempts)
 
-        self.vm_list = []
-        self.static_ip_list = []
+        # adaptive in-flight limits of the clone, reconfigure and power tasks
+        self.limiters = {'clone': aimd_limiter('clone', initial=10, logger=logger),
+                         'reconfigure': aimd_limiter('reconfigure', initial=20, logger=logger),
+                         'power': aimd_limiter('power', initial=20, logger=logger),
+                         'snapshot': aimd_limiter('snapshot', initial=10, logger=logger),
+                         'destroy': aimd_limiter('destroy', initial=20, logger=logger)}
+
+        self.records = vm_records()    # per virtual machine name, static IP address and task
         self.vm_netmask = None 
         self.vm_gateway = None 
         self.vm_dns = None 
@@ -78,13 +128,42 @@ class vms:
             tmp_vm_list = build_vmname(self.base_vmname, self.count)
             self.vm_list = copy.deepcopy(tmp_vm_list)
         self.deployed_vm = []  #not every vm in self.vm_list can be deployed
+        self.cloned_vm = []    #the virtual machines this run has started to clone
+
+        # the in-flight tasks are tracked, so they can all be cancelled when the run is aborted
+        self.active_tasks = {}    # task moref -> (vm_name, task)
+        self.abort_event = threading.Event()
+        self.abort_done = threading.Event()
+        self.abort_reason = None
 
 
-    # set up VMs static ip information
+    # the virtual machine names, in deployment order. Setting it keeps the static IP addresses
+    # of the virtual machines that stay.
+    #
+    @property
+    def vm_list(self):
+        return self.records.names()
+
+    @vm_list.setter
+    def vm_list(self, names):
+        self.records.reset(names)
+
+
+    # the static IP addresses of the virtual machines, in deployment order
+    #
+    @property
+    def static_ip_list(self):
+        return self.records.ip_list()
+
+    @static_ip_list.setter
+    def static_ip_list(self, ips):
+        self.records.reset(self.records.names(), ips)
+
+
+    # set up VMs static ip information. The IP addresses are given to the virtual machines in order.
     #
     def set_static_ip(self, iplist, netmask, gateway, dns):
-        for ip in iplist:
-            self.static_ip_list.append(ip)
+        self.static_ip_list = list(iplist)
         self.vm_netmask = netmask
         self.vm_gateway = gateway
         self.vm_dns = dns
@@ -96,33 +175,36 @@ class vms:
         self.logger.info("Checking static IP setup for virtual machine")
 
         timeout = int(time.time()) + 3600
-        while( int(time.time()) < timeout ):
+        while( int(time.time()) < timeout and not self.abort_event.is_set() ):
             self.logger.info('-'*15 + "Waiting for static IP setup for virtual machine" + '-'*15)
-            vm_ips = self.get_vm_ip()    #   in the format of [{'vm_name': 'vm1', 'vm_ip': '192.168.51.x'},,]
-
-            boot_vm_ips = []
-            for vm in vm_ips:
-                if( vm["vm_ip"] != None and len(vm["vm_ip"]) > 0 ):
-                    boot_vm_ips.append(vm["vm_ip"])
-
-            count = 0
-            for ip in self.static_ip_list:
-                if(ip in boot_vm_ips):
-                    count = count + 1 
+            boot_vm_ips = set(self._vm_ips().values())    # read in one bulk query
 
-            if(count == len(self.static_ip_list)):
+            static_ips = self.records.ip_list()
+            count = len([ip for ip in static_ips if ip in boot_vm_ips])
+            if(count == len(static_ips)):
                 self.logger.info("The static IP setup is completed for all the VMs")
                 return 0
             self.logger.info("The static IP setup is still not completed for all the VMs")
-            time.sleep(30)
+            self.abort_event.wait(30)
                 
+        if self.abort_event.is_set():
+            self.logger.warning("Checking static IP setup is aborted")
+            return 1
         self.logger.warning("The static IP setup can not be completed for all the VMs within one hour")
         return 1
 
 
-    # locate object from vCenter by calling vSphere API
+    # locate object from vCenter by calling vSphere API. The object resolved in the
+    # deployment plan inventory is used directly without walking the vCenter inventory.
     #
     def locate_obj(self, name, vimtype):
+        if(vimtype == [vim.VirtualMachine] and name in self.known_vms):
+            return self.known_vms[name]
+        if(self.plan_inventory != None and len(vimtype) == 1):
+            moid = self.plan_inventory["objects"].get(self._obj_key(vimtype[0], name))
+            if(moid != None):
+                return vimtype[0](moid, self.conn_obj._stub)
+
         content = self.conn_content
         vcobj_view = content.viewManager.CreateContainerView(content.rootFolder, vimtype, True)
         vcobj_list = vcobj_view.view
@@ -138,9 +220,151 @@ class vms:
         return ret_obj 
 
 
+    def _obj_key(self, vimtype, name):
+        return '%s:%s' % (vimtype._wsdlName, name)
+
+
+    # retrieve the properties in path_set of all the vCenter objects of vimtypes in one
+    # property collector call. path_set is a list of properties for all the vimtypes, or a
+    # {vimtype: list of properties} dictionary. If obj_list is provided, only the objects in
+    # obj_list are retrieved. Return a list of (object, {property name: property value}).
+    #
+    def retrieve_props(self, vimtypes, path_set, obj_list = None):
+        content = self.conn_content
+        property_collector = content.propertyCollector
+        obj_view = None
+
+        if(obj_list == None):
+            obj_view = content.viewManager.CreateContainerView(content.rootFolder, vimtypes, True)
+            traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name='traverseEntities', path='view', skip=False,
+                                                                         type=vim.view.ContainerView)
+            obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=obj_view, skip=True, selectSet=[traversal_spec])]
+        else:
+            obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=obj) for obj in obj_list]
+
+        if not isinstance(path_set, dict):
+            path_set = dict([(vimtype, path_set) for vimtype in vimtypes])
+        prop_specs = [vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=path_set[vimtype], all=False) for vimtype in vimtypes]
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs, propSet=prop_specs)
+
+        obj_props = []
+        try:
+            result = property_collector.RetrievePropertiesEx([filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+            while result:
+                for obj_content in result.objects:
+                    props = {}
+                    for prop in obj_content.propSet:
+                        props[prop.name] = prop.val
+                    obj_props.append((obj_content.obj, props))
+                if not result.token:
+                    break
+                result = property_collector.ContinueRetrievePropertiesEx(result.token)
+        finally:
+            if obj_view:
+                obj_view.Destroy()
+        return obj_props
+
+
+    # locate the virtual machines in vm_names with one inventory retrieval.
+    # Return {vm_name: virtual machine object} of the virtual machines that exist.
+    #
+    def locate_vms(self, vm_names):
+        wanted = set(vm_names)
+        vm_objs = {}
+        for (obj, props) in self.retrieve_props([vim.VirtualMachine], ['name']):
+            name = props.get('name')
+            if name in wanted and name not in vm_objs:
+                vm_objs[name] = obj
+        return vm_objs
+
+
+    # set up the vCenter object inventory resolved in the deployment plan
+    #
+    def set_plan_inventory(self, inventory):
+        self.plan_inventory = copy.deepcopy(inventory) if inventory else None
+
+
+    # the vCenter objects this deployment needs: template, datacenter, cluster, ESXi host,
+    # folder, datastore and network
+    #
+    def _plan_obj_names(self):
+        obj_names = [(vim.VirtualMachine, str(self.template))]
+        if self.data_center:
+            obj_names.append((vim.Datacenter, str(self.data_center)))
+        if self.cluster:
+            obj_names.append((vim.ClusterComputeResource, str(self.cluster)))
+        if self.esx:
+            obj_names.append((vim.HostSystem, str(self.esx)))
+        if self.folder:
+            obj_names.append((vim.Folder, str(self.folder)))
+        if self.data_store:
+            obj_names.append((vim.Datastore, str(self.data_store)))
+        if self.network:
+            if self.network_vds == False:
+                obj_names.append((vim.Network, str(self.network)))
+            else:
+                obj_names.append((vim.dvs.DistributedVirtualPortgroup, str(self.network)))
+        return obj_names
+
+
+    # resolve all the vCenter objects this deployment needs in one inventory retrieval.
+    # The cached plan inventory is reused if it is from the same vCenter and all its objects
+    # still have the same names. All the objects that can not be found are reported together.
+    #
+    def resolve_objects(self):
+        obj_names = self._plan_obj_names()
+        vcenter_uuid = self.conn_content.about.instanceUuid
+
+        inventory = self.plan_inventory
+        if(inventory != None and inventory.get("vcenter_uuid") == vcenter_uuid):
+            obj_list, cached = [], True
+            for (vimtype, name) in obj_names:
+                moid = inventory["objects"].get(self._obj_key(vimtype, name))
+                if(moid == None):
+                    cached = False
+                    break
+                obj_list.append(vimtype(moid, self.conn_obj._stub))
+
+            if(cached == True):
+                try:
+                    vimtypes = list(set([vimtype for (vimtype, name) in obj_names]))
+                    obj_props = self.retrieve_props(vimtypes, ["name"], obj_list)
+                    found = set([(obj._moId, props.get("name")) for (obj, props) in obj_props])
+                    if( all([(obj._moId, name) in found for (obj, (vimtype, name)) in zip(obj_list, obj_names)]) ):
+                        self.logger.info('Using vCenter objects resolved in the deployment plan')
+                        return 0
+                except Exception as exp:
+                    self.logger.debug('Cached deployment plan objects are out of date. Exception: %s' % exp)
+
+        self.logger.info('Resolving vCenter objects for the deployment plan')
+        vimtypes = list(set([vimtype for (vimtype, name) in obj_names]))
+        vcobj_names = {}
+        for (obj, props) in self.retrieve_props(vimtypes, ["name"]):
+            vcobj_names.setdefault(props.get("name"), []).append(obj)
+
+        objects, rc = {}, 0
+        for (vimtype, name) in obj_names:
+            found = [obj for obj in vcobj_names.get(name, []) if isinstance(obj, vimtype)]
+            if( len(found) == 0 ):
+                self.logger.warning('Unable to find %s %s from vcenter %s' % (vimtype._wsdlName, name, self.vc_name))
+                rc = 1
+                continue
+            objects[self._obj_key(vimtype, name)] = found[0]._moId
+
+        if(rc != 0):
+            return rc
+
+        if(inventory == None or inventory.get("vcenter_uuid") != vcenter_uuid):
+            self.plan_inventory = {"vcenter_uuid": vcenter_uuid, "objects": objects}
+        else:
+            self.plan_inventory["objects"].update(objects)
+        return 0
+
+
     # connect to vCenter
     #
     def connect_vc(self):
+        from pyVim.connect import SmartConnect, SmartConnectNoSSL, Disconnect
         try:
             if(self.vc_ssl_check == False):
                 self.conn_obj = SmartConnectNoSSL(host=self.vc_name, user=self.vc_user, pwd=self.vc_pw, port=self.vc_port)
@@ -148,7 +372,9 @@ class vms:
                 self.conn_obj = SmartConnect(host=self.vc_name, user=self.vc_user, pwd=self.vc_pw, port=self.vc_port)
 
             atexit.register(Disconnect, self.conn_obj)
+            _connections.append(self.conn_obj)
             self.logger.debug('Registering disconnect at script exit')
+            trace_stub(self.conn_obj._stub, self.logger)
         except IOError as error:
             self.logger.warning('Having ioerror while connecting to vcenter %s. Error: %s' % (self.vc_name, error)) 
         except Exception as exp:
@@ -173,6 +399,12 @@ class vms:
             self.logger.info('Error connecting to vCenter %s' % self.vc_name)
             return rc 
 
+        # resolve all the user specified objects at once to fail fast on typos
+        rc = self.resolve_objects()
+        if(rc != 0):
+            self.logger.warning('Unable to resolve the user specified objects from vCenter %s' % self.vc_name)
+            return rc
+
         # locate the user specified template
         self.logger.debug('Trying to get template %s details' % self.template)
         self.template_obj = self.locate_obj( str(self.template), [vim.VirtualMachine] )
@@ -263,6 +495,14 @@ class vms:
                 return 1
             self.logger.info('Successfully retrieve datastore from template %s' % self.template)
 
+        # clone from the template replica on the target datastore, so every clone is a same datastore copy
+        if(self.template_replica == True and data_store._moId not in [ds._moId for ds in self.template_obj.datastore]):
+            replica_obj = self.get_template_replica(data_store)
+            if not replica_obj:
+                self.logger.warning('Unable to get template %s replica on datastore %s' % (self.template, data_store.name))
+                return 1
+            self.template_obj = replica_obj
+
         # create place holder for specifications
         relocate_spec = vim.vm.RelocateSpec()
         if resource_pool:
@@ -279,6 +519,113 @@ class vms:
         # done with build_vm_spec
 
 
+    # the template replica cache maps a vCenter template to its replicas on other datastores:
+    # {vcenter_uuid: {template_name: {datastore_name: replica_name}}}
+    #
+    def _load_replica_cache(self):
+        try:
+            with open(self.replica_cache, 'r') as file_descr:
+                return json.load(file_descr)
+        except (IOError, ValueError):
+            return {}
+
+
+    def _save_replica_cache(self, template_name, datastore_name, replica_name):
+        replica_map = self._load_replica_cache()
+        vc_replicas = replica_map.setdefault(self.conn_content.about.instanceUuid, {})
+        vc_replicas.setdefault(template_name, {})[datastore_name] = replica_name
+
+        tmp_file = self.replica_cache + '.%d' % os.getpid()
+        try:
+            with open(tmp_file, 'w') as file_descr:
+                json.dump(replica_map, file_descr, indent=1)
+            os.replace(tmp_file, self.replica_cache)
+        except (IOError, OSError) as error:
+            self.logger.warning('Unable to save template replica cache %s. Error: %s' % (self.replica_cache, error))
+
+
+    def _replica_name(self, datastore_name):
+        return '%s-replica-%s' % (self.template, re.sub(r'[^\w.-]', '_', datastore_name))
+
+
+    # check whether replica_obj is a template on data_store
+    #
+    def _valid_replica(self, replica_obj, data_store):
+        try:
+            return replica_obj.config.template == True and data_store._moId in [ds._moId for ds in replica_obj.datastore]
+        except Exception:
+            return False
+
+
+    # get the replica of the template on data_store. The replica recorded in the template
+    # replica cache or an existing replica with the replica name is reused. Otherwise the
+    # template is copied to data_store once and the replica is recorded in the cache.
+    #
+    def get_template_replica(self, data_store):
+        datastore_name = data_store.name
+        replica_map = self._load_replica_cache()
+        replica_name = replica_map.get(self.conn_content.about.instanceUuid, {}).get(str(self.template), {}).get(datastore_name)
+
+        for name in [replica_name, self._replica_name(datastore_name)]:
+            if not name:
+                continue
+            replica_obj = self.locate_obj(name, [vim.VirtualMachine])
+            if replica_obj and self._valid_replica(replica_obj, data_store):
+                self.logger.info('Using template %s replica %s on datastore %s' % (self.template, name, datastore_name))
+                if(name != replica_name):
+                    self._save_replica_cache(str(self.template), datastore_name, name)
+                return replica_obj
+
+        rc = self.replicate_template([datastore_name])
+        if(rc != 0):
+            return None
+        return self.locate_obj(self._replica_name(datastore_name), [vim.VirtualMachine])
+
+
+    # copy the template to every datastore in datastore_names at the same time. The replicas that
+    # already exist are not copied again. The replicas are recorded in the template replica cache.
+    #
+    def replicate_template(self, datastore_names):
+        if not self.template_obj:
+            self.template_obj = self.locate_obj(str(self.template), [vim.VirtualMachine])
+            if not self.template_obj:
+                self.logger.warning('Unable to retrieve template %s' % self.template)
+                return 1
+
+        data_stores = []
+        for datastore_name in datastore_names:
+            data_store = self.locate_obj(str(datastore_name), [vim.Datastore])
+            if not data_store:
+                self.logger.warning('Unable to retrieve data store %s' % datastore_name)
+                return 1
+            data_stores.append(data_store)
+
+        replica_tasks = {}
+        replica_result = {}
+        replica_datastores = {}
+        task_msg = 'Template %s replicating' % self.template
+        for data_store in data_stores:
+            replica_name = self._replica_name(data_store.name)
+            replica_obj = self.locate_obj(replica_name, [vim.VirtualMachine])
+            if replica_obj and self._valid_replica(replica_obj, data_store):
+                self._save_replica_cache(str(self.template), data_store.name, replica_name)
+                continue
+
+            self.logger.info('Start copying template %s to datastore %s as %s' % (self.template, data_store.name, replica_name))
+            relocate_spec = vim.vm.RelocateSpec(datastore=data_store)
+            clone_spec = vim.vm.CloneSpec(powerOn=False, template=True, location=relocate_spec)
+            replica_tasks[replica_name] = self.template_obj.Clone(name=replica_name, folder=self.template_obj.parent, spec=clone_spec)
+            replica_datastores[replica_name] = data_store.name
+
+        if( len(replica_tasks) == 0 ):
+            return 0
+
+        self.wait_task_finish(replica_tasks, replica_result, task_msg, 3600)
+        for replica_name in replica_result.keys():
+            self._save_replica_cache(str(self.template), replica_datastores[replica_name], replica_name)
+        return 0 if( len(replica_result) == len(replica_tasks) ) else 1
+
+
     # migrate virtual machine to user specified ESXi host
     #
     def relocate_vm(self):
@@ -321,7 +668,8 @@ class vms:
 
         # need to disable vm's DRS migration to avoid automatic vmotion
         self.logger.info('Start updating virtual machine DRS migration') 
-        time.sleep(15)
+        if self.abort_event.wait(15):
+            return 1
         vm_updated = {}
         vm_result = {}
         task_msg = 'Virtual machine DRS migration updating' 
@@ -351,49 +699,354 @@ class vms:
         return rc
 
 
+    # write a structured task event into the deploy record
+    #
+    def _task_event(self, vm, task_msg, state, info = None):
+        duration = None
+        if(info != None and info.startTime != None and info.completeTime != None):
+            duration = round((info.completeTime - info.startTime).total_seconds(), 3)
+        writeevent(self.tmplogfile, vm=vm, phase=task_msg, state=state, duration=duration)
+
+
     # wait for task to complete
     #
     def wait_task_finish(self, vm_deployed, vm_result, task_msg, timeout):
-        while(timeout > 0):
-            vm_num = len(vm_deployed.keys())
+        timeout_value = timeout
+        vm_num = len(vm_deployed.keys())
+        progress = progress_reporter(self.logger, task_msg, vm_num)
+        timer = aimd_limiter(task_msg)    # only used for the poll interval
+        self._track_tasks(vm_deployed)
+
+        while(timeout > 0 and not self.abort_event.is_set()):
             count = 0
-            self.logger.info( ('-'*15 + "Waiting for %s" + '-'*15) % task_msg )
+            # poll all the tasks with one property collector call
+            task_vms = {}
+            for vm in vm_deployed.keys():
+                task_vms[vm_deployed[vm]._moId] = vm
+            task_infos = {}
+            for (task, props) in self.retrieve_props([vim.Task], ['info'], list(vm_deployed.values())):
+                task_infos[task_vms[task._moId]] = props.get('info')
 
             for vm in vm_deployed.keys():
-                task = vm_deployed[vm]
-                info = task.info
+                info = task_infos.get(vm)
+                if info == None:
+                    continue
+                prev_state = progress.states.get(vm)
+                if(prev_state not in ('success', 'error') and info.state in (vim.TaskInfo.State.success, vim.TaskInfo.State.error) and
+                   info.startTime != None and info.completeTime != None):
+                    timer.observe_task(None, (info.completeTime - info.startTime).total_seconds())
 
                 if info.state == vim.TaskInfo.State.success:
-                    self.logger.info('%s %s is successfully done' % (task_msg, vm))
+                    if(prev_state != 'success'):
+                        self.logger.debug('%s %s is successfully done' % (task_msg, vm))
+                        self._task_event(vm, task_msg, 'success', info)
+                    progress.update(vm, 'success')
                     vm_result[vm] = 1
                     count = count + 1
                 elif info.state == vim.TaskInfo.State.running:
-                    self.logger.info('%s %s is still running and task is at %s percent' % (task_msg, vm, info.progress))
+                    progress.update(vm, 'running', info.progress)
                 elif info.state == vim.TaskInfo.State.queued:
-                    self.logger.info('%s %s task is queued' % (task_msg, vm))
+                    progress.update(vm, 'queued')
                 elif info.state == vim.TaskInfo.State.error:
-                    if info.error.fault:
-                        self.logger.warning('%s %s task has quit with error: %s' % (task_msg, vm, info.error.fault.faultMessage))
-                    else:
-                        self.logger.warning('%s %s task has quit with cancelation' % (task_msg, vm))
+                    if(prev_state != 'error'):
+                        if info.error.fault:
+                            self.logger.warning('%s %s task has quit with error: %s' % (task_msg, vm, info.error.fault.faultMessage))
+                        else:
+                            self.logger.warning('%s %s task has quit with cancelation' % (task_msg, vm))
+                        self._task_event(vm, task_msg, 'error', info)
+                    progress.update(vm, 'error')
                     count = count + 1
 
+            progress.report(count == vm_num)
             if(count == vm_num):
-                return 0 
+                self._untrack_tasks(vm_deployed)
+                # a failed task is done, but it is not a success
+                return 0 if len(vm_result) == vm_num else 1
 
-            time.sleep(20)
-            timeout = timeout - 20
+            poll_interval = timer.poll_interval()
+            self.abort_event.wait(poll_interval)
+            timeout = timeout - poll_interval
 
-        self.logger.warning("Task %s does not finish within %d seconds" % (task_msg, timeout))
+        if self.abort_event.is_set():
+            self.logger.warning("Task %s is aborted" % task_msg)
+            return 1
+        self.logger.warning("Task %s does not finish within %d seconds" % (task_msg, timeout_value))
+        self.abort('%s does not finish within %d seconds' % (task_msg, timeout_value))
         return 1 
 
 
-    def _get_task_vm(self, task, task_d):
-        task_str = str(task)
-        for vm in task_d.keys():
-            if( task_str == str(task_d[vm]) ):
-                return vm
-        return None
+    # submit the tasks of vm_names through submit_fn and wait for them to complete. The number of
+    # tasks in flight is bounded by the adaptive limiter of this kind of task, and all the in-flight
+    # tasks are polled with one property collector call. submit_fn(vm_name) returns the task, or None
+    # if the virtual machine is skipped. A task that fails with a transient fault is resubmitted for
+    # that virtual machine only, with backoff, after cleanup_fn(vm_name) removes what the failed task
+    # has left behind. The operation times out if no task completes within timeout seconds.
+    # on_done(vm_name, state, message) is called as soon as a virtual machine is done with the
+    # state 'success', 'error' or 'skipped'.
+    # Return (rc, vm_result) where vm_result has the virtual machines whose tasks succeed.
+    #
+    def run_task_window(self, vm_names, submit_fn, task_msg, kind, timeout, cleanup_fn = None, on_done = None):
+        limiter = self.limiters[kind]
+        pending = collections.deque(vm_names)
+        retry_queue = []  # heap of (retry time, vm_name)
+        attempts = {}     # vm_name -> attempts made
+        in_flight = {}    # task moref -> (vm_name, task)
+        vm_result = {}
+        vm_failed = []
+        progress = progress_reporter(self.logger, task_msg, len(vm_names), done_states=('success', 'error', 'skipped'))
+        deadline = time.time() + timeout
+
+        while( (len(pending) > 0 or len(in_flight) > 0 or len(retry_queue) > 0) and time.time() < deadline and
+               not self.abort_event.is_set() ):
+            while( len(in_flight) < limiter.limit and not self.abort_event.is_set() ):
+                if( len(retry_queue) > 0 and retry_queue[0][0] <= time.time() ):
+                    vm_name = heapq.heappop(retry_queue)[1]
+                    if( cleanup_fn != None and cleanup_fn(vm_name) != 0 ):
+                        self.logger.warning('Unable to clean up virtual machine %s before retrying %s' % (vm_name, task_msg))
+                        vm_failed.append(vm_name)
+                        self._vm_done(progress, on_done, vm_name, 'error', 'cleanup before retry fails')
+                        continue
+                elif( len(pending) > 0 ):
+                    vm_name = pending.popleft()
+                else:
+                    break
+
+                attempts[vm_name] = attempts.get(vm_name, 0) + 1
+                try:
+                    task = submit_fn(vm_name)
+                except Exception as exp:
+                    self.logger.warning('Catching exception while submitting %s task for virtual machine %s. Exception details: %s' % (task_msg, vm_name, exp))
+                    if self._schedule_retry(vm_name, exp, attempts[vm_name], retry_queue, task_msg):
+                        progress.update(vm_name, 'retrying')
+                    else:
+                        vm_failed.append(vm_name)
+                        self._vm_done(progress, on_done, vm_name, 'error', str(exp))
+                    continue
+                if task is None:
+                    self._vm_done(progress, on_done, vm_name, 'skipped')
+                    continue
+                in_flight[task._moId] = (vm_name, task)
+                self.active_tasks[task._moId] = (vm_name, task)
+                progress.update(vm_name, 'queued')
+
+            if( len(in_flight) == 0 ):
+                if( len(retry_queue) > 0 ):
+                    self.abort_event.wait(max(0, retry_queue[0][0] - time.time()))
+                continue
+
+            self.abort_event.wait(limiter.poll_interval())
+            start_time = time.time()
+            obj_props = self.retrieve_props([vim.Task], ['info'], [task for (vm_name, task) in in_flight.values()])
+            limiter.observe_api(time.time() - start_time)
+
+            polled, queued = len(in_flight), 0
+            for (task, props) in obj_props:
+                info = props.get('info')
+                if( info == None or task._moId not in in_flight ):
+                    continue
+                vm_name = in_flight[task._moId][0]
+
+                if info.state in (vim.TaskInfo.State.success, vim.TaskInfo.State.error):
+                    del in_flight[task._moId]
+                    self.active_tasks.pop(task._moId, None)
+                    deadline = time.time() + timeout
+                    if(info.startTime != None and info.completeTime != None):
+                        limiter.observe_task((info.startTime - info.queueTime).total_seconds() if info.queueTime else None,
+                                             (info.completeTime - info.startTime).total_seconds())
+                    if info.state == vim.TaskInfo.State.success:
+                        vm_result[vm_name] = 1
+                        self._vm_done(progress, on_done, vm_name, 'success')
+                        self._task_event(vm_name, task_msg, 'success', info)
+                    else:
+                        fault_msg = info.error.msg if info.error else 'cancelation'
+                        self.logger.warning('%s %s task has quit with error: %s' % (task_msg, vm_name, fault_msg))
+                        self._task_event(vm_name, task_msg, 'error', info)
+                        if self._schedule_retry(vm_name, info.error, attempts[vm_name], retry_queue, task_msg):
+                            progress.update(vm_name, 'retrying')
+                        else:
+                            vm_failed.append(vm_name)
+                            self._vm_done(progress, on_done, vm_name, 'error', fault_msg)
+                elif info.state == vim.TaskInfo.State.queued:
+                    queued = queued + 1
+                    progress.update(vm_name, 'queued')
+                else:
+                    progress.update(vm_name, 'running', info.progress)
+
+            limiter.adjust(polled, queued)
+            progress.report( len(pending) == 0 and len(in_flight) == 0 and len(retry_queue) == 0 )
+
+        if self.abort_event.is_set():
+            self.logger.warning("Task %s is aborted" % task_msg)
+            return (1, vm_result)
+        if( len(pending) > 0 or len(in_flight) > 0 or len(retry_queue) > 0 ):
+            self.logger.warning("Task %s does not finish: no task completes within %d seconds" % (task_msg, timeout))
+            self.abort('%s does not finish: no task completes within %d seconds' % (task_msg, timeout))
+            return (1, vm_result)
+        if( len(vm_failed) > 0 ):
+            self.logger.warning('%s fails for virtual machines: %s' % (task_msg, ', '.join(vm_failed)))
+        return (0 if len(vm_failed) == 0 else 1, vm_result)
+
+
+    def _vm_done(self, progress, on_done, vm_name, state, message = None):
+        progress.update(vm_name, state)
+        if on_done != None:
+            on_done(vm_name, state, message)
+
+
+    # schedule the task of a virtual machine to be resubmitted after backoff, if its fault is
+    # transient and the virtual machine has attempts left. Return True if it is scheduled.
+    #
+    def _schedule_retry(self, vm_name, fault, attempt, retry_queue, task_msg):
+        if not self.retry.should_retry(fault, attempt):
+            if( classify_fault(fault) == 'permanent' ):
+                self.logger.warning('%s %s has failed with a permanent fault, not retrying' % (task_msg, vm_name))
+            else:
+                self.logger.warning('%s %s has failed %d times, not retrying' % (task_msg, vm_name, attempt))
+            return False
+
+        delay = self.retry.delay(attempt)
+        self.logger.info('Retrying %s %s in %d seconds (attempt %d of %d)' % (task_msg, vm_name, delay, attempt + 1, self.retry.max_attempts))
+        writeevent(self.tmplogfile, vm=vm_name, phase=task_msg, state='retrying', attempt=attempt + 1)
+        heapq.heappush(retry_queue, (time.time() + delay, vm_name))
+        return True
+
+
+    # remove the virtual machine left behind by a failed clone task, so the clone can be retried
+    #
+    def _cleanup_vm(self, vm_name):
+        tmp_vm = self.locate_vms([vm_name]).get(vm_name)
+        if tmp_vm == None:
+            return 0
+
+        self.logger.info('Removing partially created virtual machine %s' % vm_name)
+        self.known_vms.pop(vm_name, None)
+        try:
+            if(tmp_vm.runtime.powerState == vim.VirtualMachinePowerState.poweredOn):
+                rc = self.wait_task_finish({vm_name: tmp_vm.PowerOffVM_Task()}, {}, 'Virtual machine power off', 600)
+                if(rc != 0): return rc
+            return self.wait_task_finish({vm_name: tmp_vm.Destroy_Task()}, {}, 'Deleting virtual machine', 600)
+        except Exception as exp:
+            self.logger.warning('Catching exception while removing virtual machine %s. Exception details: %s' % (vm_name, exp))
+            return 1
+
+
+    def _track_tasks(self, vm_tasks):
+        for vm_name in vm_tasks.keys():
+            self.active_tasks[vm_tasks[vm_name]._moId] = (vm_name, vm_tasks[vm_name])
+
+
+    def _untrack_tasks(self, vm_tasks):
+        for task in vm_tasks.values():
+            self.active_tasks.pop(task._moId, None)
+
+
+    # abort the run because of a timeout, an interrupt or a caller request. All the tracked
+    # in-flight tasks are cancelled at once, and the waiting loops stop at their next poll.
+    # This can be called from another thread.
+    #
+    def abort(self, reason):
+        if(self.abort_reason != None):    # already aborted, the cleanup after the abort is not cancelled
+            return
+        self.abort_reason = reason
+        self.abort_event.set()
+        self.logger.warning('Aborting the operation through vCenter %s: %s' % (self.vc_name, reason))
+        writeevent(self.tmplogfile, phase='abort', state='aborting', reason=reason)
+        self.cancel_tasks()
+        self.abort_done.set()
+
+
+    # cancel all the tracked in-flight tasks concurrently
+    #
+    def cancel_tasks(self):
+        tasks = list(self.active_tasks.items())
+        if( len(tasks) == 0 ):
+            return 0
+
+        self.logger.info('Cancelling %d in-flight tasks' % len(tasks))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, len(tasks))) as executor:
+            results = list(executor.map(self._cancel_task, [vm_task for (moid, vm_task) in tasks]))
+        for (moid, vm_task) in tasks:
+            self.active_tasks.pop(moid, None)
+        return 0 if all([rc == 0 for rc in results]) else 1
+
+
+    def _cancel_task(self, vm_task):
+        (vm_name, task) = vm_task
+        try:
+            task.CancelTask()
+            writeevent(self.tmplogfile, vm=vm_name, phase='abort', state='cancelled')
+            return 0
+        except vim.fault.InvalidState:    # the task has already completed
+            return 0
+        except Exception as exp:
+            self.logger.warning('Unable to cancel task of virtual machine %s. Exception details: %s' % (vm_name, exp))
+            return 1
+
+
+    # the virtual machines this run has started to clone, from the deploy record of this process
+    #
+    def _created_vms(self):
+        vm_names = list(self.cloned_vm)
+        seen = set(vm_names)
+        for event in readevents(self.tmplogfile, pid=os.getpid(), phase='Virtual machine cloning', state='submitted'):
+            if event.get('vm') not in seen:
+                seen.add(event.get('vm'))
+                vm_names.append(event.get('vm'))
+        return vm_names
+
+
+    # submit the task of every virtual machine in vm_names from a thread pool, so the tasks are
+    # submitted at once. Return {vm_name: task}.
+    #
+    def _submit_concurrently(self, vm_names, submit_fn, task_msg):
+        vm_tasks = {}
+        if( len(vm_names) == 0 ):
+            return vm_tasks
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, len(vm_names))) as executor:
+            futures = {}
+            for vm_name in vm_names:
+                futures[executor.submit(submit_fn, vm_name)] = vm_name
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    vm_tasks[futures[future]] = future.result()
+                except Exception as exp:
+                    self.logger.warning('Catching exception while submitting %s task for virtual machine %s. Exception details: %s' % \
+                                        (task_msg, futures[future], exp))
+        return vm_tasks
+
+
+    # destroy the virtual machines created by this run after an abort. The virtual machines are
+    # located in one inventory pass, then all the power off tasks and all the destroy tasks are
+    # submitted at once and polled together.
+    #
+    def destroy_created_vms(self):
+        vm_names = self._created_vms()
+        if( len(vm_names) == 0 ):
+            return 0
+
+        vm_objs = self.locate_vms(vm_names)
+        if( len(vm_objs) == 0 ):
+            return 0
+        self.logger.info('Destroying %d virtual machines created by this run: %s' % (len(vm_objs), ', '.join(vm_objs.keys())))
+
+        rc = 0
+        powered_on = [props.get('name') for (obj, props) in self.retrieve_props([vim.VirtualMachine], ['name', 'runtime.powerState'], list(vm_objs.values()))
+                      if props.get('runtime.powerState') == vim.VirtualMachinePowerState.poweredOn]
+        if( len(powered_on) > 0 ):
+            task_msg = 'Virtual machine power off'
+            vm_tasks = self._submit_concurrently(powered_on, lambda vm_name: vm_objs[vm_name].PowerOffVM_Task(), task_msg)
+            rc = self.wait_task_finish(vm_tasks, {}, task_msg, 600) or rc
+
+        task_msg = 'Deleting virtual machine'
+        vm_result = {}
+        vm_tasks = self._submit_concurrently(list(vm_objs.keys()), lambda vm_name: vm_objs[vm_name].Destroy_Task(), task_msg)
+        rc = self.wait_task_finish(vm_tasks, vm_result, task_msg, 600) or rc
+        for vm_name in vm_result.keys():
+            self.known_vms.pop(vm_name, None)
+            writeevent(self.tmplogfile, vm=vm_name, phase='abort', state='destroyed')
+        if( len(vm_result) != len(vm_objs) ):
+            rc = 1
+        return rc
 
 
     # wait for update task to complete
@@ -403,7 +1056,7 @@ class vms:
         property_collector = content.propertyCollector
   
         tasks = list(update_tasks.values())
-        task_list = [str(task) for task in tasks]
+        pending = vm_records.from_tasks(update_tasks)    # the virtual machines of the pending tasks, by task moref
 
         obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks]
         property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.Task, pathSet=[], all=True)
@@ -412,59 +1065,67 @@ class vms:
         filter_spec.objectSet = obj_specs
         filter_spec.propSet = [property_spec]
         pcfilter = property_collector.CreateFilter(filter_spec, True)
+        self._track_tasks(update_tasks)
  
-        task_number = len(task_list)
+        task_number = len(pending)
         task_success = [] 
+        progress = progress_reporter(self.logger, 'Virtual machine %s' % task_msg, task_number)
 
         try:
-            version, state = None, None
+            version, state, info = None, None, None
             # wait for the task to complete
-            while(task_list and timeout > 0):
-                self.logger.info( ('-'*15 + "Waiting for virtual machine %s" + '-'*15) % task_msg )
-
-                for vm in task_success:
-                    self.logger.info('Virtual machine %s %s succeeds' % (vm, task_msg))
-
+            while(len(pending) > 0 and timeout > 0 and not self.abort_event.is_set()):
                 update = property_collector.WaitForUpdates(version)
                 for filter_set in update.filterSet:
                     for obj_set in filter_set.objectSet:
                         task = obj_set.obj
                         for change in obj_set.changeSet:
                             if change.name == 'info':
+                                info = change.val
                                 state = change.val.state
                             elif change.name == 'info.state':
+                                info = None
                                 state = change.val
                             else:
                                 continue
 
-                            if not str(task) in task_list:
+                            record = pending.by_task(task)
+                            if record == None:
                                 continue
-
-                            vm = self._get_task_vm(task, update_tasks)
+                            vm = record.name
 
                             if state == vim.TaskInfo.State.success:
-                                task_list.remove(str(task))  # Remove task from taskList
+                                pending.remove(vm)
                                 task_success.append(vm) 
-                                self.logger.info('Virtual machine %s %s succeeds' % (vm, task_msg)) 
+                                progress.update(vm, 'success')
+                                self.logger.debug('Virtual machine %s %s succeeds' % (vm, task_msg)) 
+                                self._task_event(vm, task_msg, 'success', info)
                             elif state == vim.TaskInfo.State.error:
-                                task_list.remove(str(task))
+                                pending.remove(vm)
+                                progress.update(vm, 'error')
                                 self.logger.warning('Virtual machine %s %s has quit with error' % (vm, task_msg))
+                                self._task_event(vm, task_msg, 'error', info)
                             else:
-                                self.logger.info('Virtual machine %s %s is still running' % (vm, task_msg))
+                                progress.update(vm, 'running')
 
                 # Move to next version
                 version = update.version
 
+                progress.report(len(pending) == 0)
                 if( len(task_success) == task_number ):  #all the tasks in task_list are complted, not need to wait
                     break
 
-                time.sleep(20)
+                self.abort_event.wait(20)
                 timeout = timeout - 20
+            if( timeout <= 0 and len(pending) > 0 ):
+                self.logger.warning('Virtual machine %s does not finish in time' % task_msg)
+                self.abort('Virtual machine %s does not finish in time' % task_msg)
         except Exception as exp:
             self.logger.warning('Having problem while waiting for tasks to complete. Exception: %s' % exp)
         finally:
             if pcfilter:
                 pcfilter.Destroy()
+            self._untrack_tasks(update_tasks)
             return 0 if( len(task_success) == task_number ) else 1 
 
  
@@ -479,51 +1140,52 @@ class vms:
         if(network == None):
             self.logger.warn('Unable to find network %s from vcenter %s' % (self.network, self.vc_name))
             return 1
+        self.network_obj = network
 
-        network_updated = {}
-
-        for vm_name in self.vm_list:
-            tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
-            if tmp_vm == None:
-                self.logger.warn('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
-                return 1
+        task_msg = 'Virtual machine network update to %s' % self.network
+        (rc, vm_result) = self.run_task_window(self.vm_list, self._submit_network_update, task_msg, 'reconfigure', 1800)
+        return rc
 
-            device_change = []
-            for device in tmp_vm.config.hardware.device:
-                found_instance = isinstance(device, vim.vm.device.VirtualEthernetCard)
-                if(found_instance == False):
-                    continue
 
-                nicspec = vim.vm.device.VirtualDeviceSpec()
-                nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
-                nicspec.device = device
-                nicspec.device.wakeOnLanEnabled = True
+    # submit the network reconfigure task of one virtual machine
+    #
+    def _submit_network_update(self, vm_name):
+        network = self.network_obj
+        tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
+        if tmp_vm == None:
+            raise Exception('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
+
+        device_change = []
+        for device in tmp_vm.config.hardware.device:
+            found_instance = isinstance(device, vim.vm.device.VirtualEthernetCard)
+            if(found_instance == False):
+                continue
 
-                if self.network_vds == False:  # for non VDS network
-                    nicspec.device.backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
-                    nicspec.device.backing.network = network
-                    nicspec.device.backing.deviceName = self.network 
-                else:
-                    dvs_port_connection = vim.dvs.PortConnection()
+            nicspec = vim.vm.device.VirtualDeviceSpec()
+            nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+            nicspec.device = device
+            nicspec.device.wakeOnLanEnabled = True
 
-                    dvs_port_connection.portgroupKey = network.key
-                    dvs_port_connection.switchUuid = network.config.distributedVirtualSwitch.uuid
-                    nicspec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
-                    nicspec.device.backing.port = dvs_port_connection
+            if self.network_vds == False:  # for non VDS network
+                nicspec.device.backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
+                nicspec.device.backing.network = network
+                nicspec.device.backing.deviceName = self.network 
+            else:
+                dvs_port_connection = vim.dvs.PortConnection()
 
-                nicspec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
-                nicspec.device.connectable.startConnected = True
-                nicspec.device.connectable.allowGuestControl = True
-                device_change.append(nicspec)
-                break
+                dvs_port_connection.portgroupKey = network.key
+                dvs_port_connection.switchUuid = network.config.distributedVirtualSwitch.uuid
+                nicspec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+                nicspec.device.backing.port = dvs_port_connection
 
-            config_spec = vim.vm.ConfigSpec(deviceChange=device_change) 
-            task = tmp_vm.ReconfigVM_Task(config_spec)
-            network_updated[vm_name] = task
+            nicspec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
+            nicspec.device.connectable.startConnected = True
+            nicspec.device.connectable.allowGuestControl = True
+            device_change.append(nicspec)
+            break
 
-        task_msg = 'network update to %s' % self.network
-        rc = self.wait_update_task(network_updated, task_msg, 1800)
-        return rc
+        config_spec = vim.vm.ConfigSpec(deviceChange=device_change) 
+        return tmp_vm.ReconfigVM_Task(config_spec)
 
 
     # get the deployed virtual machine's operating system type
@@ -559,52 +1221,46 @@ class vms:
         if(self.static_ip == False):
             return 0
 
-        vm_deployed = {}
-        vm_result = {}
         task_msg = "Virtual machine static IP setup"
         self.logger.info('Start setting up virtual machine static IP address')
-        for i in range(len(self.vm_list)):
-            vm_name = self.vm_list[i]
-            tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
-            if not tmp_vm:
-                self.logger.warn('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
-                return 1
-           
-            adaptermap = vim.vm.customization.AdapterMapping()
-            adaptermap.adapter = vim.vm.customization.IPSettings()
-            if(self.static_ip):
-                adaptermap.adapter.ip = vim.vm.customization.FixedIp()
-                adaptermap.adapter.ip.ipAddress = self.static_ip_list[i] 
-                adaptermap.adapter.subnetMask = self.vm_netmask 
-                adaptermap.adapter.gateway = self.vm_gateway
-            else:
-                adaptermap.adapter.ip = vim.vm.customization.DhcpIpGenerator()
+        (rc, vm_result) = self.run_task_window(self.vm_list, self._submit_customize, task_msg, 'reconfigure', 3600)
+        return rc
 
-            if(self.vm_dns):
-                adaptermap.adapter.dnsServerList = self.vm_dns 
 
-            globalip = vim.vm.customization.GlobalIPSettings()
-            if(self.vm_dns):
-                globalip.dnsServerList = self.vm_dns 
+    # submit the guest customization task of one linux virtual machine
+    #
+    def _submit_customize(self, vm_name):
+        tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
+        if not tmp_vm:
+            raise Exception('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
 
-            ident = vim.vm.customization.LinuxPrep()
-            ident.hostName = vim.vm.customization.FixedName()
-            ident.hostName.name = vm_name
+        adaptermap = vim.vm.customization.AdapterMapping()
+        adaptermap.adapter = vim.vm.customization.IPSettings()
+        if(self.static_ip):
+            adaptermap.adapter.ip = vim.vm.customization.FixedIp()
+            adaptermap.adapter.ip.ipAddress = self.records.get(vm_name).ip
+            adaptermap.adapter.subnetMask = self.vm_netmask 
+            adaptermap.adapter.gateway = self.vm_gateway
+        else:
+            adaptermap.adapter.ip = vim.vm.customization.DhcpIpGenerator()
 
-            customspec = vim.vm.customization.Specification()
-            customspec.nicSettingMap = [adaptermap]
-            customspec.globalIPSettings = globalip
-            customspec.identity = ident
+        if(self.vm_dns):
+            adaptermap.adapter.dnsServerList = self.vm_dns 
 
-            try:
-                task = tmp_vm.Customize(spec=customspec)
-                vm_deployed[vm_name]=task
-            except Exception as exp:
-                self.logger.warning('Catching exception while updating virtual machine %s configuration. Exception details: %s' % (vm_name, exp))
-                return 1
+        globalip = vim.vm.customization.GlobalIPSettings()
+        if(self.vm_dns):
+            globalip.dnsServerList = self.vm_dns 
 
-        rc = self.wait_task_finish(vm_deployed, vm_result, task_msg, 3600)
-        return rc
+        ident = vim.vm.customization.LinuxPrep()
+        ident.hostName = vim.vm.customization.FixedName()
+        ident.hostName.name = vm_name
+
+        customspec = vim.vm.customization.Specification()
+        customspec.nicSettingMap = [adaptermap]
+        customspec.globalIPSettings = globalip
+        customspec.identity = ident
+
+        return tmp_vm.Customize(spec=customspec)
 
 
     # set up windows virtual machine's ip address and DNS server
@@ -615,9 +1271,9 @@ class vms:
         profile_manager = content.guestOperationsManager.processManager
 
         self.logger.info('Start setting up virtual machine static IP address')
-        for i in range(len(self.vm_list)):
-            vm_name = self.vm_list[i]
-            self.logger.info('Setting up static IP address %s for virtual machine %s' % (self.static_ip_list[i], vm_name))
+        for record in self.records:
+            vm_name = record.name
+            self.logger.info('Setting up static IP address %s for virtual machine %s' % (record.ip, vm_name))
 
             tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
             if not tmp_vm:
@@ -625,20 +1281,29 @@ class vms:
                 return 1
 
             # set up vm ip address
-            win_cmd1 = "interface ipv4 set address Ethernet0 static %s %s %s" % (self.static_ip_list[i], self.vm_netmask, self.vm_gateway)
+            win_cmd1 = "interface ipv4 set address Ethernet0 static %s %s %s" % (record.ip, self.vm_netmask, self.vm_gateway)
             program_spec1 = vim.vm.guest.ProcessManager.ProgramSpec( programPath="c:\\windows\\system32\\netsh.exe", arguments=win_cmd1)
             tools_status = tmp_vm.guest.toolsStatus
             res = profile_manager.StartProgramInGuest(tmp_vm, creds, program_spec1)
-            time.sleep(10)
+            if self.abort_event.wait(10):
+                return 1
 
             # set up vm DNS
             win_cmd2 = "interface ipv4 set dnsserver Ethernet0 static %s primary" % (self.vm_dns)
             program_spec2 = vim.vm.guest.ProcessManager.ProgramSpec( programPath="c:\\windows\\system32\\netsh.exe", arguments=win_cmd2)
             res = profile_manager.StartProgramInGuest(tmp_vm, creds, program_spec2)
 
-        time.sleep(30)
-        for i in range(len(self.vm_list)):
-            vm_name = self.vm_list[i]
+        # the services answer on the new static IP address once netsh has applied it
+        rc = self.wait_vm_ready(timeout = 300, vm_ips = self.records.ips())
+        if(rc == None):
+            self.abort_event.wait(30)
+        if self.abort_event.is_set():
+            return 1
+        if(rc != None and rc != 0):
+            # wait_vm_ready has logged the virtual machines that do not answer
+            self.logger.warning('Not all the virtual machines answer on their static IP addresses, the reboot is not started')
+            return rc
+        for vm_name in self.vm_list:
             tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
             if not tmp_vm:
                 self.logger.warn('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
@@ -651,7 +1316,13 @@ class vms:
 
             self.logger.info('Done with setting up static IP address for virtual machine %s' % vm_name)
 
-        time.sleep(60) # for all the vms, give one minute to reboot
+        rc = self.wait_vm_ready(after_reboot = True, vm_ips = self.records.ips())
+        if(rc == None):
+            self.abort_event.wait(60) # for all the vms, give one minute to reboot
+        if self.abort_event.is_set():
+            return 1
+        if(rc != None and rc != 0):
+            return rc
         self.logger.info('Done with setting up static IP addresses for all the virtual machines')
         return 0
 
@@ -668,8 +1339,7 @@ class vms:
         content = self.conn_content
         profile_manager = content.guestOperationsManager.processManager
 
-        for i in range(len(self.vm_list)):
-            vm_name = self.vm_list[i]
+        for vm_name in self.vm_list:
             tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
             if not tmp_vm:
                 self.logger.warn('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
@@ -686,31 +1356,261 @@ class vms:
                 self.logger.warning('Having problem while updating virtual machine %s hostname. Exception details: %s' % (vm_name, exp))
                 return 1
 
-        time.sleep(30)
+        if( self.wait_vm_ready(after_reboot = True) == None ):
+            self.abort_event.wait(30)
+        if self.abort_event.is_set():
+            return 1
         rc = self.wait_vm_up(1800)
         self.logger.info("Successfully update virtual machine hostname")
         return rc
 
 
+    # the TCP ports that must answer before a virtual machine is usable
+    #
+    def _probe_ports(self):
+        if(self.probe_ports != None):
+            return self.probe_ports
+        return [3389] if self.vm_ostype == "Windows" else [22]
+
+
+    # the IP addresses of the virtual machines in vm_list, read in one bulk query. Return {vm_name: ip}.
+    #
+    def _vm_ips(self):
+        vm_objs = self.locate_vms(self.vm_list)
+        vm_ips = {}
+        for (obj, props) in self.retrieve_props([vim.VirtualMachine], ['name', 'guest.ipAddress'], list(vm_objs.values())):
+            if props.get('guest.ipAddress'):
+                vm_ips[props.get('name')] = props.get('guest.ipAddress')
+        return vm_ips
+
+
+    # Wait until the probe ports of every virtual machine answer. vm_ips is {vm_name: ip}; by default
+    # the static IP addresses are used, or the IP addresses reported by VMware tools. With after_reboot,
+    # the ports are first waited to go down. Return 0 if all the virtual machines are ready, 1 if not,
+    # or None if the probes are turned off with an empty probe_ports, so the caller uses a fixed wait.
+    #
+    def wait_vm_ready(self, after_reboot = False, timeout = 1800, vm_ips = None):
+        ports = self._probe_ports()
+        if( len(ports) == 0 ):
+            return None
+
+        if(vm_ips == None):
+            vm_ips = self.records.ips() if self.static_ip else self._vm_ips()
+        rc = 0
+        for vm_name in self.vm_list:
+            if vm_name not in vm_ips:
+                self.logger.warning('Virtual machine %s has no IP address to probe' % vm_name)
+                rc = 1
+
+        self.logger.info('Waiting for port %s of %d virtual machines to answer' % (','.join([str(port) for port in ports]), len(vm_ips)))
+        (ready, not_ready) = wait_ports(vm_ips, ports, timeout, after_reboot = after_reboot, logger = self.logger,
+                                        stop_event = self.abort_event)
+        for vm_name in sorted(ready.keys()):
+            writeevent(self.tmplogfile, vm=vm_name, phase='ready', state='ready', duration=ready[vm_name])
+        if self.abort_event.is_set():
+            self.logger.warning('Waiting for the virtual machines to answer is aborted')
+            return 1
+        if( len(not_ready) > 0 ):
+            self.logger.warning('Port %s of virtual machines %s does not answer within %d seconds' % \
+                                (','.join([str(port) for port in ports]), ', '.join(not_ready), timeout))
+            rc = 1
+        return rc
+
+
+    # the guest path of a file in a guest directory, with the path separator of the guest OS
+    #
+    def _guest_path(self, dest_dir, file_name):
+        sep = '\\' if( '\\' in dest_dir or re.match(r'^[A-Za-z]:', dest_dir) ) else '/'
+        return dest_dir.rstrip('\\/') + sep + file_name
+
+
+    # the file transfer URL of vCenter has "*" for the ESXi host of the virtual machine
+    #
+    def _transfer_url(self, url, host_name):
+        if host_name != None:
+            url = url.replace('://*', '://%s' % host_name, 1)
+        return url
+
+
+    # the {file name: sha256 checksum} manifest of the files pushed into a guest directory
+    #
+    def _read_guest_manifest(self, file_manager, vm_obj, host_name, creds, manifest_path, pool):
+        try:
+            info = file_manager.InitiateFileTransferFromGuest(vm_obj, creds, manifest_path)
+        except vim.fault.FileFault:
+            return {}
+        (status, data) = pool.request('GET', self._transfer_url(info.url, host_name))
+        if(status != 200):
+            return {}
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError:
+            return {}
+
+
+    # the {file name: size} of the files in a guest directory
+    #
+    def _guest_file_sizes(self, file_manager, vm_obj, creds, dest_dir):
+        sizes, index = {}, 0
+        while True:
+            result = file_manager.ListFilesInGuest(vm_obj, creds, dest_dir, index, 500)
+            files = result.files or []
+            for info in files:
+                if(info.type == 'file'):
+                    sizes[info.path] = info.size
+            index += len(files)
+            if( not result.remaining or len(files) == 0 ):
+                break
+        return sizes
+
+
+    # upload bytes or a local file to a guest path. The file is streamed to the ESXi host.
+    #
+    def _upload_guest_file(self, file_manager, vm_obj, host_name, creds, guest_path, body, size, pool):
+        url = file_manager.InitiateFileTransferToGuest(vm_obj, creds, guest_path, vim.vm.guest.FileManager.FileAttributes(), size, True)
+        (status, data) = pool.request('PUT', self._transfer_url(url, host_name), body)
+        if(status != 200):
+            raise IOError('HTTP status %d when uploading %s' % (status, guest_path))
+
+
+    # push the local files into the guest directory of one virtual machine. The files whose
+    # checksum in the guest manifest and size in the guest are unchanged are skipped.
+    # Return (pushed file names, skipped file names, pushed bytes).
+    #
+    def _push_vm(self, vm_obj, host_name, creds, local_files, dest_dir, pool):
+        file_manager = self.conn_content.guestOperationsManager.fileManager
+        try:
+            file_manager.MakeDirectoryInGuest(vm_obj, creds, dest_dir, True)
+        except vim.fault.FileAlreadyExists:
+            pass
+
+        manifest_path = self._guest_path(dest_dir, '.vmpush.json')
+        manifest = self._read_guest_manifest(file_manager, vm_obj, host_name, creds, manifest_path, pool)
+        sizes = self._guest_file_sizes(file_manager, vm_obj, creds, dest_dir) if len(manifest) > 0 else {}
+
+        pushed, skipped, pushed_bytes = [], [], 0
+        for (file_name, path, size, checksum) in local_files:
+            if( manifest.get(file_name) == checksum and sizes.get(file_name) == size ):
+                skipped.append(file_name)
+                continue
+            self._upload_guest_file(file_manager, vm_obj, host_name, creds, self._guest_path(dest_dir, file_name), path, size, pool)
+            manifest[file_name] = checksum
+            pushed.append(file_name)
+            pushed_bytes += size
+
+        if( len(pushed) > 0 ):
+            data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+            self._upload_guest_file(file_manager, vm_obj, host_name, creds, manifest_path, data, len(data), pool)
+        return (pushed, skipped, pushed_bytes)
+
+
+    # push the local files into the guest directory of one virtual machine, and retry the
+    # transient faults with the retry policy of the tasks
+    #
+    def _push_vm_retry(self, vm_name, vm_obj, host_name, creds, local_files, dest_dir, pool):
+        attempt = 1
+        while True:
+            try:
+                return self._push_vm(vm_obj, host_name, creds, local_files, dest_dir, pool)
+            except Exception as exp:
+                if( self.abort_event.is_set() or not self.retry.should_retry(exp, attempt) ):
+                    raise
+                self.logger.warning('Pushing files into virtual machine %s fails, retrying. Exception details: %s' % (vm_name, exp))
+                self.abort_event.wait(self.retry.delay(attempt))
+                attempt += 1
+
+
+    # Push local files into the guest directory dest_dir of the virtual machines, with at most
+    # concurrency virtual machines at a time. vm_objs is {vm_name: virtual machine object}, the
+    # virtual machines in vm_list by default. The guest credentials are vm_user and vm_password.
+    # A file that is already in the guest with the same checksum and size is skipped.
+    # Return (rc, {vm_name: (pushed file names, skipped file names)}).
+    #
+    def push_files(self, files, dest_dir, vm_objs = None, concurrency = 8, on_done = None):
+        from vmtransfer import http_pool, file_checksum    # the HTTP modules are only loaded to push files
+
+        local_files = []
+        for path in files:
+            if not os.path.isfile(path):
+                self.logger.warning('Unable to find local file %s to push into the virtual machines' % path)
+                return (1, {})
+            local_files.append((os.path.basename(path), path, os.path.getsize(path), file_checksum(path)))
+
+        rc = 0
+        if(vm_objs == None):
+            vm_objs = self.locate_vms(self.vm_list)
+            missing = [vm_name for vm_name in self.vm_list if vm_name not in vm_objs]
+            if( len(missing) > 0 ):
+                self.logger.warning('Unable to find virtual machines %s from vcenter %s' % (', '.join(missing), self.vc_name))
+                rc = 1
+
+        # the ESXi host names for the transfer URLs, in two bulk reads
+        vm_hosts, host_names = {}, {}
+        for (obj, props) in self.retrieve_props([vim.VirtualMachine], ['name', 'runtime.host'], list(vm_objs.values())):
+            if props.get('runtime.host') != None:
+                vm_hosts[props.get('name')] = props.get('runtime.host')
+        hosts = dict([(host._moId, host) for host in vm_hosts.values()])
+        for (obj, props) in self.retrieve_props([vim.HostSystem], ['name'], list(hosts.values())):
+            host_names[obj._moId] = props.get('name')
+
+        task_msg = 'Guest file push'
+        self.logger.info('Start pushing %d files into %s of %d virtual machines' % (len(local_files), dest_dir, len(vm_objs)))
+        creds = vim.vm.guest.NamePasswordAuthentication(username=self.vm_user, password=self.vm_password)
+        pool = http_pool(self.vc_ssl_check)
+        progress = progress_reporter(self.logger, task_msg, len(vm_objs))
+        vm_result = {}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                futures = {}
+                for vm_name in sorted(vm_objs.keys()):
+                    host = vm_hosts.get(vm_name)
+                    host_name = host_names.get(host._moId) if host != None else None
+                    futures[executor.submit(self._push_vm_retry, vm_name, vm_objs[vm_name], host_name, creds, local_files, dest_dir, pool)] = (vm_name, time.time())
+                    progress.update(vm_name, 'running')
+
+                for future in concurrent.futures.as_completed(futures):
+                    (vm_name, start_time) = futures[future]
+                    try:
+                        (pushed, skipped, pushed_bytes) = future.result()
+                    except Exception as exp:
+                        self.logger.warning('Unable to push files into virtual machine %s. Exception details: %s' % (vm_name, exp))
+                        writeevent(self.tmplogfile, vm=vm_name, phase=task_msg, state='error', error=str(exp))
+                        self._vm_done(progress, on_done, vm_name, 'error', str(exp))
+                        rc = 1
+                        continue
+                    vm_result[vm_name] = (pushed, skipped)
+                    writeevent(self.tmplogfile, vm=vm_name, phase=task_msg, state='success', duration=round(time.time() - start_time, 1),
+                               pushed=len(pushed), skipped=len(skipped), bytes=pushed_bytes)
+                    self._vm_done(progress, on_done, vm_name, 'success', '%d pushed, %d skipped' % (len(pushed), len(skipped)))
+                    progress.report()
+        finally:
+            pool.close()
+        progress.report(True)
+        return (rc, vm_result)
+
+
     # power up VMs and wait until the vmtools are all available
     #
     def power_up_vm(self):
-        vm_processed = {}
-        task_msg = 'powering up'
+        task_msg = 'Virtual machine powering up'
         self.logger.info('Start powering up virtual machine')
-        for vm_name in self.vm_list:
-            tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
-            if not tmp_vm:
-                self.logger.warn('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
-                return 1
-     
-            task = tmp_vm.PowerOnVM_Task()
-            vm_processed[vm_name]=task
-        
+        (rc, vm_result) = self.run_task_window(self.vm_list, self._submit_power_on, task_msg, 'power', 1800)
+        if(rc != 0):
+            return rc
+
         rc = self.wait_vm_up(3600)
         return rc
 
 
+    def _submit_power_on(self, vm_name):
+        tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
+        if not tmp_vm:
+            raise Exception('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
+        if( tmp_vm.runtime.powerState == 'poweredOn' ):
+            return None
+        return tmp_vm.PowerOnVM_Task()
+
+
     # power off virtual machine
     #
     def power_off_vm(self):
@@ -720,24 +1620,20 @@ class vms:
             self.logger.info('Error connecting to vCenter %s' % self.vc_name)
             return rc
 
-        vm_processed = {}
-        vm_result = {}
         task_msg = 'Powering off virtual machine'
         self.logger.info('Start powering off virtual machine')
+        (rc, vm_result) = self.run_task_window(self.vm_list, self._submit_power_off, task_msg, 'power', 1800)
+        return rc
 
-        for vm_name in self.vm_list:
-            self.logger.info('Start powering off virtual machine %s' % vm_name)
-            tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
-            if not tmp_vm:
-                self.logger.warn('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
-                return 1 
-           
-            if( tmp_vm.runtime.powerState == 'poweredOn' ):
-                task = tmp_vm.PowerOffVM_Task()
-                vm_processed[vm_name]=task
 
-        rc = self.wait_task_finish(vm_processed, vm_result, task_msg, 1800)
-        return rc
+    def _submit_power_off(self, vm_name):
+        self.logger.debug('Start powering off virtual machine %s' % vm_name)
+        tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
+        if not tmp_vm:
+            raise Exception('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
+        if( tmp_vm.runtime.powerState != 'poweredOn' ):
+            return None
+        return tmp_vm.PowerOffVM_Task()
 
 
     # waiting for VMs and its installed VMTools to be fully up
@@ -745,30 +1641,49 @@ class vms:
     def wait_vm_up(self, timeout_value):
         timeout = int(time.time()) + timeout_value 
         rc = 1
-        while( int(time.time()) < timeout ):
-            self.logger.info('-'*15 + "Waiting for virtual machine and VMware Tool to be fully up" + '-'*15) 
-            booted_vm = 0
+        vm_names = self.vm_list
+        progress = progress_reporter(self.logger, 'Virtual machine and VMware Tool boot up', len(vm_names),
+                                     done_states=('up',))
+
+        vm_objs = self.locate_vms(vm_names)
+        for vm_name in vm_names:
+            if vm_name not in vm_objs:
+                self.logger.warn('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
+                return 1
 
-            for vm_name in self.vm_list:
-                tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
-                if not tmp_vm:
-                    self.logger.warn('Unable to find virtual machine %s from vcenter %s' % (vm_name, self.vc_name))
-                    return 1
+        # poll quickly while the virtual machines keep coming up, and back off up to 30 seconds otherwise
+        poll_interval, last_booted = 5, 0
+        while( int(time.time()) < timeout and not self.abort_event.is_set() ):
+            booted_vm = 0
 
-                if(tmp_vm.runtime.powerState == vim.VirtualMachinePowerState.poweredOn and 
-                   tmp_vm.guest.toolsStatus == vim.vm.GuestInfo.ToolsStatus.toolsOk): 
-                    self.logger.info('Virtual machine %s and its installed VMware Tool are fully up' % vm_name)
+            vm_states = {}
+            for (tmp_vm, props) in self.retrieve_props([vim.VirtualMachine], ['name', 'runtime.powerState', 'guest.toolsStatus'], list(vm_objs.values())):
+                vm_states[props.get('name')] = props
+
+            for vm_name in vm_names:
+                props = vm_states.get(vm_name, {})
+                if(props.get('runtime.powerState') == vim.VirtualMachinePowerState.poweredOn and 
+                   props.get('guest.toolsStatus') == vim.vm.GuestInfo.ToolsStatus.toolsOk): 
+                    if(progress.states.get(vm_name) != 'up'):
+                        self.logger.debug('Virtual machine %s and its installed VMware Tool are fully up' % vm_name)
+                    progress.update(vm_name, 'up')
                     booted_vm = booted_vm + 1
                 else:
-                    self.logger.info('Virtual machine %s and its installed VM Tool are still being booted up' % vm_name)
+                    progress.update(vm_name, 'booting')
 
-            if( booted_vm == len(self.vm_list) ):
+            progress.report(booted_vm == len(vm_names))
+            if( booted_vm == len(vm_names) ):
                 rc = 0
                 break
-            time.sleep(30)
+
+            poll_interval = 5 if booted_vm > last_booted else min(30, poll_interval * 1.5)
+            last_booted = booted_vm
+            self.abort_event.wait(poll_interval)
  
         if(rc == 0):
             self.logger.info('Successfully boot up all the specified virtual machines.')
+        elif self.abort_event.is_set():
+            self.logger.warning('Waiting for the virtual machines to boot up is aborted')
         else:
             self.logger.warning('Unable to fully boot up all the specified virtual machines within %d seconds' % timeout_value)
         return rc 
@@ -800,10 +1715,13 @@ class vms:
         return rc
 
 
-    # check if vm with static IP already exists in vCenter
+    # check if vm with static IP already exists in vCenter. The guest IP addresses of all the
+    # virtual machines are read in one bulk query, and the virtual machine planned for an IP
+    # address that is already used is not created.
     #
     def check_vm_exist(self):
-        if( len(self.static_ip_list) == 0 ):
+        static_ips = self.records.ips()
+        if( len(static_ips) == 0 ):
             return 0
 
         rc = self.connect_vc()
@@ -811,46 +1729,89 @@ class vms:
             self.logger.info('Error connecting to vCenter %s' % self.vc_name)
             return 1
 
-        vm_exist = []
-        searchIndex = self.conn_obj.RetrieveContent().searchIndex
-        for tmp_ip in self.static_ip_list:
-            vm_found = searchIndex.FindAllByIp(ip=tmp_ip, vmSearch=True)
+        ip_vms = {}    # guest IP address -> names of the virtual machines using it
+        for (obj, props) in self.retrieve_props([vim.VirtualMachine], ['name', 'guest.ipAddress', 'guest.net']):
+            vm_ips = set([props.get('guest.ipAddress')])
+            for nic in (props.get('guest.net') or []):
+                vm_ips.update(nic.ipAddress or [])
+            for ip in vm_ips:
+                if ip in self.records.ip_index:
+                    ip_vms.setdefault(ip, []).append(props.get('name'))
+
+        for (vm_name, tmp_ip) in static_ips.items():
+            vm_found = ip_vms.get(tmp_ip, [])
             if( len(vm_found) == 0 ):
                 continue
             elif( len(vm_found) == 1 ):
-                vm_exist.append(tmp_ip)
-                if( len(self.vm_list) > 0 ):
-                    self.vm_list.pop(-1)
-                self.deployed_vm.append( vm_found[0].summary.config.name )
+                self.records.remove(vm_name)
+                self.deployed_vm.append(vm_found[0])
                 self.logger.info("Virtual machine %s with static IP %s already exists in vCenter %s. Will not create VM with this static IP." % \
-                                    (vm_found[0].summary.config.name, tmp_ip, self.vc_name))
+                                    (vm_found[0], tmp_ip, self.vc_name))
             else:
                 for item in vm_found:
-                    self.logger.warning("Virtual machine %s with static IP %s already existed in vCenter %s" % (item.summary.config.name, tmp_ip, self.vc_name)) 
+                    self.logger.warning("Virtual machine %s with static IP %s already existed in vCenter %s" % (item, tmp_ip, self.vc_name))
                 self.logger.warning("For static IP %s, it has multiple VMs configured with this IP. Please correct this problem first." % tmp_ip)
                 return 1
 
-        # get vms with static IP that do not exist in vCenter
-        vm_new = [] 
-        vm_new = [ip for ip in self.static_ip_list if ip not in vm_exist]
-        if( len(vm_new) == 0 ):
+        # the virtual machines with static IP that do not exist in vCenter are left
+        if( len(self.records) == 0 ):
             self.logger.warning("Theare are virtual machines created with the user specified static IP addresses in vCenter %s. Do not deploy any new virtual machines." % \
                                 self.vc_name)
             return 2
+        return 0
 
-        self.static_ip_list = copy.deepcopy(vm_new)
-        if( len(self.static_ip_list) != len(self.vm_list) ):
-            self.logger.warning("The provided static IP address number %d does not equal to the provided VM number %d. Please check the YAML file." % \
-                                len(self.static_ip_list), len(self.vm_list))
-            return 1
-        else:
-            return 0 
 
+    def _submit_clone(self, vm_name):
+        # the existing virtual machines are located in one bulk read before the clone window
+        if vm_name in self.known_vms:
+            self.logger.warn('Virtual machine %s already exists. Do not clone this virtual machine!' % vm_name)
+            return None
+
+        record = self.records.add(vm_name)
+        if not record.cloned:
+            record.cloned = True
+            self.cloned_vm.append(vm_name)
+            writeevent(self.tmplogfile, vm=vm_name, phase='Virtual machine cloning', state='submitted')
+        task = self.template_obj.Clone(name=vm_name, folder=self.folder_obj, spec=self.vm_spec)
+        self.logger.info('Start cloning virtual machine %s' % vm_name)
+        if not record.deployed:
+            record.deployed = True
+            self.deployed_vm.append(vm_name)
+        return task
 
-    # deploy virtual machine
+
+    # drop the virtual machines that can not be cloned, so the following steps work on the
+    # virtual machines that are deployed
+    #
+    def _drop_failed_vms(self, failed_vms):
+        for vm_name in failed_vms:
+            self.records.remove(vm_name)
+        failed_vms = set(failed_vms)
+        self.deployed_vm = [vm_name for vm_name in self.deployed_vm if vm_name not in failed_vms]
+
+
+    # deploy virtual machine. If the deployment is aborted by a timeout, an interrupt or a
+    # caller request, the virtual machines created by this run are destroyed. check_existing
+    # is False when the caller already knows that none of the virtual machines exists.
     #
-    def deploy_vm(self):
-        rc = self.check_vm_exist()
+    def deploy_vm(self, check_existing = True):
+        try:
+            rc = self._deploy_steps(check_existing)
+        except KeyboardInterrupt:
+            self.abort('interrupted by user')
+            rc = 1
+
+        if(self.abort_reason != None):
+            self.abort_done.wait()
+            self.cancel_tasks()         # the tasks submitted while the abort was in progress
+            self.abort_event.clear()    # let the cleanup tasks be waited for, abort() does not cancel them
+            self.destroy_created_vms()
+            return 1
+        return rc
+
+
+    def _deploy_steps(self, check_existing = True):
+        rc = self.check_vm_exist() if check_existing else 0
         if(rc == 1):
             return 1 
         elif(rc == 2):  # all the vms with static ips already existed in vCenter, do not create new.
@@ -861,43 +1822,32 @@ class vms:
             self.logger.warning('Unable to build virtual machine spacification through vCenter %s' % self.vc_name)
             return rc
 
-        count = 0 
-        vm_deployed = {}
-        vm_result = {}
+        # the number of clones in flight follows how busy vCenter is
         task_msg = 'Virtual machine cloning'
-
-        for vm_name in self.vm_list:
-            tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
-            if tmp_vm:
-                self.logger.warn('Virtual machine %s already exists. Do not clone this virtual machine!' % vm_name)
-                continue
-    
-            task = self.template_obj.Clone(name=vm_name, folder=self.folder_obj, spec=self.vm_spec)
-            vm_deployed[vm_name]=task
-            self.logger.debug('task id is %d' % id(task))
-            count = count + 1
-        
-            self.logger.info('Start cloning virtual machine %s' % vm_name)
-            self.deployed_vm.append(vm_name)  
- 
-            if(count % 10 == 0):
-                self.wait_task_finish(vm_deployed, vm_result, task_msg, 3600)
-                vm_deployed = {}
-
-        if( len(vm_deployed.keys()) > 0 ):
-            self.wait_task_finish(vm_deployed, vm_result, task_msg, 3600)
+        self.known_vms.update(self.locate_vms(self.vm_list))
+        (clone_rc, vm_result) = self.run_task_window(self.vm_list, self._submit_clone, task_msg, 'clone', 3600, self._cleanup_vm)
+        if( clone_rc != 0 and self.abort_event.is_set() ):
+            return 1
+        failed_vms = [record.name for record in self.records if record.cloned and record.name not in vm_result]
+        self._drop_failed_vms(failed_vms)
+        # the following steps find the cloned virtual machines without walking the inventory per virtual machine
+        self.known_vms.update(self.locate_vms(self.vm_list))
+        if( len(self.vm_list) == 0 ):
+            self.logger.warning('No virtual machine can be cloned through vCenter %s' % self.vc_name)
+            return 1
 
         if(self.network != None):
-            self.update_network()
+            rc = self.update_network()
+            if(rc != 0): return rc
 
         if(self.cluster == None and self.esx != None):
-            time.sleep(30)
+            if self.abort_event.wait(30):
+                return 1
             rc = self.relocate_vm()
             if(rc != 0): return rc
 
         for vm_name in vm_result.keys():
-            logmessage = 'DEPLOYVM:' + vm_name
-            writelog(self.tmplogfile, logmessage, False)
+            writeevent(self.tmplogfile, vm=vm_name, phase='deploy', state='deployed')
         # done with deploying vm
 
         rc = self.get_vm_ostype()
@@ -907,10 +1857,12 @@ class vms:
             rc = self.setup_linux_ip()
             if(rc != 0): return rc
 
-        self.power_up_vm()
+        rc = self.power_up_vm()
+        if(rc != 0): return rc
 
         if(self.static_ip and self.vm_ostype == "Windows"):
-            time.sleep(30)  # wait 30 seconds until vm's VMTool is fully up
+            if self.abort_event.wait(30):  # wait 30 seconds until vm's VMTool is fully up
+                return 1
             rc = self.setup_win_ip()
             if(rc != 0): return rc
 
@@ -922,6 +1874,17 @@ class vms:
             rc = self.update_win_hostname()
             if(rc != 0): return rc
 
+        # the virtual machines are handed over once their services answer
+        if(self.power_on == True):
+            rc = self.wait_vm_ready()
+            if(rc != None and rc != 0): return rc
+            if self.abort_event.is_set():
+                return 1
+
+        if(self.payload_files and self.power_on == True):
+            (rc, vm_result) = self.push_files(self.payload_files, self.payload_dest)
+            if(rc != 0): return rc
+
         if(self.snapshot_name != None):
             rc = self.create_snapshot()
             if(rc != 0): return rc
@@ -932,9 +1895,12 @@ class vms:
 
         deployed_vm_str = ', '.join(self.deployed_vm)
         self.logger.info('='*15 + 'Successfully deploy virtual machines: %s' % deployed_vm_str + '='*15)
+        if( len(failed_vms) > 0 ):
+            self.logger.warning('Unable to deploy virtual machines: %s' % ', '.join(failed_vms))
+            return 1
 
         return 0  # All the steps succeed, return 0 here
-    # done with deploy_vm
+    # done with _deploy_steps
 
 
     # delete virtual machine
@@ -963,20 +1929,225 @@ class vms:
         return rc
 
 
-    # get virtual machines' IP addresses from vCenter
+    # bound the number of in-flight tasks of every kind to concurrency
     #
-    def get_vm_ip(self, vm_list = []):
-        ipaddress_list = []
+    def set_concurrency(self, concurrency):
+        for limiter in self.limiters.values():
+            limiter.maximum = concurrency
+            limiter.limit = min(limiter.limit, concurrency)
+
+
+    # select the virtual machines for a batch operation with one inventory pass. names limits
+    # the selection to these virtual machine names, regex to the names that match it and folder
+    # to the virtual machines directly in this folder. Templates are never selected.
+    # Return {vm_name: (virtual machine object, {property name: property value})}.
+    #
+    def select_vms(self, names = None, regex = None, folder = None):
+        pattern = re.compile(regex) if regex else None
+        wanted = set(names) if names != None else None
+        path_set = {vim.VirtualMachine: ['name', 'parent', 'config.template', 'runtime.powerState', 'guest.ipAddress'],
+                    vim.Folder: ['name']}
+
+        folder_names, vm_props = {}, []
+        for (obj, props) in self.retrieve_props([vim.VirtualMachine, vim.Folder], path_set):
+            if isinstance(obj, vim.Folder):
+                folder_names[obj._moId] = props.get('name')
+            else:
+                vm_props.append((obj, props))
+
+        selected = {}
+        for (obj, props) in vm_props:
+            name = props.get('name')
+            if( props.get('config.template') == True or name in selected ):
+                continue
+            if( wanted != None and name not in wanted ):
+                continue
+            if( pattern != None and pattern.search(name) == None ):
+                continue
+            parent = props.get('parent')
+            if( folder != None and (parent == None or folder_names.get(parent._moId) != folder) ):
+                continue
+            selected[name] = (obj, props)
+        return selected
+
+
+    # power on or off the selected virtual machines. The virtual machines that are already in
+    # this power state are skipped.
+    #
+    def batch_power(self, selected, power_on, on_done = None):
+        task_msg = 'Virtual machine powering up' if power_on else 'Powering off virtual machine'
+
+        def submit_power(vm_name):
+            (vm_obj, props) = selected[vm_name]
+            powered_on = (props.get('runtime.powerState') == vim.VirtualMachinePowerState.poweredOn)
+            if(powered_on == power_on):
+                return None
+            return vm_obj.PowerOnVM_Task() if power_on else vm_obj.PowerOffVM_Task()
+
+        return self.run_task_window(sorted(selected.keys()), submit_power, task_msg, 'power', 1800, on_done=on_done)
+
+
+    # create a snapshot of every selected virtual machine
+    #
+    def batch_snapshot(self, selected, snapshot_name, memory = False, on_done = None):
+        def submit_snapshot(vm_name):
+            return selected[vm_name][0].CreateSnapshot_Task(name=snapshot_name, description=snapshot_name, memory=memory, quiesce=False)
+
+        return self.run_task_window(sorted(selected.keys()), submit_snapshot, 'Virtual machine snapshot creating', 'snapshot', 3600, on_done=on_done)
+
+
+    # power off and destroy the selected virtual machines. A virtual machine that can not be
+    # powered off is not destroyed.
+    #
+    def batch_delete(self, selected, on_done = None):
+        def power_done(vm_name, state, message):
+            if(state == 'error' and on_done != None):
+                on_done(vm_name, state, 'power off fails: %s' % message)
+
+        (rc, vm_result) = self.batch_power(selected, False, power_done)
+        powered_off = [vm_name for vm_name in sorted(selected.keys()) if vm_name in vm_result or
+                       selected[vm_name][1].get('runtime.powerState') != vim.VirtualMachinePowerState.poweredOn]
+
+        def submit_destroy(vm_name):
+            return selected[vm_name][0].Destroy_Task()
+
+        (destroy_rc, vm_result) = self.run_task_window(powered_off, submit_destroy, 'Deleting virtual machine', 'destroy', 1800, on_done=on_done)
+        return (rc or destroy_rc, vm_result)
+
+
+    # the names of all the snapshots in a virtual machine snapshot tree
+    #
+    def _snapshot_names(self, snapshot_info):
+        names = []
+        snapshot_list = list(snapshot_info.rootSnapshotList) if snapshot_info else []
+        while( len(snapshot_list) > 0 ):
+            snapshot = snapshot_list.pop()
+            names.append(snapshot.name)
+            snapshot_list.extend(snapshot.childSnapshotList or [])
+        return names
+
 
+    # the regex of the virtual machine names built from base_vmname, like "vm-\d+" for "vm-001"
+    #
+    def _vm_name_pattern(self):
+        searchObj = re.search(r'\d+$', self.base_vmname)
+        return re.compile(r'^%s\d+$' % re.escape(self.base_vmname[0:searchObj.start()]))
+
+
+    # Reconcile the virtual machines in vCenter with this deployment. The current state of all
+    # the virtual machines (exists, power state, IP address, host, network and snapshots) is read
+    # in one bulk query, and only the actions needed to match the deployment are run: create the
+    # missing virtual machines, fix the network, create the snapshot, fix the power state, and
+    # with prune, delete the virtual machines named like this deployment but not in keep_names.
+    # IP address and host differences are reported. With plan_only, the actions are only logged.
+    # Return (rc, {action: [vm names]}).
+    #
+    def reconcile(self, keep_names, prune = False, plan_only = False):
+        actions = collections.OrderedDict([('create', []), ('network', []), ('snapshot', []), ('power', []), ('delete', [])])
         rc = self.connect_vc()
-        if(rc == 1):
-            self.logger.info('Error connecting to vCenter %s' % self.vc_name)
-            return ipaddress_list
+        if(rc == 0):
+            rc = self.resolve_objects()
+        if(rc != 0):
+            self.logger.warning('Unable to resolve the user specified objects from vCenter %s' % self.vc_name)
+            return (rc, actions)
+
+        path_set = ['name', 'config.template', 'runtime.powerState', 'guest.ipAddress', 'runtime.host', 'network', 'snapshot']
+        states = {}
+        for (obj, props) in self.retrieve_props([vim.VirtualMachine], path_set):
+            if( props.get('config.template') != True and props.get('name') not in states ):
+                states[props.get('name')] = (obj, props)
+
+        objects = self.plan_inventory["objects"]
+        network_type = vim.Network if self.network_vds == False else vim.dvs.DistributedVirtualPortgroup
+        network_moid = objects.get(self._obj_key(network_type, str(self.network))) if self.network else None
+        esx_moid = objects.get(self._obj_key(vim.HostSystem, str(self.esx))) if self.esx else None
+        static_ips = self.records.ips() if self.static_ip else {}
+
+        for vm_name in self.vm_list:
+            if vm_name not in states:
+                actions['create'].append(vm_name)
+                continue
+            (obj, props) = states[vm_name]
+            if( network_moid != None and network_moid not in [network._moId for network in (props.get('network') or [])] ):
+                actions['network'].append(vm_name)
+            if( self.snapshot_name != None and self.snapshot_name not in self._snapshot_names(props.get('snapshot')) ):
+                actions['snapshot'].append(vm_name)
+            if( (props.get('runtime.powerState') == vim.VirtualMachinePowerState.poweredOn) != self.power_on ):
+                actions['power'].append(vm_name)
+
+            vm_ip = props.get('guest.ipAddress')
+            if( vm_name in static_ips and vm_ip and vm_ip != static_ips[vm_name] ):
+                self.logger.warning('Virtual machine %s has IP address %s instead of %s' % (vm_name, vm_ip, static_ips[vm_name]))
+            host = props.get('runtime.host')
+            if( esx_moid != None and self.cluster == None and host != None and host._moId != esx_moid ):
+                self.logger.warning('Virtual machine %s runs on another host than %s' % (vm_name, self.esx))
+
+        if(prune == True):
+            pattern = self._vm_name_pattern()
+            actions['delete'] = sorted([vm_name for vm_name in states.keys() if pattern.match(vm_name) and vm_name not in keep_names])
+
+        summary = ', '.join(['%s %d' % (action, len(actions[action])) for action in actions.keys()])
+        if( all([len(vm_names) == 0 for vm_names in actions.values()]) ):
+            self.logger.info('Virtual machines of %s are already converged with vCenter %s' % (self.base_vmname, self.vc_name))
+            return (0, actions)
+        self.logger.info('Reconcile actions for vCenter %s: %s' % (self.vc_name, summary))
+        for action in actions.keys():
+            if( len(actions[action]) > 0 ):
+                self.logger.info('Reconcile %s: %s' % (action, ', '.join(actions[action])))
+        if(plan_only == True):
+            return (0, actions)
+
+        # the existing virtual machines are used as they are read, without looking them up again
+        for vm_name in self.vm_list:
+            if vm_name in states:
+                self.known_vms[vm_name] = states[vm_name][0]
+
+        if( len(actions['create']) > 0 ):
+            all_records = self.records
+            self.records = vm_records(actions['create'], [static_ips[vm_name] for vm_name in actions['create']] if self.static_ip else None)
+            rc = self.deploy_vm(check_existing = False) or rc
+            self.records = all_records
+            if(self.abort_reason != None):    # an aborted run does not go on with the other actions
+                return (1, actions)
+
+        if( len(actions['network']) > 0 ):
+            self.network_obj = network_type(network_moid, self.conn_obj._stub)
+            task_msg = 'Virtual machine network update to %s' % self.network
+            rc = self.run_task_window(actions['network'], self._submit_network_update, task_msg, 'reconfigure', 1800)[0] or rc
+
+        if( len(actions['snapshot']) > 0 ):
+            selected = dict([(vm_name, states[vm_name]) for vm_name in actions['snapshot']])
+            rc = self.batch_snapshot(selected, self.snapshot_name, memory = True)[0] or rc
+
+        if( len(actions['power']) > 0 ):
+            selected = dict([(vm_name, states[vm_name]) for vm_name in actions['power']])
+            rc = self.batch_power(selected, self.power_on)[0] or rc
+
+        if( len(actions['delete']) > 0 ):
+            selected = dict([(vm_name, states[vm_name]) for vm_name in actions['delete']])
+            rc = self.batch_delete(selected)[0] or rc
+
+        return (rc, actions)
+
+
+    # get virtual machines' IP addresses from vCenter. If the inventory snapshot file is provided,
+    # the IP addresses are read from the snapshot without connecting to vCenter.
+    #
+    def get_vm_ip(self, vm_list = [], inventory_file = None):
+        ipaddress_list = []
 
         if( len(vm_list) > 0 ):
             self.vm_list = []
             self.vm_list = copy.deepcopy(vm_list)
 
+        if(inventory_file != None):
+            return query_vm_ip(inventory_file, self.vm_list, self.logger)
+
+        rc = self.connect_vc()
+        if(rc == 1):
+            self.logger.info('Error connecting to vCenter %s' % self.vc_name)
+            return ipaddress_list
+
         for vm_name in self.vm_list:
             tmp_vm = self.locate_obj(vm_name, [vim.VirtualMachine])
             if not tmp_vm:
@@ -1002,3 +2173,57 @@ class vms:
 
         return ipaddress_list 
 
+
+    # dump all the virtual machines' name, power state, IP addresses, ESXi host, datastores and
+    # folder into the inventory snapshot file in one bulk property retrieval. If watch is larger
+    # than 0, the property collector filter is kept and the snapshot is refreshed incrementally
+    # from the saved property collector version until the script is stopped. The property
+    # collector version is only valid in the vCenter session that creates it, so every new run
+    # starts with a full dump.
+    #
+    def dump_inventory(self, inventory_file, watch = 0):
+        rc = self.connect_vc()
+        if(rc == 1):
+            self.logger.info('Error connecting to vCenter %s' % self.vc_name)
+            return rc
+
+        content = self.conn_content
+        property_collector = content.propertyCollector
+        obj_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine, vim.HostSystem, vim.Datastore, vim.Folder], True)
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name='traverseEntities', path='view', skip=False, type=vim.view.ContainerView)
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=obj_view, skip=True, selectSet=[traversal_spec])
+        prop_specs = [vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=list(VM_PROPS.keys()), all=False)]
+        for vimtype in [vim.HostSystem, vim.Datastore, vim.Folder]:
+            prop_specs.append(vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=['name'], all=False))
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+        pcfilter = property_collector.CreateFilter(filter_spec, True)
+
+        store = inventory_store(inventory_file)
+        store.reset(self.vc_name)
+        version = None
+        try:
+            while True:
+                wait_options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=(watch if version else 0))
+                update = property_collector.WaitForUpdatesEx(version, wait_options)
+                while update:
+                    store.apply_update(update.filterSet)
+                    version = update.version
+                    if not update.truncated:
+                        break
+                    update = property_collector.WaitForUpdatesEx(version, wait_options)
+                store.commit(version)
+                self.logger.info('Inventory snapshot %s is updated to property collector version %s' % (inventory_file, version))
+
+                if(watch <= 0):
+                    break
+        except KeyboardInterrupt:
+            self.logger.info('Stop refreshing inventory snapshot %s' % inventory_file)
+        except Exception as exp:
+            self.logger.warning('Having problem while dumping inventory snapshot %s. Exception: %s' % (inventory_file, exp))
+            rc = 1
+        finally:
+            store.close()
+            pcfilter.Destroy()
+            obj_view.Destroy()
+        return rc
+